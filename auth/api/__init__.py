@@ -3,7 +3,7 @@ from http import HTTPStatus
 from flask_restx import Api
 
 from core.exceptions import (AuthError, AuthorizationError, BadRequestError,
-                             EmailUsedError, NotFound)
+                             EmailUsedError, NotFound, ServiceUnavailableError)
 
 api = Api(title="Auth")
 
@@ -31,3 +31,12 @@ def handle_authorization_error(error):
 @api.errorhandler(BadRequestError)
 def handle_bad_request_error(error):
     return {"message": f"{error!s}"}, HTTPStatus.BAD_REQUEST
+
+
+@api.errorhandler(ServiceUnavailableError)
+def handle_service_unavailable_error(error):
+    return (
+        {"message": f"{error!s}"},
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        {"Retry-After": "1"},
+    )
@@ -85,16 +85,30 @@ class LogoutView(Resource):
     @ns.response(200, "Successfully logout")
     def post(self):
         """Logout user"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
         user_agent = request.headers.get("User-Agent")
         self.services.user_history.insert_entry(
-            user_id=user_data.user_id, action="logout", user_agent=user_agent
+            user_id=g.access_token.user_id, action="logout", user_agent=user_agent
         )
         self.services.token_service.remove_tokens(g.access_token)
         return "Successfully logout"
 
 
+@ns.route("/logout_all/")
+@ns.doc(security="api_key")
+class LogoutAllView(Resource):
+    @login_required
+    @ns.response(401, description="Unauthorized")
+    @ns.response(200, "Successfully logout from all devices")
+    def post(self):
+        """Logout user from all devices"""
+        user_agent = request.headers.get("User-Agent")
+        self.services.user_history.insert_entry(
+            user_id=g.access_token.user_id, action="logout", user_agent=user_agent
+        )
+        self.services.token_service.remove_all_tokens(g.access_token.user_id)
+        return "Successfully logout from all devices"
+
+
 @ns.route("/refresh/")
 class RefreshTokensView(Resource):
     @ns.expect(RefreshTokenModel, validate=True)
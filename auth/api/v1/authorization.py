@@ -2,15 +2,22 @@ from uuid import UUID
 
 from flask_restx import Namespace
 
-from api.v1.models.authorization import ResponseGetUserRoles, RoleModel
-from core.api import Resource, is_superuser, login_required
+from api.v1.models.authorization import (ResponseGetUserRoles,
+                                         RoleChangesModel,
+                                         RoleChangesResponseModel, RoleModel)
+from core.api import Resource, is_superuser, login_required, service_required
 
 authorizations = {
     "api_key": {
         "type": "apiKey",
         "in": "Header",
         "name": "TOKEN",
-    }
+    },
+    "service_token": {
+        "type": "apiKey",
+        "in": "Header",
+        "name": "X-Service-Token",
+    },
 }
 ns = Namespace(
     "Authorization Namespace", authorizations=authorizations, security="api_key"
@@ -71,3 +78,23 @@ class ChangeUserRole(Resource):
         ):
             return {"message": "Successfully delete role from user"}, 204
         return {"message": "The user does not have this role"}, 400
+
+
+@ns.route("/user_roles/batch/")
+@ns.doc(security="service_token")
+@ns.response(401, description="Unauthorized")
+@ns.response(403, description="Forbidden, you don't have permission to access")
+class ChangeUserRolesBatch(Resource):
+    @service_required
+    @ns.expect(RoleChangesModel, validate=True)
+    @ns.response(400, description="Unknown roles in request")
+    @ns.marshal_with(
+        RoleChangesResponseModel, code=200, description="Successfully changed roles"
+    )
+    def post(self):
+        """
+        Grant and revoke roles in batch, the last operation for a user/role pair wins
+        """
+        return self.services.authorization_service.apply_role_changes(
+            self.api.payload["changes"]
+        )
@@ -29,13 +29,8 @@ class CaptchaPayloadView(Resource):
         """
         Get captcha challenge payload
         """
-        captcha_challenge = self.services.captcha.get(id)
-        b = BytesIO()
-        b.write(captcha_challenge.payload)
-        b.seek(0)
-
         return send_file(
-            b,
+            BytesIO(self.services.captcha.get(id)),
             attachment_filename="challenge.png",
             cache_timeout=0,
         )
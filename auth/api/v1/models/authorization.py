@@ -13,3 +13,26 @@ RoleModel = api.model(
         "role_title": fields.String(required=True),
     },
 )
+
+RoleChangeModel = api.model(
+    "RoleChangeModel",
+    {
+        "user_id": fields.String(required=True, as_uuid=True),
+        "role_title": fields.String(required=True),
+        "op": fields.String(required=True, enum=["grant", "revoke"]),
+    },
+)
+
+RoleChangesModel = api.model(
+    "RoleChangesModel",
+    {"changes": fields.List(fields.Nested(RoleChangeModel), required=True)},
+)
+
+RoleChangesResponseModel = api.model(
+    "RoleChangesResponseModel",
+    {
+        "granted": fields.Integer(),
+        "revoked": fields.Integer(),
+        "missing_users": fields.List(fields.String()),
+    },
+)
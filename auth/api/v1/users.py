@@ -1,11 +1,11 @@
 import datetime
 
-from flask import request
-from flask_restx import Namespace
+from flask import g
+from flask_restx import Namespace, inputs
 
 from api.v1.models.history import History
 from api.v1.models.users import ChangePassword, UserModel
-from core.api import Resource, login_required
+from core.api import Resource, get_current_user, login_required
 
 authorizations = {
     "api_key": {
@@ -16,6 +16,25 @@ authorizations = {
 }
 ns = Namespace("Profile Namespace", authorizations=authorizations, security="api_key")
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+
+def history_page_size(value) -> int:
+    value = int(value)
+    if not 1 <= value <= HISTORY_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
+    return value
+
+
+history_parser = ns.parser()
+history_parser.add_argument(
+    "limit", type=history_page_size, default=HISTORY_PAGE_SIZE, location="args"
+)
+history_parser.add_argument("cursor", type=str, location="args")
+history_parser.add_argument("since", type=inputs.datetime_from_iso8601, location="args")
+history_parser.add_argument("until", type=inputs.datetime_from_iso8601, location="args")
+
 
 @ns.route("/")
 @ns.doc(security="api_key")
@@ -26,9 +45,7 @@ class UserProfile(Resource):
     @ns.marshal_with(UserModel, code=200, description="Successful getting profile")
     def get(self):
         """Getting profile user by id"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
-        user = self.services.user.get(user_data.user_id)
+        user = get_current_user()
         if not user:
             return {"message": "User not found"}, 404
         return user, 200
@@ -39,8 +56,7 @@ class UserProfile(Resource):
     @ns.response(409, description="This email address is already in use")
     def put(self):
         """Change profile user by id"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
+        user_data = g.access_token
         updated_user = self.services.user.put(user_data.user_id, **self.api.payload)
         if "birthdate" in self.api.payload:
             if (
@@ -61,9 +77,9 @@ class UserProfile(Resource):
     @ns.response(204, description="Successfully deleted user profile")
     def delete(self):
         """Delete profile user"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
+        user_data = g.access_token
         if self.services.user.delete(user_data.user_id):
+            self.services.token_service.remove_all_tokens(user_data.user_id)
             return {"message": "Successfully deleted user profile"}, 204
         return {"message": "User not found"}, 404
 
@@ -73,15 +89,23 @@ class UserProfile(Resource):
 @ns.route("/history/")
 class UserHistory(Resource):
     @login_required
+    @ns.expect(history_parser)
     @ns.response(401, description="Unauthorized")
     @ns.marshal_with(
         History, as_list=True, code=200, description="Successful getting history"
     )
     def get(self):
-        """Getting the user's login history"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
-        return self.services.user_history.get_history(user_data.user_id)
+        """Getting the user's login history page, next page cursor is in X-Next-Cursor header"""
+        args = history_parser.parse_args()
+        history, next_cursor = self.services.user_history.get_history(
+            g.access_token.user_id,
+            limit=args["limit"],
+            cursor=args["cursor"],
+            since=args["since"],
+            until=args["until"],
+        )
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return history, 200, headers
 
 
 @ns.response(404, description="User not found")
@@ -95,11 +119,11 @@ class ChangePassword(Resource):
     @ns.expect(ChangePassword, validate=True)
     def patch(self):
         """Change user password"""
-        token = request.headers.get("TOKEN")
-        user_data = self.services.token_service.decode_access_token(token)
+        user_data = g.access_token
         old_password = self.api.payload.get("old_password")
         new_password = self.api.payload.get("new_password")
         self.services.user.change_password(
             user_data.user_id, old_password, new_password
         )
+        self.services.token_service.remove_all_tokens(user_data.user_id)
         return {"message": "Successful change password"}, 200
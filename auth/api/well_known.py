@@ -0,0 +1,19 @@
+from flask_restx import Namespace
+
+from core.api import Resource
+
+ns = Namespace("Well-known Namespace")
+
+JWKS_MAX_AGE = 300
+
+
+@ns.route("/jwks.json")
+class JWKSView(Resource):
+    @ns.response(200, description="Public keys for access token verification")
+    def get(self):
+        """Get public keys for access token verification"""
+        return (
+            self.services.token_service.keyring.jwks(),
+            200,
+            {"Cache-Control": f"public, max-age={JWKS_MAX_AGE}"},
+        )
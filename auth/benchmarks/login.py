@@ -0,0 +1,67 @@
+"""
+Нагрузочный тест входа через HTTP: gunicorn, flask, база, redis и пул хеширования паролей.
+
+Запуск из каталога auth при запущенном сервисе auth:
+    python -m benchmarks.login --url http://127.0.0.1:8001 --requests 400 --concurrency 32
+
+Печатает число успешных входов в секунду, число отказов 503 (очередь хеширования
+переполнена) и задержки ответов.
+"""
+import argparse
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark-password"
+
+
+def login(session: requests.Session, url: str):
+    started = time.perf_counter()
+    response = session.post(
+        f"{url}/api/v1/auth/login/", json={"email": EMAIL, "password": PASSWORD}
+    )
+    return response.status_code, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    # Пользователь для входа, 409 - уже создан прошлым запуском
+    response = requests.post(
+        f"{args.url}/api/v1/auth/signup/", json={"email": EMAIL, "password": PASSWORD}
+    )
+    if response.status_code not in (201, 409):
+        response.raise_for_status()
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as threads:
+        started = time.perf_counter()
+        results = list(
+            threads.map(lambda _: login(session, args.url), range(args.requests))
+        )
+        elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for status, latency in results if status == 200)
+    print(f"{statuses[200] / elapsed:8.1f} logins/s, statuses {dict(statuses)}")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"latency p50 {statistics.median(latencies) * 1000:.0f} ms, "
+            f"p99 {p99 * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Нагрузочный тест проверки паролей при входе.
+
+Запуск из каталога auth:
+    python -m benchmarks.password_hashing --requests 400 --concurrency 32
+
+Для каждого размера пула (1, 2, 4, ... до числа ядер) печатает число проверок в секунду.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.passwords import PasswordHasher, build_context
+
+
+def run(hasher: PasswordHasher, password_hash: str, requests: int, concurrency: int):
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        started = time.perf_counter()
+        results = list(
+            threads.map(
+                lambda _: hasher.verify_and_update("password", password_hash),
+                range(requests),
+            )
+        )
+        elapsed = time.perf_counter() - started
+    assert all(valid for valid, _ in results)
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--schemes", default="pbkdf2_sha256")
+    parser.add_argument("--pbkdf2-rounds", type=int, default=29000)
+    parser.add_argument("--argon2-memory-cost", type=int, default=65536)
+    args = parser.parse_args()
+
+    schemes = args.schemes.split(",")
+    context_args = dict(
+        schemes=schemes,
+        pbkdf2_rounds=args.pbkdf2_rounds,
+        argon2_memory_cost=args.argon2_memory_cost,
+    )
+    password_hash = build_context(**context_args).hash("password")
+
+    workers = 1
+    while True:
+        hasher = PasswordHasher(
+            **context_args,
+            workers=workers,
+            max_pending=args.concurrency,
+            queue_timeout=60,
+        )
+        hasher.verify_and_update("password", password_hash)  # запуск пула
+        rate = run(hasher, password_hash, args.requests, args.concurrency)
+        print(f"workers={workers:<3} {rate:8.1f} logins/s")
+        hasher.shutdown()
+
+        if workers >= os.cpu_count():
+            break
+        workers = min(workers * 2, os.cpu_count())
+
+
+if __name__ == "__main__":
+    main()
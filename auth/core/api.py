@@ -1,31 +1,51 @@
+import hmac
 from functools import wraps
+from typing import Optional
 
-from flask import g, request
+from flask import current_app, g, request
 from flask_restx import Resource as RestResource
 
-from core.db import session
+from core.db import User, session
 from core.exceptions import AuthError, AuthorizationError, BadRequestError
 from services import services
+from services.auth import AccessToken
 
 
-def get_current_user():
-    token = request.headers.get("TOKEN")
-    if not token:
-        return None
+def get_access_token() -> Optional[AccessToken]:
+    """Access токен текущего запроса, декодируется один раз за запрос"""
+    if "access_token" not in g:
+        token = request.headers.get("TOKEN")
+        g.access_token = (
+            services.token_service.decode_access_token(token) if token else None
+        )
+    return g.access_token
 
-    user_data = services.token_service.decode_access_token(token)
-    return services.user.get(user_data.user_id)
+
+def get_current_user() -> Optional[User]:
+    """Пользователь текущего запроса, загружается из базы при первом обращении"""
+    if "current_user" not in g:
+        access_token = get_access_token()
+        g.current_user = (
+            services.user.get(access_token.user_id) if access_token else None
+        )
+    return g.current_user
+
+
+def get_current_roles_permissions() -> dict:
+    """Роли и права пользователя текущего запроса"""
+    if "roles_permissions" not in g:
+        g.roles_permissions = services.authorization_service.get_user_roles_permissions(
+            user_id=get_access_token().user_id
+        )
+    return g.roles_permissions
 
 
 def login_required(func):
     @wraps(func)
     def decorated_view(*args, **kwargs):
-        token = request.headers.get("TOKEN")
-        if not token:
+        if not get_access_token():
             raise AuthError("Access token required")
 
-        g.access_token = services.token_service.decode_access_token(token)
-
         return func(*args, **kwargs)
 
     return decorated_view
@@ -35,18 +55,10 @@ def is_authorized(permission_name):
     def func_wrapper(func):
         @wraps(func)
         def decorator_view(*args, **kwargs):
-            token = request.headers.get("TOKEN")
-            if not token:
+            if not get_access_token():
                 raise AuthError("Access token required")
 
-            access_token = services.token_service.decode_access_token(token)
-            user_roles_permissions = (
-                services.authorization_service.get_user_roles_permissions(
-                    user_id=access_token.user_id
-                )
-            )
-
-            if permission_name in user_roles_permissions["user_permissions"]:
+            if permission_name in get_current_roles_permissions()["user_permissions"]:
                 return func(*args, **kwargs)
 
             raise AuthorizationError("Forbidden, you don't have permission to access")
@@ -59,17 +71,29 @@ def is_authorized(permission_name):
 def is_superuser(func):
     @wraps(func)
     def decorator_view(*args, **kwargs):
-        token = request.headers.get("TOKEN")
-        if not token:
+        if not get_access_token():
             raise AuthError("Access token required")
 
-        access_token = services.token_service.decode_access_token(token)
-        user_roles_permissions = (
-            services.authorization_service.get_user_roles_permissions(
-                user_id=access_token.user_id
-            )
-        )
-        if "superuser" in user_roles_permissions["user_roles"]:
+        if "superuser" in get_current_roles_permissions()["user_roles"]:
+            return func(*args, **kwargs)
+
+        raise AuthorizationError("Forbidden, you don't have permission to access")
+
+    return decorator_view
+
+
+def service_required(func):
+    """Доступ только для сервисов с общим секретом SERVICE_TOKEN"""
+
+    @wraps(func)
+    def decorator_view(*args, **kwargs):
+        token = request.headers.get("X-Service-Token")
+        if not token:
+            raise AuthError("Service token required")
+
+        if hmac.compare_digest(
+            token.encode(), current_app.config["SERVICE_TOKEN"].encode()
+        ):
             return func(*args, **kwargs)
 
         raise AuthorizationError("Forbidden, you don't have permission to access")
@@ -1,8 +1,8 @@
 import uuid
 
-from sqlalchemy import (Column, Date, DateTime, ForeignKey, LargeBinary,
+from sqlalchemy import (Column, Date, DateTime, ForeignKey, Index, LargeBinary,
                         PrimaryKeyConstraint, String, UniqueConstraint,
-                        create_engine)
+                        create_engine, text)
 from sqlalchemy.dialects.postgresql import ENUM, UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref, relationship, scoped_session, sessionmaker
@@ -10,6 +10,7 @@ from sqlalchemy.orm import backref, relationship, scoped_session, sessionmaker
 from core.enums import Action, DeviceType, OAuthProvider
 from core.insert_data import (insert_permissions, insert_user_role_permissions,
                               insert_user_roles)
+from core.partitions import create_device_partitions
 
 session = scoped_session(sessionmaker(autocommit=False, autoflush=False))
 
@@ -52,7 +53,9 @@ class RefreshToken(Base):
     )
     user_id = Column(UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"))
     token = Column(String, index=True, nullable=False)
-    access_token = Column(String, index=True, nullable=False)
+    # jti или sha256 токенов, выпущенных до появления jti (см. services/auth.py)
+    access_token_jti = Column(String(64), index=True, nullable=False)
+    access_token_exp = Column(DateTime, nullable=False)
     exp = Column(DateTime, nullable=False)
 
 
@@ -76,18 +79,7 @@ class OAuthAccount(Base):
 
 
 def create_partition(target, connection, **kw) -> None:
-    connection.execute(
-        """CREATE TABLE IF NOT EXISTS "history_at_pc" PARTITION OF "history" FOR VALUES IN ('pc')"""
-    )
-    connection.execute(
-        """CREATE TABLE IF NOT EXISTS "history_at_mobile" PARTITION OF "history" FOR VALUES IN ('mobile')"""
-    )
-    connection.execute(
-        """CREATE TABLE IF NOT EXISTS "history_at_tablet" PARTITION OF "history" FOR VALUES IN ('tablet')"""
-    )
-    connection.execute(
-        """CREATE TABLE IF NOT EXISTS "history_at_undefined" PARTITION OF "history" FOR VALUES IN ('undefined')"""
-    )
+    create_device_partitions(connection)
 
 
 class History(Base):
@@ -104,9 +96,10 @@ class History(Base):
     user_agent = Column(String, nullable=False)
     device_type = Column(ENUM(DeviceType), nullable=False)
 
+    # Ключ партиционирования входит в первичный ключ: device_type и месяц по datetime
     __table_args__ = (
-        PrimaryKeyConstraint(id, device_type),
-        UniqueConstraint(id, device_type),
+        PrimaryKeyConstraint(id, device_type, datetime),
+        Index("history_user_id_datetime_idx", user_id, datetime, id),
         {
             "postgresql_partition_by": "LIST (device_type)",
             "listeners": [("after_create", create_partition)],
@@ -197,6 +190,8 @@ class UserRole(Base):
 
 
 class CaptchaChallenge(Base):
+    """Капчи, которые хранились в базе до переноса в redis (см. services/captcha.py)"""
+
     __tablename__ = "captcha"
 
     id = Column(
@@ -211,8 +206,114 @@ class CaptchaChallenge(Base):
     hash_key = Column(String, nullable=False, index=True)
 
 
+# Уведомление процессов auth об изменении ролей и прав (см. core/permissions.py)
+ROLE_PERMISSIONS_TRIGGERS = """
+CREATE OR REPLACE FUNCTION notify_role_permissions() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('role_permissions', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS role_notify ON role;
+CREATE TRIGGER role_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON role
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_role_permissions();
+
+DROP TRIGGER IF EXISTS permission_notify ON permission;
+CREATE TRIGGER permission_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON permission
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_role_permissions();
+
+DROP TRIGGER IF EXISTS role_permission_notify ON role_permission;
+CREATE TRIGGER role_permission_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON role_permission
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_role_permissions();
+"""
+
+
+# Ключ advisory lock для установки триггеров: воркеры стартуют одновременно
+TRIGGERS_LOCK_KEY = 7_310_009
+ROLE_PERMISSIONS_TRIGGER_NAMES = (
+    "role_notify",
+    "permission_notify",
+    "role_permission_notify",
+)
+
+
+def install_role_permissions_triggers(engine) -> None:
+    """
+    Установка триггеров уведомлений, если их ещё нет.
+    DDL выполняет только первый воркер под advisory lock, остальные видят готовые триггеры
+    и не берут блокировки на таблицы ролей
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), key=TRIGGERS_LOCK_KEY
+        )
+        installed = connection.execute(
+            text(
+                "SELECT count(*) FROM pg_trigger "
+                "WHERE NOT tgisinternal AND tgname = ANY(:names)"
+            ),
+            names=list(ROLE_PERMISSIONS_TRIGGER_NAMES),
+        ).scalar()
+        if installed < len(ROLE_PERMISSIONS_TRIGGER_NAMES):
+            connection.execute(text(ROLE_PERMISSIONS_TRIGGERS))
+
+
+# Ключ advisory lock для перевода refresh_token на jti access токена
+REFRESH_TOKENS_LOCK_KEY = 7_310_007
+
+
+def migrate_refresh_tokens(engine) -> None:
+    """
+    Перевод таблицы refresh_token, созданной до появления jti, на новые колонки.
+    Вместо access токена хранится его sha256, срок действия старых access токенов -
+    не больше часа от момента миграции. Выполняется один раз под advisory lock
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), key=REFRESH_TOKENS_LOCK_KEY
+        )
+        columns = dict(
+            connection.execute(
+                text(
+                    "SELECT column_name, character_maximum_length "
+                    "FROM information_schema.columns WHERE table_name = 'refresh_token'"
+                )
+            ).fetchall()
+        )
+        if "access_token" not in columns and columns.get("access_token_jti") == 64:
+            return
+        connection.execute(
+            "ALTER TABLE refresh_token "
+            "ADD COLUMN IF NOT EXISTS access_token_jti varchar(64), "
+            "ADD COLUMN IF NOT EXISTS access_token_exp timestamp, "
+            "ALTER COLUMN access_token_jti TYPE varchar(64)"
+        )
+        if "access_token" in columns:
+            connection.execute(
+                """
+                UPDATE refresh_token
+                SET access_token_jti = encode(sha256(convert_to(access_token, 'UTF8')), 'hex'),
+                    access_token_exp = (now() AT TIME ZONE 'UTC') + interval '1 hour'
+                WHERE access_token_jti IS NULL
+                """
+            )
+            connection.execute("ALTER TABLE refresh_token DROP COLUMN access_token")
+        connection.execute(
+            "ALTER TABLE refresh_token "
+            "ALTER COLUMN access_token_jti SET NOT NULL, "
+            "ALTER COLUMN access_token_exp SET NOT NULL"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_refresh_token_access_token_jti "
+            "ON refresh_token (access_token_jti)"
+        )
+
+
 def init_session(dsn):
     engine = create_engine(dsn)
     session.configure(bind=engine)
     Base.metadata.create_all(engine)
+    migrate_refresh_tokens(engine)
+    install_role_permissions_triggers(engine)
     return session
@@ -16,3 +16,7 @@ class EmailUsedError(Exception):
 
 class AuthorizationError(Exception):
     pass
+
+
+class ServiceUnavailableError(Exception):
+    pass
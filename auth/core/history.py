@@ -0,0 +1,114 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import uuid
+from functools import lru_cache
+from typing import List, Optional
+
+import user_agents
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from core.db import History
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1024)
+def parse_device_type(user_agent: str) -> str:
+    """Тип устройства по User-Agent"""
+    parsed = user_agents.parse(user_agent)
+    if parsed.is_pc:
+        return "pc"
+    if parsed.is_mobile:
+        return "mobile"
+    if parsed.is_tablet:
+        return "tablet"
+    return "undefined"
+
+
+class HistoryWriter:
+    """
+    Запись истории входов вне запроса.
+
+    Записи копятся в ограниченной очереди, фоновый поток вставляет их в history
+    одним многострочным INSERT на пачку. При переполнении очереди запись отбрасывается:
+    история не должна замедлять вход пользователя.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def put(self, entry: dict) -> None:
+        """Добавление записи в очередь на вставку"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait({"id": uuid.uuid4(), **entry})
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("History queue is full, %s entries dropped", self.dropped)
+
+    def flush(self) -> None:
+        """Вставка всего, что накопилось в очереди"""
+        with self._lock:
+            while True:
+                batch = self._take(block=False)
+                if not batch:
+                    return
+                self._insert(batch)
+
+    def _ensure_started(self) -> None:
+        # Поток запускается в каждом процессе отдельно (воркеры gunicorn создаются через fork)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name="history", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take(block=True)
+            if batch:
+                with self._lock:
+                    self._insert(batch)
+
+    def _take(self, block: bool) -> List[dict]:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _insert(self, batch: List[dict]) -> None:
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(History.__table__.insert().values(batch))
+        except IntegrityError:
+            # Пользователь мог быть удалён, пока запись ждала в очереди:
+            # вставляем по одной, пропуская такие записи
+            for entry in batch:
+                try:
+                    with self.engine.begin() as connection:
+                        connection.execute(History.__table__.insert().values(entry))
+                except IntegrityError as exc:
+                    logger.warning("History entry is skipped: %s", exc.orig)
+        except Exception as exc:
+            logger.exception("Failed to write %s history entries: %s", len(batch), exc)
@@ -0,0 +1,128 @@
+import fcntl
+import json
+import os
+import secrets
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from jwt.algorithms import Ed25519Algorithm, RSAAlgorithm
+
+
+def key_algorithm(private_key) -> str:
+    """Алгоритм подписи по типу ключа"""
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return "RS256"
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return "EdDSA"
+    raise ValueError(f"Unsupported signing key type {type(private_key).__name__}")
+
+
+@contextmanager
+def _locked(keys_dir: str):
+    # Блокировка каталога ключей между процессами: воркеры gunicorn при первом
+    # запуске и команда ротации не должны создать ключ одновременно
+    Path(keys_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(keys_dir) / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def generate_key(keys_dir: str, algorithm: str) -> str:
+    """
+    Генерация нового ключа подписи в каталоге ключей.
+    Имя файла (без .pem) становится kid ключа.
+    """
+    with _locked(keys_dir):
+        return _write_key(keys_dir, algorithm)
+
+
+def _write_key(keys_dir: str, algorithm: str) -> str:
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise ValueError(f"Unsupported signing algorithm {algorithm}")
+
+    kid = f"{datetime.now(tz=timezone.utc):%Y%m%d%H%M%S}-{secrets.token_hex(4)}"
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    fd = os.open(
+        Path(keys_dir) / f"{kid}.pem", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+    )
+    with os.fdopen(fd, "wb") as key_file:
+        key_file.write(pem)
+    return kid
+
+
+class KeyRing:
+    """
+    Набор ключей подписи access токенов.
+
+    Каждый *.pem в каталоге - приватный ключ, kid - имя файла.
+    Подписывает ключ jwt_signing_kid (или самый новый), проверяются токены всеми ключами,
+    поэтому для ротации новый ключ добавляется в каталог, а старый удаляется,
+    когда истекут все подписанные им токены.
+    """
+
+    def __init__(
+        self, keys_dir: str, algorithm: str, signing_kid: Optional[str] = None
+    ):
+        self.keys_dir = keys_dir
+        self.private_keys: Dict[str, object] = {}
+        # Первый запущенный воркер создаёт ключ, остальные ждут и читают его
+        with _locked(keys_dir):
+            if not list(Path(keys_dir).glob("*.pem")):
+                _write_key(keys_dir, algorithm)
+            paths = sorted(
+                Path(keys_dir).glob("*.pem"), key=lambda path: path.stat().st_mtime
+            )
+            for path in paths:
+                self.private_keys[path.stem] = serialization.load_pem_private_key(
+                    path.read_bytes(), password=None
+                )
+        self.signing_kid = signing_kid or paths[-1].stem
+        if self.signing_kid not in self.private_keys:
+            raise ValueError(f"Signing key {self.signing_kid} not found in {keys_dir}")
+
+        self.public_keys = {
+            kid: private_key.public_key()
+            for kid, private_key in self.private_keys.items()
+        }
+        self.algorithms = {
+            kid: key_algorithm(private_key)
+            for kid, private_key in self.private_keys.items()
+        }
+
+    def signing_key(self) -> Tuple[str, str, object]:
+        """kid, алгоритм и приватный ключ для подписи новых токенов"""
+        return (
+            self.signing_kid,
+            self.algorithms[self.signing_kid],
+            self.private_keys[self.signing_kid],
+        )
+
+    def verification_key(self, kid: str) -> Optional[Tuple[str, object]]:
+        """Алгоритм и публичный ключ для проверки токена с заданным kid"""
+        if kid not in self.public_keys:
+            return None
+        return self.algorithms[kid], self.public_keys[kid]
+
+    def jwks(self) -> dict:
+        """Публичные ключи в формате JWKS"""
+        keys = []
+        for kid, public_key in self.public_keys.items():
+            algorithm = self.algorithms[kid]
+            if algorithm == "RS256":
+                jwk = json.loads(RSAAlgorithm.to_jwk(public_key))
+            else:
+                jwk = json.loads(Ed25519Algorithm.to_jwk(public_key))
+            keys.append({**jwk, "kid": kid, "alg": algorithm, "use": "sig"})
+        return {"keys": keys}
@@ -0,0 +1,189 @@
+import logging
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from core.enums import DeviceType
+
+logger = logging.getLogger(__name__)
+
+# Партиции history: по типу устройства (history_at_pc, ...), внутри - по месяцам
+# (history_at_pc_y2021m09, ...) и партиция по умолчанию на случай, если месяц не создан
+MONTH_PARTITION = "history_at_{device_type}_y{year:04d}m{month:02d}"
+MONTH_PARTITION_RE = re.compile(r"^history_at_(\w+)_y(\d{4})m(\d{2})$")
+# Ключ advisory lock: партиции создаёт только один процесс одновременно
+PARTITIONS_LOCK_KEY = 7_310_015
+
+
+def add_months(day: date, months: int) -> date:
+    """Первое число месяца, отстоящего от day на months месяцев"""
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def create_device_partitions(connection: Connection) -> None:
+    """Партиции по типу устройства, каждая разбита на месячные партиции"""
+    for device_type in DeviceType:
+        connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS "history_at_{device_type.value}" PARTITION OF "history" """
+            f"""FOR VALUES IN ('{device_type.value}') PARTITION BY RANGE (datetime)"""
+        )
+        connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS "history_at_{device_type.value}_default" """
+            f"""PARTITION OF "history_at_{device_type.value}" DEFAULT"""
+        )
+
+
+def ensure_month_partitions(
+    engine: Engine, months_ahead: int = 2, since: Optional[date] = None
+) -> List[str]:
+    """
+    Создание месячных партиций с месяца since (по умолчанию текущего)
+    на months_ahead месяцев вперёд от текущего.
+
+    Строки месяца, которые уже попали в партицию по умолчанию, переносятся
+    в созданную партицию, иначе postgres не даст её подключить. Запуски из разных
+    процессов выполняются по очереди под advisory lock
+    """
+    created = []
+    last = add_months(date.today(), months_ahead)
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), key=PARTITIONS_LOCK_KEY
+        )
+        end = add_months(since or date.today(), 0)
+        while end <= last:
+            start, end = end, add_months(end, 1)
+            for device_type in DeviceType:
+                name = MONTH_PARTITION.format(
+                    device_type=device_type.value, year=start.year, month=start.month
+                )
+                if connection.execute(
+                    text("SELECT to_regclass(:name)"), name=name
+                ).scalar():
+                    continue
+                parent = f"history_at_{device_type.value}"
+                connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" '
+                    f'(LIKE "{parent}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                )
+                moved = connection.execute(
+                    f"""
+                    WITH moved AS (
+                        DELETE FROM "{parent}_default"
+                        WHERE datetime >= '{start}' AND datetime < '{end}'
+                        RETURNING *
+                    )
+                    INSERT INTO "{name}" SELECT * FROM moved
+                    """
+                ).rowcount
+                connection.execute(
+                    f'ALTER TABLE "{parent}" ATTACH PARTITION "{name}" '
+                    f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                )
+                if moved:
+                    logger.info(
+                        "Moved %s rows from the default partition to %s", moved, name
+                    )
+                created.append(name)
+    if created:
+        logger.info("Created history partitions: %s", ", ".join(created))
+    return created
+
+
+def retire_month_partitions(engine: Engine, retention_months: int) -> List[str]:
+    """Отключение и удаление месячных партиций старше retention_months месяцев"""
+    oldest = add_months(date.today(), -retention_months)
+    retired = []
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), key=PARTITIONS_LOCK_KEY
+        )
+        partitions = connection.execute(
+            text(
+                """
+                SELECT child.relname, parent.relname
+                FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                WHERE parent.relname LIKE 'history_at_%'
+                """
+            )
+        ).fetchall()
+        for name, parent in partitions:
+            match = MONTH_PARTITION_RE.match(name)
+            if not match:
+                continue
+            if date(int(match.group(2)), int(match.group(3)), 1) >= oldest:
+                continue
+            connection.execute(f'ALTER TABLE "{parent}" DETACH PARTITION "{name}"')
+            connection.execute(f'DROP TABLE "{name}"')
+            retired.append(name)
+    if retired:
+        logger.info("Retired history partitions: %s", ", ".join(retired))
+    return retired
+
+
+def migrate_history_table(engine: Engine) -> bool:
+    """
+    Перевод таблицы history, созданной до помесячных партиций, на новую схему.
+
+    Раньше партиции по типу устройства были обычными таблицами, а первичный ключ -
+    (id, device_type). Старые партиции отключаются, history получает первичный ключ
+    (id, device_type, datetime), строки переносятся в новые партиции и раскладываются
+    по месяцам. Для таблицы в новой схеме ничего не делает
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), key=PARTITIONS_LOCK_KEY
+        )
+        legacy = [
+            device_type.value
+            for device_type in DeviceType
+            if connection.execute(
+                text("SELECT relkind FROM pg_class WHERE relname = :name"),
+                name=f"history_at_{device_type.value}",
+            ).scalar()
+            == "r"
+        ]
+        if not legacy:
+            return False
+        for device_type in legacy:
+            connection.execute(
+                f'ALTER TABLE "history" DETACH PARTITION "history_at_{device_type}"'
+            )
+            connection.execute(
+                f'ALTER TABLE "history_at_{device_type}" '
+                f'RENAME TO "history_at_{device_type}_legacy"'
+            )
+        connection.execute(
+            'ALTER TABLE "history" DROP CONSTRAINT IF EXISTS "history_id_device_type_key"'
+        )
+        connection.execute(
+            'ALTER TABLE "history" DROP CONSTRAINT IF EXISTS "history_pkey"'
+        )
+        connection.execute(
+            'ALTER TABLE "history" ADD PRIMARY KEY (id, device_type, datetime)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS "history_user_id_datetime_idx" '
+            'ON "history" (user_id, datetime, id)'
+        )
+        create_device_partitions(connection)
+        for device_type in legacy:
+            moved = connection.execute(
+                f"""
+                INSERT INTO "history" (id, user_id, action, datetime, user_agent, device_type)
+                SELECT id, user_id, action, datetime, user_agent, device_type
+                FROM "history_at_{device_type}_legacy"
+                """
+            ).rowcount
+            connection.execute(f'DROP TABLE "history_at_{device_type}_legacy"')
+            logger.info("Migrated %s history rows of %s devices", moved, device_type)
+        oldest = connection.execute('SELECT min(datetime) FROM "history"').scalar()
+    # Строки старых месяцев попали в партиции по умолчанию и переносятся в месячные
+    ensure_month_partitions(engine, since=oldest.date() if oldest else None)
+    return True
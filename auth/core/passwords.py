@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from core.exceptions import ServiceUnavailableError
+
+# Контекст хеширования внутри процесса пула, создаётся инициализатором
+_context: Optional[CryptContext] = None
+
+
+def build_context(schemes: List[str], pbkdf2_rounds: int, argon2_memory_cost: int):
+    """
+    Контекст хеширования паролей.
+    Новые хеши считаются первой схемой, хеши других схем и с другими параметрами
+    считаются устаревшими и пересчитываются при входе пользователя.
+    Схема argon2 требует пакет argon2-cffi.
+    """
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        pbkdf2_sha256__rounds=pbkdf2_rounds,
+        argon2__memory_cost=argon2_memory_cost,
+    )
+
+
+def _init_worker(schemes: List[str], pbkdf2_rounds: int, argon2_memory_cost: int):
+    global _context
+    _context = build_context(schemes, pbkdf2_rounds, argon2_memory_cost)
+
+
+def _hash(password: str) -> str:
+    return _context.hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return _context.verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Хеширование паролей в пуле процессов.
+
+    Хеширование не занимает поток воркера flask и не держит GIL, число одновременно
+    ожидающих задач ограничено: если очередь не освободилась за queue_timeout,
+    запрос отклоняется с ServiceUnavailableError.
+    При workers=0 пароли хешируются в текущем процессе.
+    """
+
+    def __init__(
+        self,
+        schemes: List[str],
+        pbkdf2_rounds: int,
+        argon2_memory_cost: int,
+        workers: int,
+        max_pending: int,
+        queue_timeout: float,
+    ):
+        self.context_args = (schemes, pbkdf2_rounds, argon2_memory_cost)
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        if not workers:
+            _init_worker(*self.context_args)
+
+    def hash(self, password: str) -> str:
+        """Хеш пароля"""
+        return self._run(_hash, password)
+
+    def verify_and_update(
+        self, password: str, password_hash: str
+    ) -> Tuple[bool, Optional[str]]:
+        """Проверка пароля и новый хеш, если параметры хеширования изменились"""
+        return self._run(_verify_and_update, password, password_hash)
+
+    def shutdown(self) -> None:
+        """Остановка пула процессов текущего процесса"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+            self._pid = None
+
+    def _run(self, func: Callable, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ServiceUnavailableError("Too many password hashing requests")
+        try:
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Пул создаётся в каждом процессе отдельно (воркеры gunicorn создаются через fork).
+        # Процессы пула запускаются через forkserver, а не fork: в воркере уже работают
+        # фоновые потоки, и fork мог бы унаследовать захваченную ими блокировку
+        # (logging, redis, sqlalchemy) и зависнуть
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_init_worker,
+                    initargs=self.context_args,
+                )
+            return self._executor
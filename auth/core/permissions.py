@@ -0,0 +1,108 @@
+import logging
+import os
+import select
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional
+from uuid import UUID
+
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который пишут триггеры на таблицах role, permission и role_permission
+ROLE_PERMISSIONS_CHANNEL = "role_permissions"
+RECONNECT_DELAY = 1
+POLL_TIMEOUT = 5
+
+ROLE_PERMISSIONS_QUERY = """
+SELECT role.id, role.title, permission.title
+FROM role
+LEFT JOIN role_permission ON role_permission.role_id = role.id
+LEFT JOIN permission ON permission.id = role_permission.permission_id
+"""
+
+
+class RolePermissionMatrix:
+    """
+    Матрица "роль - права" и id ролей по названию в памяти процесса.
+
+    Загружается из postgres и перечитывается целиком по уведомлению LISTEN/NOTIFY,
+    которое шлют триггеры при любом изменении ролей и прав.
+    Пока подписка не установлена, permissions возвращает None и права нужно читать из базы.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.matrix: Dict[str, FrozenSet[str]] = {}
+        self.role_ids: Dict[str, UUID] = {}
+        self.synced = threading.Event()
+        self._pid: Optional[int] = None
+
+    def permissions(self, roles: Iterable[str]) -> Optional[List[str]]:
+        """Права для набора ролей. None - матрица не синхронизирована"""
+        self._ensure_started()
+        if not self.synced.is_set():
+            return None
+        matrix = self.matrix
+        return sorted(set().union(*(matrix.get(role, frozenset()) for role in roles)))
+
+    def get_role_ids(self) -> Optional[Dict[str, UUID]]:
+        """id ролей по названию. None - матрица не синхронизирована"""
+        self._ensure_started()
+        if not self.synced.is_set():
+            return None
+        return self.role_ids
+
+    def _ensure_started(self) -> None:
+        # Поток запускается в каждом процессе отдельно (воркеры gunicorn создаются через fork)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.synced.clear()
+        threading.Thread(
+            target=self._listen, name="role-permissions", daemon=True
+        ).start()
+
+    def _listen(self) -> None:
+        while True:
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {ROLE_PERMISSIONS_CHANNEL}")
+                # Матрица загружается после подписки, чтобы не потерять изменения между ними
+                self._load(dbapi_connection)
+                self.synced.set()
+                logger.info("Role permissions are synced, %s roles", len(self.matrix))
+                while True:
+                    if select.select([dbapi_connection], [], [], POLL_TIMEOUT)[0]:
+                        dbapi_connection.poll()
+                        if dbapi_connection.notifies:
+                            dbapi_connection.notifies.clear()
+                            self._load(dbapi_connection)
+            except Exception as exc:
+                logger.warning("Role permissions subscription is lost: %s", exc)
+            finally:
+                self.synced.clear()
+                if connection is not None:
+                    connection.close()
+            time.sleep(RECONNECT_DELAY)
+
+    def _load(self, dbapi_connection) -> None:
+        matrix: Dict[str, set] = {}
+        role_ids: Dict[str, UUID] = {}
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(ROLE_PERMISSIONS_QUERY)
+            for role_id, role, permission in cursor.fetchall():
+                role_ids[role] = UUID(str(role_id))
+                permissions = matrix.setdefault(role, set())
+                if permission:
+                    permissions.add(permission)
+        self.role_ids = role_ids
+        self.matrix = {
+            role: frozenset(permissions) for role, permissions in matrix.items()
+        }
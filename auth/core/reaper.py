@@ -0,0 +1,79 @@
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Таблицы с истёкшими строками. oauth_account сюда не входит: его exp - срок токена
+# провайдера, а удаление строки отвязало бы аккаунт пользователя.
+EXPIRED_TABLES = ("refresh_token", "captcha")
+
+# Строки удаляются пачками по первичному ключу: каждая пачка - короткая транзакция,
+# занятые другими транзакциями строки пропускаются и удаляются в следующий проход
+DELETE_BATCH_QUERY = """
+DELETE FROM {table} WHERE id IN (
+    SELECT id FROM {table}
+    WHERE exp < :now AND id > :last_id
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id
+"""
+
+
+@dataclass
+class PurgeResult:
+    table: str
+    deleted: int
+    duration: float
+
+
+class ExpiredRowsReaper:
+    """Удаление истёкших строк небольшими пачками с паузой между ними"""
+
+    def __init__(self, engine: Engine, batch_size: int = 1000, pause: float = 0.1):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def purge(self) -> List[PurgeResult]:
+        """Один проход по всем таблицам"""
+        return [self.purge_table(table) for table in EXPIRED_TABLES]
+
+    def purge_table(self, table: str) -> PurgeResult:
+        started = time.monotonic()
+        now = datetime.utcnow()
+        query = text(DELETE_BATCH_QUERY.format(table=table))
+        deleted, last_id = 0, "00000000-0000-0000-0000-000000000000"
+        while True:
+            with self.engine.begin() as connection:
+                ids = [
+                    row[0]
+                    for row in connection.execute(
+                        query, now=now, last_id=last_id, batch_size=self.batch_size
+                    )
+                ]
+            if not ids:
+                break
+            deleted += len(ids)
+            last_id = str(max(ids))
+            if len(ids) < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        result = PurgeResult(
+            table=table, deleted=deleted, duration=time.monotonic() - started
+        )
+        logger.info(
+            "Purged %s expired rows from %s in %.3f s",
+            result.deleted,
+            result.table,
+            result.duration,
+        )
+        return result
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import threading
+import time
+from hashlib import blake2b, sha256
+from typing import Dict, Iterator, Optional
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Множество отозванных токенов: member - jti токена, score - время истечения токена.
+# Другие сервисы загружают его при старте и дальше получают изменения через канал pub/sub.
+REVOKED_TOKENS_KEY = "revoked_tokens"
+# Поколение сессий пользователя: токены с поколением меньше текущего считаются отозванными.
+# Множество: member - id пользователя, score - поколение, время последнего выхода
+# со всех устройств в миллисекундах. Через время жизни access токена все токены
+# старых поколений истекают, и запись удаляется; новое поколение всё равно больше,
+# поэтому счётчик не начинается заново.
+TOKEN_GENERATIONS_KEY = "token_generations_at"
+REVOCATION_CHANNEL = "revoked_tokens"
+RECONNECT_DELAY = 1
+PRUNE_INTERVAL = 60
+# Новое поколение - текущее время, но не меньше предыдущего + 1 (часы серверов могут расходиться)
+NEXT_GENERATION_SCRIPT = """
+local current = tonumber(redis.call("ZSCORE", KEYS[1], ARGV[1]) or 0)
+local generation = math.max(tonumber(ARGV[2]), current + 1)
+redis.call("ZADD", KEYS[1], generation, ARGV[1])
+return generation
+"""
+
+
+def is_token_id_revoked(redis, token_id: str) -> bool:
+    """Проверка отзыва токена напрямую в redis"""
+    exp = redis.zscore(REVOKED_TOKENS_KEY, token_id)
+    return exp is not None and exp > time.time()
+
+
+def get_token_generation(redis, user_id: str) -> int:
+    """Текущее поколение сессий пользователя напрямую из redis"""
+    return int(redis.zscore(TOKEN_GENERATIONS_KEY, user_id) or 0)
+
+
+def token_digest(token: str) -> str:
+    """Идентификатор для списка отозванных у токенов, выпущенных без jti"""
+    return sha256(token.encode()).hexdigest()
+
+
+def publish_revoked_token(redis, token_id: str, exp: float) -> None:
+    """Добавление токена в общий список отозванных и оповещение подписчиков"""
+    pipeline = redis.pipeline()
+    pipeline.zadd(REVOKED_TOKENS_KEY, {token_id: exp})
+    pipeline.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", time.time())
+    pipeline.publish(
+        REVOCATION_CHANNEL, json.dumps({"type": "token", "id": token_id, "exp": exp})
+    )
+    pipeline.execute()
+
+
+def publish_token_generation(redis, user_id: str, ttl: float) -> int:
+    """
+    Новое поколение сессий пользователя и оповещение подписчиков.
+    Заодно удаляются поколения, которые сменились больше ttl секунд назад.
+    """
+    now = time.time()
+    generation = int(
+        redis.eval(
+            NEXT_GENERATION_SCRIPT, 1, TOKEN_GENERATIONS_KEY, user_id, int(now * 1000)
+        )
+    )
+    pipeline = redis.pipeline()
+    pipeline.zremrangebyscore(TOKEN_GENERATIONS_KEY, "-inf", int((now - ttl) * 1000))
+    pipeline.publish(
+        REVOCATION_CHANNEL,
+        json.dumps({"type": "user", "id": user_id, "generation": generation}),
+    )
+    pipeline.execute()
+    return generation
+
+
+def import_legacy_revocations(redis) -> int:
+    """
+    Перенос отзывов, которые до появления jti хранились ключом с самим токеном,
+    в общий список отозванных. Перенесённые ключи удаляются
+    """
+    imported = 0
+    for key in redis.scan_iter(match="eyJ*", count=1000):
+        ttl = redis.ttl(key)
+        if ttl > 0:
+            publish_revoked_token(redis, token_digest(key.decode()), time.time() + ttl)
+            imported += 1
+        redis.delete(key)
+    if imported:
+        logger.info("Imported %s legacy revoked tokens", imported)
+    return imported
+
+
+class BloomFilter:
+    """Фильтр Блума: отвечает "точно нет" или "возможно есть" без хранения самих элементов"""
+
+    def __init__(self, size_bits: int = 1 << 20, hashes: int = 7):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray(size_bits // 8)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = blake2b(item.encode(), digest_size=4 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4 * i : 4 * (i + 1)], "big") % self.size_bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(item)
+        )
+
+
+class RevocationCache:
+    """
+    Локальная копия списка отозванных токенов.
+
+    Проверка "токен не отозван" проходит фильтр Блума и не выходит из процесса,
+    положительный ответ фильтра подтверждается точным множеством.
+    Рядом хранятся поколения сессий пользователей, сменившиеся не больше
+    generation_ttl секунд назад (времени жизни access токена).
+    Данные загружаются из redis и обновляются фоновым потоком по каналу pub/sub.
+    Пока подписка не установлена, методы возвращают None и проверку нужно делать в redis.
+    """
+
+    def __init__(self, redis, generation_ttl: float):
+        self.redis = redis
+        self.generation_ttl = generation_ttl
+        self.revoked: Dict[str, float] = {}
+        self.generations: Dict[str, int] = {}
+        self.bloom = BloomFilter()
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+        self._pruned_at = time.time()
+        self._pid: Optional[int] = None
+
+    def is_revoked(self, token_id: str) -> Optional[bool]:
+        """Проверка, отозван ли токен. None - локальная копия не синхронизирована"""
+        self._ensure_started()
+        if not self.synced.is_set():
+            return None
+        if token_id not in self.bloom:
+            return False
+        return self.revoked.get(token_id, 0) > time.time()
+
+    def generation(self, user_id: str) -> Optional[int]:
+        """Текущее поколение сессий пользователя. None - локальная копия не синхронизирована"""
+        self._ensure_started()
+        if not self.synced.is_set():
+            return None
+        return self.generations.get(user_id, 0)
+
+    def add(self, token_id: str, exp: float) -> None:
+        """Добавление отозванного токена в локальную копию"""
+        with self._lock:
+            self.revoked[token_id] = exp
+            self.bloom.add(token_id)
+
+    def set_generation(self, user_id: str, generation: int) -> None:
+        """Обновление поколения сессий пользователя в локальной копии"""
+        with self._lock:
+            if generation > self.generations.get(user_id, 0):
+                self.generations[user_id] = generation
+
+    def _ensure_started(self) -> None:
+        # Поток запускается в каждом процессе отдельно (воркеры gunicorn создаются через fork)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.synced.clear()
+        threading.Thread(target=self._listen, name="revocation", daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                # Снимок загружается после подписки, чтобы не потерять отзывы между ними
+                self._load_snapshot()
+                self.synced.set()
+                logger.info(
+                    "Revoked tokens are synced, %s entries, %s user generations",
+                    len(self.revoked),
+                    len(self.generations),
+                )
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._apply(json.loads(message["data"]))
+            except RedisError as exc:
+                logger.warning("Revoked tokens subscription is lost: %s", exc)
+            finally:
+                self.synced.clear()
+                pubsub.close()
+            time.sleep(RECONNECT_DELAY)
+
+    def _load_snapshot(self) -> None:
+        entries = self.redis.zrangebyscore(
+            REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True
+        )
+        self._rebuild({token_id.decode(): exp for token_id, exp in entries})
+        generations = self.redis.zrangebyscore(
+            TOKEN_GENERATIONS_KEY, self._generations_since(), "+inf", withscores=True
+        )
+        with self._lock:
+            self.generations = {
+                user_id.decode(): int(generation) for user_id, generation in generations
+            }
+
+    def _apply(self, event: dict) -> None:
+        if event.get("type") == "token":
+            self.add(event["id"], event["exp"])
+        elif event.get("type") == "user":
+            self.set_generation(event["id"], event["generation"])
+
+        now = time.time()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            since = self._generations_since()
+            with self._lock:
+                entries = list(self.revoked.items())
+                self.generations = {
+                    user_id: generation
+                    for user_id, generation in self.generations.items()
+                    if generation >= since
+                }
+            self._rebuild({token_id: exp for token_id, exp in entries if exp > now})
+
+    def _generations_since(self) -> int:
+        """Поколения старше этого значения сменились до выпуска всех живых токенов"""
+        return int((time.time() - self.generation_ttl) * 1000)
+
+    def _rebuild(self, revoked: Dict[str, float]) -> None:
+        """Пересборка фильтра: из фильтра Блума нельзя удалить истёкшие токены"""
+        bloom = BloomFilter()
+        for token_id in revoked:
+            bloom.add(token_id)
+        with self._lock:
+            self.revoked, self.bloom = revoked, bloom
+            self._pruned_at = time.time()
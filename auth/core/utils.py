@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Iterable
 
 
 def extend_enum(inherited_enum):
@@ -11,3 +12,8 @@ def extend_enum(inherited_enum):
         return Enum(added_enum.__name__, joined)
 
     return wrapper
+
+
+def chunked(items: list, size: int) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
@@ -1,3 +1,8 @@
+import os
+import time
+from typing import List, Optional
+
+import click
 from flask import Flask
 from pydantic import BaseSettings, PostgresDsn, RedisDsn
 from redis import Redis
@@ -9,8 +14,15 @@ from api.v1.authorization import ns as authorization_ns
 from api.v1.captcha import ns as captcha_ns
 from api.v1.oauth import ns as oauth_ns
 from api.v1.users import ns as profile_ns
+from api.well_known import ns as well_known_ns
 from core.db import init_session
+from core.keys import KeyRing, generate_key
 from core.oauth import oauth
+from core.partitions import (ensure_month_partitions, migrate_history_table,
+                             retire_month_partitions)
+from core.passwords import PasswordHasher
+from core.reaper import ExpiredRowsReaper
+from core.revocation import import_legacy_revocations
 from services import Services
 
 
@@ -18,6 +30,35 @@ class Settings(BaseSettings):
     redis_dsn: RedisDsn
     postgres_dsn: PostgresDsn
     secret_key: str
+    # Общий секрет сервисов (billing), которые вызывают внутренние ручки auth
+    service_token: str
+
+    # Ключи подписи access токенов (RS256 или EdDSA), см. core/keys.py
+    jwt_keys_dir: str = "keys"
+    jwt_algorithm: str = "RS256"
+    jwt_signing_kid: Optional[str] = None
+
+    # Потоков в процессе gunicorn (--threads в Dockerfile-auth)
+    web_threads: int = 8
+
+    # Хеширование паролей, см. core/passwords.py. Первая схема - схема новых хешей
+    password_schemes: List[str] = ["pbkdf2_sha256"]
+    password_pbkdf2_rounds: int = 29000
+    password_argon2_memory_cost: int = 65536
+    password_hash_workers: int = os.cpu_count() or 1
+    # Сколько проверок паролей может ждать пул в одном процессе. По умолчанию
+    # 2 * password_hash_workers, но не больше половины потоков gunicorn: остальные
+    # входы через password_hash_queue_timeout получают 503, а потоки остаются
+    # свободными для других запросов
+    password_hash_max_pending: Optional[int] = None
+    password_hash_queue_timeout: float = 5
+
+    # Удаление истёкших строк, см. core/reaper.py
+    reaper_batch_size: int = 1000
+    reaper_pause: float = 0.1
+
+    # Сколько месяцев хранится история входов, см. core/partitions.py
+    history_retention_months: int = 12
 
     oauth_facebook_client_id: str
     oauth_facebook_client_secret: str
@@ -32,6 +73,7 @@ def create_app():
 
     app = Flask(__name__)
     app.config["SECRET_KEY"] = settings.secret_key
+    app.config["SERVICE_TOKEN"] = settings.service_token
     app.config["ERROR_404_HELP"] = False
 
     app.config["FACEBOOK_CLIENT_ID"] = settings.oauth_facebook_client_id
@@ -45,6 +87,7 @@ def create_app():
 
     session = init_session(f"{str(settings.postgres_dsn)}/auth")
     redis = Redis(host=settings.redis_dsn.host, port=settings.redis_dsn.port, db=1)
+    import_legacy_revocations(redis)
 
     oauth.init_app(app)
     oauth.register("facebook")
@@ -56,11 +99,71 @@ def create_app():
     api.add_namespace(staff_auth_ns, "/staff/api/v1/auth")
     api.add_namespace(authorization_ns, "/api/v1/authorization")
     api.add_namespace(captcha_ns, "/api/v1/captcha")
-
-    services = Services(session, redis, settings.secret_key)
+    api.add_namespace(well_known_ns, "/.well-known")
+
+    keyring = KeyRing(
+        keys_dir=settings.jwt_keys_dir,
+        algorithm=settings.jwt_algorithm,
+        signing_kid=settings.jwt_signing_kid,
+    )
+    max_pending = settings.password_hash_max_pending or max(
+        min(2 * settings.password_hash_workers, settings.web_threads // 2), 1
+    )
+    hasher = PasswordHasher(
+        schemes=settings.password_schemes,
+        pbkdf2_rounds=settings.password_pbkdf2_rounds,
+        argon2_memory_cost=settings.password_argon2_memory_cost,
+        workers=settings.password_hash_workers,
+        max_pending=max_pending,
+        queue_timeout=settings.password_hash_queue_timeout,
+    )
+    services = Services(session, redis, settings.secret_key, keyring, hasher)
     app.extensions["services"] = services
     api.services = services
 
+    @app.cli.command("generate-signing-key")
+    @click.option("--algorithm", default=settings.jwt_algorithm)
+    def generate_signing_key(algorithm):
+        """Generate a new access token signing key (key rotation)"""
+        click.echo(generate_key(settings.jwt_keys_dir, algorithm))
+
+    @app.cli.command("history-partitions")
+    @click.option("--interval", default=0, help="Repeat every N seconds, 0 - run once")
+    def history_partitions(interval):
+        """Create upcoming monthly history partitions and drop expired ones"""
+        engine = session.get_bind()
+        if migrate_history_table(engine):
+            click.echo("migrated history to monthly partitions")
+        while True:
+            for name in ensure_month_partitions(engine):
+                click.echo(f"created {name}")
+            for name in retire_month_partitions(
+                engine, settings.history_retention_months
+            ):
+                click.echo(f"dropped {name}")
+            if not interval:
+                break
+            time.sleep(interval)
+
+    @app.cli.command("purge-expired")
+    @click.option("--interval", default=0, help="Repeat every N seconds, 0 - run once")
+    def purge_expired(interval):
+        """Delete expired refresh tokens and captcha challenges"""
+        reaper = ExpiredRowsReaper(
+            session.get_bind(),
+            batch_size=settings.reaper_batch_size,
+            pause=settings.reaper_pause,
+        )
+        while True:
+            for result in reaper.purge():
+                click.echo(
+                    f"{result.table}: deleted {result.deleted} rows "
+                    f"in {result.duration:.3f} s"
+                )
+            if not interval:
+                break
+            time.sleep(interval)
+
     return app
 
 
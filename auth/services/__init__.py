@@ -1,7 +1,10 @@
 from flask import current_app
 from werkzeug.local import LocalProxy
 
-from services.auth import OAuthService, TokenService
+from core.history import HistoryWriter
+from core.permissions import RolePermissionMatrix
+from core.revocation import RevocationCache
+from services.auth import ACCESS_TOKEN_INTERVAL, OAuthService, TokenService
 from services.authorization import AuthorizationService
 from services.captcha import CaptchaService
 from services.history import UserHistoryService
@@ -11,12 +14,26 @@ services = LocalProxy(lambda: current_app.extensions["services"])
 
 
 class Services:
-    def __init__(self, session, redis, secret_key):
+    def __init__(self, session, redis, secret_key, keyring, hasher):
         self.session = session
         self.redis = redis
-        self.user = UserService(session)
-        self.user_history = UserHistoryService(session)
-        self.token_service = TokenService(session, redis, secret_key)
-        self.authorization_service = AuthorizationService(session)
+        self.revocation = RevocationCache(redis, generation_ttl=ACCESS_TOKEN_INTERVAL)
+        self.user = UserService(session, hasher)
+        self.user_history = UserHistoryService(
+            session, HistoryWriter(session.get_bind())
+        )
+        self.role_permissions = RolePermissionMatrix(session.get_bind())
+        self.authorization_service = AuthorizationService(
+            session, redis, self.role_permissions
+        )
+        self.token_service = TokenService(
+            session,
+            redis,
+            secret_key,
+            keyring,
+            self.revocation,
+            self.user,
+            self.authorization_service,
+        )
         self.oauth_account = OAuthService(session)
-        self.captcha = CaptchaService(session)
+        self.captcha = CaptchaService(redis)
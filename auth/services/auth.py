@@ -10,6 +10,12 @@ import jwt
 from core.db import OAuthAccount, RefreshToken
 from core.enums import OAuthProvider
 from core.exceptions import AuthError, NotFound
+from core.keys import KeyRing
+from core.revocation import (RevocationCache, get_token_generation,
+                             is_token_id_revoked, publish_revoked_token,
+                             publish_token_generation, token_digest)
+from services.authorization import AuthorizationService
+from services.users import UserService
 
 ACCESS_TOKEN_INTERVAL = 3600  # 1 hour
 REFRESH_TOKEN_INTERVAL = 3600 * 24 * 10  # 10 day
@@ -34,6 +40,7 @@ class OAuthAccountNotFound(NotFound):
 @dataclass
 class AccessToken:
     token: str
+    jti: str
     user_id: UUID
     user_email: str
     user_roles: list
@@ -45,10 +52,23 @@ class AccessToken:
 
 
 class TokenService:
-    def __init__(self, session, redis, secret_key):
+    def __init__(
+        self,
+        session,
+        redis,
+        secret_key,
+        keyring: KeyRing,
+        revocation: RevocationCache,
+        user_service: UserService,
+        authorization_service: AuthorizationService,
+    ):
         self.session = session
         self.redis = redis
         self.secret_key = secret_key
+        self.keyring = keyring
+        self.revocation = revocation
+        self.user_service = user_service
+        self.authorization_service = authorization_service
 
     def create_tokens(
         self,
@@ -64,7 +84,13 @@ class TokenService:
         """
 
         now = datetime.now(tz=timezone.utc)
+        exp = now + timedelta(seconds=ACCESS_TOKEN_INTERVAL)
+        jti = secrets.token_urlsafe(12)
         payload = {
+            "jti": jti,
+            # Поколение читается из redis, а не из локальной копии, чтобы не выпустить
+            # токен со старым поколением сразу после выхода со всех устройств
+            "gen": get_token_generation(self.redis, str(user_id)),
             "user_id": str(user_id),
             "user_email": user_email,
             "user_roles": json.dumps(user_roles),
@@ -72,15 +98,19 @@ class TokenService:
             "country": country,
             "birthdate": birthdate,
             "iat": now,
-            "exp": now + timedelta(seconds=ACCESS_TOKEN_INTERVAL),
+            "exp": exp,
         }
 
-        access_token = jwt.encode(payload, key=self.secret_key)
+        kid, algorithm, private_key = self.keyring.signing_key()
+        access_token = jwt.encode(
+            payload, key=private_key, algorithm=algorithm, headers={"kid": kid}
+        )
         refresh_token = RefreshToken(
             user_id=user_id,
             exp=now + timedelta(seconds=REFRESH_TOKEN_INTERVAL),
             token=secrets.token_urlsafe(),
-            access_token=access_token,
+            access_token_jti=jti,
+            access_token_exp=exp,
         )
         self.session.add(refresh_token)
 
@@ -93,17 +123,34 @@ class TokenService:
         :raises AccessTokenRevoked: Если токен был отозван (пользователь вышел из аккаунта)
         """
 
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid:
+            verification_key = self.keyring.verification_key(kid)
+            if not verification_key:
+                raise AuthError("Access token is signed with unknown key")
+            algorithm, key = verification_key
+        else:
+            # Токены, выпущенные до перехода на асимметричную подпись
+            algorithm, key = "HS256", self.secret_key
+
         payload = jwt.decode(
             token,
-            key=self.secret_key,
-            algorithms=["HS256"],
+            key=key,
+            algorithms=[algorithm],
             options={"require": ["exp", "iat"], "verify_exp": verify_exp},
         )
-        if self._is_token_revoked(token):
+        # Токены, выпущенные до появления jti, отзываются по хешу самого токена,
+        # а до переноса в общий список (import_legacy_revocations) - ключом с токеном
+        jti = payload.get("jti") or token_digest(token)
+        legacy_revoked = "jti" not in payload and self.redis.exists(token)
+        if legacy_revoked or self._is_token_revoked(jti):
             raise AccessTokenRevoked("Access token was revoked")
+        if payload.get("gen", 0) < self._get_generation(payload["user_id"]):
+            raise AccessTokenRevoked("All user sessions were revoked")
 
         access_token = AccessToken(
             token=token,
+            jti=jti,
             user_id=payload["user_id"],
             user_email=payload["user_email"],
             user_roles=json.loads(payload["user_roles"]),
@@ -119,25 +166,30 @@ class TokenService:
         """
         Обновление access, refresh токенов.
         1. Старый refresh токен удаляется, старый access токен помечается как revoked
-        2. Генерируется новая пара access, refresh токенов
+        2. Генерируется новая пара access, refresh токенов с актуальными данными пользователя
         """
 
         refresh_token = self._get_refresh_token(token)
-        access_token = self.decode_access_token(
-            refresh_token.access_token, verify_exp=False
-        )
+        user = self.user_service.get(refresh_token.user_id)
+        if not user:
+            raise RefreshTokenNotFound("Refresh token not found")
 
-        user_id = refresh_token.user_id
-        user_email = access_token.user_email
-        user_roles = access_token.user_roles
-        user_permissions = access_token.user_permissions
-        country = access_token.country
-        birthdate = access_token.birthdate
         self.session.delete(refresh_token)
-        self._revoke_token(access_token)
+        self._revoke_token(
+            refresh_token.access_token_jti,
+            refresh_token.access_token_exp.replace(tzinfo=timezone.utc),
+        )
 
+        user_roles_permissions = self.authorization_service.get_user_roles_permissions(
+            user_id=user.id
+        )
         return self.create_tokens(
-            user_id, user_email, user_roles, user_permissions, country, birthdate
+            user_id=user.id,
+            user_email=user.email,
+            user_roles=user_roles_permissions["user_roles"],
+            user_permissions=user_roles_permissions["user_permissions"],
+            country=user.country,
+            birthdate=user.birthdate,
         )
 
     def remove_tokens(self, access_token: AccessToken):
@@ -148,11 +200,26 @@ class TokenService:
         """
         refresh_token = (
             self.session.query(RefreshToken)
-            .filter(RefreshToken.access_token == access_token.token)
+            .filter(RefreshToken.access_token_jti == access_token.jti)
             .first()
         )
-        self.session.delete(refresh_token)
-        self._revoke_token(access_token)
+        if refresh_token:
+            self.session.delete(refresh_token)
+        self._revoke_token(access_token.jti, access_token.exp)
+
+    def remove_all_tokens(self, user_id: UUID):
+        """
+        Выход со всех устройств.
+        1. Удаление всех refresh токенов пользователя
+        2. Поколение сессий пользователя увеличивается, все выпущенные access токены становятся невалидными
+        """
+        self.session.query(RefreshToken).filter(RefreshToken.user_id == user_id).delete(
+            synchronize_session=False
+        )
+        generation = publish_token_generation(
+            self.redis, str(user_id), ttl=ACCESS_TOKEN_INTERVAL
+        )
+        self.revocation.set_generation(str(user_id), generation)
 
     def _get_refresh_token(self, token: str, validate_exp=True) -> RefreshToken:
         refrest_token = (
@@ -168,16 +235,24 @@ class TokenService:
 
         return refrest_token
 
-    def _is_token_revoked(self, token: str) -> bool:
-        return bool(self.redis.exists(token))
+    def _is_token_revoked(self, jti: str) -> bool:
+        revoked = self.revocation.is_revoked(jti)
+        if revoked is None:
+            return is_token_id_revoked(self.redis, jti)
+        return revoked
 
-    def _revoke_token(self, access_token: AccessToken):
-        now = datetime.now(timezone.utc)
+    def _get_generation(self, user_id: str) -> int:
+        generation = self.revocation.generation(user_id)
+        if generation is None:
+            return get_token_generation(self.redis, user_id)
+        return generation
 
-        if access_token.exp < now:
+    def _revoke_token(self, jti: str, exp: datetime):
+        if exp < datetime.now(timezone.utc):
             return
 
-        return self.redis.setex(access_token.token, access_token.exp - now, 1)
+        self.revocation.add(jti, exp.timestamp())
+        publish_revoked_token(self.redis, token_id=jti, exp=exp.timestamp())
 
 
 class OAuthService:
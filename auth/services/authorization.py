@@ -1,48 +1,159 @@
+import json
+from typing import Dict, List, Set, Tuple
 from uuid import UUID
 
+from sqlalchemy import delete, event, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from core.db import Permission, Role, RolePermission, User, UserRole
+from core.exceptions import BadRequestError
+from core.permissions import RolePermissionMatrix
+from core.utils import chunked
+
+USER_ROLES_KEY = "user_roles:{user_id}"
+USER_ROLES_CACHE_SECONDS = 3600
+# Размер одного INSERT / DELETE при пакетном изменении ролей
+ROLE_CHANGES_STATEMENT_SIZE = 1000
 
 
 class AuthorizationService:
     """Сервис авторизации"""
 
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, redis, matrix: RolePermissionMatrix):
         self.session = session
+        self.redis = redis
+        self.matrix = matrix
+        event.listen(session, "after_commit", self._after_commit)
 
     def get_user_roles_permissions(self, user_id: UUID):
         """Метод сбора всех ролей и прав пользователя"""
-        user_roles = (
-            self.session.query(Role.id, Role.title)
+        user_roles = self._get_user_roles(user_id)
+        user_permissions = self.matrix.permissions(user_roles)
+        if user_permissions is None:
+            user_permissions = [
+                perm[0]
+                for perm in self.session.query(Permission.title)
+                .join(RolePermission)
+                .join(Role)
+                .filter(Role.title.in_(user_roles))
+                .distinct()
+            ]
+
+        return {
+            "user_roles": user_roles or ["anonymous"],
+            "user_permissions": user_permissions,
+        }
+
+    def _get_user_roles(self, user_id: UUID) -> List[str]:
+        """Роли пользователя из кэша в redis, при промахе - из базы"""
+        key = USER_ROLES_KEY.format(user_id=user_id)
+        cached = self.redis.get(key)
+        if cached is not None:
+            return json.loads(cached)
+
+        user_roles = [
+            role[0]
+            for role in self.session.query(Role.title)
             .join(UserRole)
             .filter(UserRole.user_id == user_id)
-            .all()
-        )
-        user_permissions = (
-            self.session.query(Permission.title)
-            .join(RolePermission)
-            .filter(RolePermission.role_id.in_((role[0] for role in user_roles)))
-            .all()
-        )
+        ]
+        self.redis.setex(key, USER_ROLES_CACHE_SECONDS, json.dumps(user_roles))
+        return user_roles
+
+    def apply_role_changes(self, changes: List[dict]) -> dict:
+        """
+        Пакетная выдача и отзыв ролей.
+        Для каждой пары (пользователь, роль) применяется последняя операция из списка,
+        несуществующие пользователи пропускаются.
+        """
+        role_ids = self._get_role_ids()
+        unknown_roles = {c["role_title"] for c in changes} - role_ids.keys()
+        if unknown_roles:
+            raise BadRequestError(f"Unknown roles: {', '.join(sorted(unknown_roles))}")
+
+        operations: Dict[Tuple[UUID, UUID], str] = {}
+        for change in changes:
+            key = (UUID(str(change["user_id"])), role_ids[change["role_title"]])
+            operations[key] = change["op"]
+
+        requested_users = {user_id for user_id, _ in operations}
+        existing_users: Set[UUID] = set()
+        for user_ids in chunked(list(requested_users), ROLE_CHANGES_STATEMENT_SIZE):
+            existing_users.update(
+                user[0]
+                for user in self.session.query(User.id).filter(User.id.in_(user_ids))
+            )
+
+        grants = [
+            {"user_id": user_id, "role_id": role_id}
+            for (user_id, role_id), op in operations.items()
+            if op == "grant" and user_id in existing_users
+        ]
+        revokes = [
+            key
+            for key, op in operations.items()
+            if op == "revoke" and key[0] in existing_users
+        ]
+
+        granted = revoked = 0
+        for rows in chunked(grants, ROLE_CHANGES_STATEMENT_SIZE):
+            granted += self.session.execute(
+                insert(UserRole).values(rows).on_conflict_do_nothing()
+            ).rowcount
+        for pairs in chunked(revokes, ROLE_CHANGES_STATEMENT_SIZE):
+            revoked += self.session.execute(
+                delete(UserRole).where(
+                    tuple_(UserRole.user_id, UserRole.role_id).in_(pairs)
+                )
+            ).rowcount
+
+        self._invalidate_user_roles(*existing_users)
 
         return {
-            "user_roles": [role[1] for role in user_roles] or ["anonymous"],
-            "user_permissions": [perm[0] for perm in user_permissions],
+            "granted": granted,
+            "revoked": revoked,
+            "missing_users": [
+                str(user_id) for user_id in requested_users - existing_users
+            ],
         }
 
+    def _get_role_ids(self) -> Dict[str, UUID]:
+        role_ids = self.matrix.get_role_ids()
+        if role_ids is None:
+            role_ids = dict(self.session.query(Role.title, Role.id))
+        return role_ids
+
+    def _invalidate_user_roles(self, *user_ids: UUID):
+        # Ключи удаляются сразу и ещё раз после коммита: параллельный запрос мог успеть
+        # закэшировать роли, прочитанные до коммита
+        keys = [USER_ROLES_KEY.format(user_id=user_id) for user_id in user_ids]
+        if not keys:
+            return
+        self.redis.delete(*keys)
+        self.session.info.setdefault("invalidated_keys", set()).update(keys)
+
+    def _after_commit(self, session: Session):
+        keys = session.info.pop("invalidated_keys", None)
+        if keys:
+            self.redis.delete(*keys)
+
     def add_role_to_user(self, user_id: UUID, role_title: str):
         """Добавление роли пользователю"""
         role = self.session.query(Role).filter(Role.title == role_title).first()
         user_role = UserRole(user_id=user_id, role_id=role.id)
         self.session.add(user_role)
+        self.session.flush()
+        self._invalidate_user_roles(user_id)
 
     def delete_role_from_user(self, user_id: UUID, role_title: str):
         """Удаление роли у пользователя"""
         role = self.session.query(Role).filter(Role.title == role_title).first()
         user_role = UserRole(user_id=user_id, role_id=role.id)
-        return (
+        deleted = (
             self.session.query(UserRole)
             .filter(UserRole.user_id == user_id, UserRole.role_id == user_role.role_id)
             .delete()
         )
+        self._invalidate_user_roles(user_id)
+        return deleted
@@ -1,14 +1,21 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from hashlib import sha256
 from io import BytesIO
+from typing import Optional, Tuple
 from uuid import UUID, uuid4
 
 from multicolorcaptcha import CaptchaGenerator
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
 
-from core.db import CaptchaChallenge
 from core.exceptions import BadRequestError, NotFound
 
+logger = logging.getLogger(__name__)
+
 
 class CaptchaChallengeExpired(BadRequestError):
     pass
@@ -20,67 +27,148 @@ class CaptchaChallengeInvalidSolution(BadRequestError):
 
 # Captcha image size number (2 -> 640x360)
 CAPCTHA_SIZE_NUM = 2
+CAPTCHA_TTL = 300  # 5 minutes
+
+# Пул заранее сгенерированных капч: список id, картинка и hash_key лежат в CAPTCHA_KEY.
+# Выданная капча живёт CAPTCHA_TTL, невыданная - CAPTCHA_POOL_TTL.
+CAPTCHA_POOL_KEY = "captcha_pool"
+CAPTCHA_KEY = "captcha:{id}"
+CAPTCHA_HASH_KEY = "captcha_hash_key:{hash_key}"
+CAPTCHA_POOL_SIZE = 100
+CAPTCHA_POOL_TTL = 3600
+CAPTCHA_PRODUCER_INTERVAL = 1
+
+# Выдача капчи из пула: id берётся из списка (пропуская истёкшие),
+# капче и её hash_key выставляется срок жизни выданной капчи
+ISSUE_SCRIPT = """
+while true do
+    local id = redis.call('LPOP', KEYS[1])
+    if not id then
+        return nil
+    end
+    local key = 'captcha:' .. id
+    local hash_key = redis.call('HGET', key, 'hash_key')
+    if hash_key then
+        redis.call('EXPIRE', key, ARGV[1])
+        redis.call('SET', 'captcha_hash_key:' .. hash_key, id, 'EX', ARGV[1])
+        return id
+    end
+end
+"""
+
+# Удаление истёкших капч из начала пула: капчи добавляются в конец с одинаковым TTL,
+# поэтому истёкшие всегда в начале списка, и его длина - число живых капч
+TRIM_SCRIPT = """
+local removed = 0
+while true do
+    local id = redis.call('LINDEX', KEYS[1], 0)
+    if not id or redis.call('EXISTS', 'captcha:' .. id) == 1 then
+        return removed
+    end
+    redis.call('LPOP', KEYS[1])
+    removed = removed + 1
+end
+"""
+
+# Проверка решения: hash_key и капча удаляются, чтобы решение нельзя было использовать повторно
+VERIFY_SCRIPT = """
+local id = redis.call('GET', KEYS[1])
+if id then
+    redis.call('DEL', KEYS[1], 'captcha:' .. id)
+end
+return id
+"""
+
+
+@dataclass
+class Captcha:
+    id: UUID
+    exp: datetime
+
+
+def render_captcha() -> Tuple[UUID, str, bytes]:
+    """Генерация картинки капчи: id, hash_key решения и png"""
+    generator = CaptchaGenerator(CAPCTHA_SIZE_NUM)
+    captcha = generator.gen_captcha_image(difficult_level=3)
+
+    b = BytesIO()
+    image = captcha["image"]
+    image.save(b, "png")
+
+    id = uuid4()
+    hash_key = sha256((f'{id}{captcha["characters"]}').encode()).hexdigest()
+    return id, hash_key, b.getvalue()
 
 
 class CaptchaService:
-    def __init__(self, session: Session):
-        self.session = session
-
-    def get(self, id: UUID) -> CaptchaChallenge:
-        captcha_challenge = self.session.query(CaptchaChallenge).get({"id": id})
-        if not captcha_challenge:
-            raise NotFound("Captcha challenge not found")
-
-        if captcha_challenge.exp.replace(tzinfo=timezone.utc) < datetime.now(
-            tz=timezone.utc
-        ):
-            raise CaptchaChallengeExpired("Captcha challenge expired")
-
-        return captcha_challenge
-
-    def create(self) -> CaptchaChallenge:
-        generator = CaptchaGenerator(CAPCTHA_SIZE_NUM)
-        captcha = generator.gen_captcha_image(difficult_level=3)
-
-        b = BytesIO()
-        image = captcha["image"]
-        image.save(b, "png")
-        b.seek(0)
-
-        id = uuid4()
-        hash_key = sha256((f'{id}{captcha["characters"]}').encode()).hexdigest()
-        captcha_challenge = CaptchaChallenge(
-            id=id,
-            hash_key=hash_key,
-            payload=b.read(),
-            exp=datetime.now(tz=timezone.utc) + timedelta(minutes=5),
-        )
-        self.session.add(captcha_challenge)
-        self.session.flush()
-        return captcha_challenge
-
-    def delete(self, id: UUID):
-        return (
-            self.session.query(CaptchaChallenge)
-            .filter(CaptchaChallenge.id == id)
-            .delete()
+    """
+    Капчи хранятся в redis с нативным TTL.
+
+    Фоновый поток держит пул заранее отрисованных капч, поэтому выдача и получение
+    картинки - одно обращение к redis. Если пул пуст, капча рисуется в запросе.
+    """
+
+    def __init__(self, redis, pool_size: int = CAPTCHA_POOL_SIZE):
+        self.redis = redis
+        self.pool_size = pool_size
+        self._issue = redis.register_script(ISSUE_SCRIPT)
+        self._verify = redis.register_script(VERIFY_SCRIPT)
+        self._trim = redis.register_script(TRIM_SCRIPT)
+        self._pid: Optional[int] = None
+
+    def get(self, id: UUID) -> bytes:
+        """Картинка выданной капчи"""
+        self._ensure_started()
+        payload = self.redis.hget(CAPTCHA_KEY.format(id=id), "payload")
+        if payload is None:
+            raise NotFound("Captcha challenge not found or expired")
+        return payload
+
+    def create(self) -> Captcha:
+        """Выдача новой капчи"""
+        self._ensure_started()
+        id = self._issue(keys=[CAPTCHA_POOL_KEY], args=[CAPTCHA_TTL])
+        if id is None:
+            logger.warning("Captcha pool is empty, rendering in request")
+            id, hash_key, payload = render_captcha()
+            self._store(id, hash_key, payload, ttl=CAPTCHA_TTL)
+            self.redis.setex(
+                CAPTCHA_HASH_KEY.format(hash_key=hash_key), CAPTCHA_TTL, str(id)
+            )
+        return Captcha(
+            id=UUID(id.decode()) if isinstance(id, bytes) else id,
+            exp=datetime.now(tz=timezone.utc) + timedelta(seconds=CAPTCHA_TTL),
         )
 
     def verify(self, hash_key: str) -> bool:
-        captcha_challenge = (
-            self.session.query(CaptchaChallenge)
-            .filter(CaptchaChallenge.hash_key == hash_key)
-            .first()
-        )
-
-        if not captcha_challenge:
+        """Проверка решения капчи, решение можно использовать один раз"""
+        if self._verify(keys=[CAPTCHA_HASH_KEY.format(hash_key=hash_key)]) is None:
             raise NotFound("Captcha challenge not found or hash key is invalid")
-
-        if captcha_challenge.exp.replace(tzinfo=timezone.utc) < datetime.now(
-            tz=timezone.utc
-        ):
-            raise CaptchaChallengeExpired("Captcha challenge expired")
-
-        self.delete(captcha_challenge.id)
-
         return True
+
+    def _store(self, id: UUID, hash_key: str, payload: bytes, ttl: int):
+        key = CAPTCHA_KEY.format(id=id)
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, mapping={"hash_key": hash_key, "payload": payload})
+        pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def _ensure_started(self) -> None:
+        # Поток запускается в каждом процессе отдельно (воркеры gunicorn создаются через fork)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._produce, name="captcha", daemon=True).start()
+
+    def _produce(self) -> None:
+        while True:
+            try:
+                # После простоя пул состоит из истёкших капч, их нужно заменить
+                self._trim(keys=[CAPTCHA_POOL_KEY])
+                while self.redis.llen(CAPTCHA_POOL_KEY) < self.pool_size:
+                    id, hash_key, payload = render_captcha()
+                    self._store(id, hash_key, payload, ttl=CAPTCHA_POOL_TTL)
+                    self.redis.rpush(CAPTCHA_POOL_KEY, str(id))
+            except RedisError as exc:
+                logger.warning("Failed to fill captcha pool: %s", exc)
+            time.sleep(CAPTCHA_PRODUCER_INTERVAL)
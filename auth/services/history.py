@@ -1,46 +1,81 @@
+import base64
 from datetime import datetime, timezone
+from typing import List, Optional, Tuple
 from uuid import UUID
 
-import user_agents
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 
-from core.db import History, User
+from core.db import History
 from core.enums import Action
-from core.exceptions import NotFound
+from core.exceptions import BadRequestError
+from core.history import HistoryWriter, parse_device_type
+
+
+def encode_cursor(entry: History) -> str:
+    """Курсор следующей страницы истории: время и id последней записи"""
+    return base64.urlsafe_b64encode(
+        f"{entry.datetime.isoformat()}|{entry.id}".encode()
+    ).decode()
+
+
+def to_utc(value: datetime) -> datetime:
+    """Время в UTC без часового пояса, как оно хранится в history"""
+    if value.tzinfo:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        value, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(value), UUID(id)
+    except ValueError:
+        raise BadRequestError("Invalid history cursor")
 
 
 class UserHistoryService:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, writer: HistoryWriter):
         self.session = session
+        self.writer = writer
 
-    def get_history(self, user_id: UUID):
-        """Метод получения истории о пользователе"""
-        history = (
-            self.session.query(History)
-            .filter(History.user_id == user_id)
-            .order_by(History.datetime)
-            .all()
-        )
-        return history
+    def get_history(
+        self,
+        user_id: UUID,
+        limit: int,
+        cursor: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Tuple[List[History], Optional[str]]:
+        """
+        Метод получения страницы истории о пользователе.
+        Фильтр по времени ограничивает чтение нужными месячными партициями.
+        Возвращает записи и курсор следующей страницы (None, если страница последняя).
+        """
+        query = self.session.query(History).filter(History.user_id == user_id)
+        if since:
+            query = query.filter(History.datetime >= to_utc(since))
+        if until:
+            query = query.filter(History.datetime < to_utc(until))
+        if cursor:
+            query = query.filter(
+                tuple_(History.datetime, History.id) > decode_cursor(cursor)
+            )
+
+        history = query.order_by(History.datetime, History.id).limit(limit + 1).all()
+        if len(history) > limit:
+            return history[:limit], encode_cursor(history[limit - 1])
+        return history, None
 
     def insert_entry(self, user_id: UUID, action: Action, user_agent: str):
-        """Метод добавления записи в историю пользователя"""
-        user = self.session.query(User).get({"id": user_id})
-        if not user:
-            raise NotFound("User not found")
-        if user_agents.parse(user_agent).is_pc:
-            device_type = "pc"
-        elif user_agents.parse(user_agent).is_mobile:
-            device_type = "mobile"
-        elif user_agents.parse(user_agent).is_tablet:
-            device_type = "tablet"
-        else:
-            device_type = "undefined"
-        history = History(
-            user_id=user_id,
-            action=action,
-            user_agent=user_agent,
-            device_type=device_type,
-            datetime=datetime.now(tz=timezone.utc),
+        """Метод добавления записи в историю пользователя, запись вставляется в фоне"""
+        user_agent = user_agent or ""
+        self.writer.put(
+            {
+                "user_id": user_id,
+                "action": action,
+                "user_agent": user_agent,
+                "device_type": parse_device_type(user_agent),
+                "datetime": datetime.now(tz=timezone.utc),
+            }
         )
-        self.session.add(history)
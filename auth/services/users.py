@@ -1,16 +1,17 @@
 from typing import Optional
 from uuid import UUID
 
-from passlib.hash import pbkdf2_sha256
 from sqlalchemy.orm import Session
 
 from core.db import User
 from core.exceptions import AuthError, EmailUsedError, NotFound
+from core.passwords import PasswordHasher
 
 
 class UserService:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, hasher: PasswordHasher):
         self.session = session
+        self.hasher = hasher
 
     def get(self, user_id: UUID) -> Optional[User]:
         """Получение пользователя по id"""
@@ -52,8 +53,12 @@ class UserService:
         user = self.session.query(User).filter(User.email == email).first()
         if not user:
             raise AuthError("Invalid email")
-        if not self.verify_password(password=password, password_hash=user.password):
+        valid, new_hash = self.hasher.verify_and_update(password, user.password)
+        if not valid:
             raise AuthError("Invalid password")
+        if new_hash:
+            # Параметры хеширования изменились - пароль пересчитывается при входе
+            user.password = new_hash
         return user
 
     def change_password(self, user_id: UUID, old_password: str, new_password: str):
@@ -63,14 +68,13 @@ class UserService:
             raise NotFound("User not found")
         if not self.verify_password(password=old_password, password_hash=user.password):
             raise AuthError("Invalid old_password")
-        self.session.query(User).filter(User.password == user.password).update(
-            {"password": self.get_hash_password(new_password)}
-        )
+        user.password = self.get_hash_password(new_password)
 
     def get_hash_password(self, password):
         """Получение хэша пароля"""
-        return pbkdf2_sha256.hash(password)
+        return self.hasher.hash(password)
 
     def verify_password(self, password, password_hash):
         """Верификация пароля"""
-        return pbkdf2_sha256.verify(password, password_hash)
+        valid, _ = self.hasher.verify_and_update(password, password_hash)
+        return valid
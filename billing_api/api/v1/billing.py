@@ -6,14 +6,15 @@ from tortoise.transactions import in_transaction
 
 from core.auth import auth_current_user
 from core.helpers import get_amount, get_refund_amount
-from core.roles import get_roles_client
 from core.stripe import get_stripe
 from db.repositories.order import OrderRepository
 from db.repositories.payment_method import PaymentMethodRepository
+from db.repositories.role_outbox import RoleOutboxRepository
 from db.repositories.subscription import SubscriptionRepository
 from db.repositories.user_subscription import UserSubscriptionRepository
 from models.api_models import PaymentDataIn
-from models.common_models import OrderStatus, SubscriptionState
+from models.common_models import (OrderStatus, RoleChange, RoleOperation,
+                                  SubscriptionState)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -146,7 +147,7 @@ async def confirm_subscription_payment(
 @router.post("/subscription/refund")
 async def refund_subscription(
     auth_user=Depends(auth_current_user),
-    roles_client=Depends(get_roles_client),
+    role_outbox_repository=Depends(RoleOutboxRepository),
     stripe_client=Depends(get_stripe),
     order_repository=Depends(OrderRepository),
     user_subscription_repository=Depends(UserSubscriptionRepository),
@@ -210,12 +211,17 @@ async def refund_subscription(
         )
         logger.info("Subscription %s update status to inactive", user_subscription.id)
 
-        await roles_client.revoke_role(
-            user_id=refund_order.user_id,
-            role_title=f"subscriber_{refund_order.subscription.type.value}",
+        await role_outbox_repository.add_role_changes(
+            [
+                RoleChange(
+                    user_id=refund_order.user_id,
+                    role_title=f"subscriber_{refund_order.subscription.type.value}",
+                    op=RoleOperation.REVOKE,
+                )
+            ]
         )
         logger.info(
-            "Roles subscriber_%s has revoke from user %s",
+            "Role subscriber_%s is queued for revoke from user %s",
             refund_order.subscription.type.value,
             refund_order.user_id,
         )
@@ -227,10 +233,10 @@ async def cancel_subscription(
     user_subscription_repository=Depends(UserSubscriptionRepository),
 ) -> None:
     """Метод отказа от подписки (отказа от автоматической пролонгации)"""
-    user_subscription = await user_subscription_repository.get_user_subscription(
-        user_id=auth_user.user_id,
-        subscription__automatic=True,
-        status=[SubscriptionState.ACTIVE],
+    user_subscription = (
+        await user_subscription_repository.get_user_automatic_subscription(
+            user_id=auth_user.user_id, status=[SubscriptionState.ACTIVE]
+        )
     )
     if not user_subscription:
         logger.info(
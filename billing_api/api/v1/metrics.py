@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+
+from core.auth import get_token_cache, service_required
+from core.catalog import get_subscription_catalog
+from core.http import get_auth_http_client
+from core.outbox import get_role_outbox_dispatcher
+from core.stripe import get_stripe
+from db.repositories.role_outbox import RoleOutboxRepository
+
+# Метрики раскрывают состояние очередей и пулов, поэтому доступны только по SERVICE_TOKEN
+router = APIRouter(dependencies=[Depends(service_required)])
+
+
+@router.get("/metrics")
+async def metrics(
+    stripe_client=Depends(get_stripe),
+    auth_http_client=Depends(get_auth_http_client),
+    token_cache=Depends(get_token_cache),
+    role_outbox_dispatcher=Depends(get_role_outbox_dispatcher),
+    role_outbox_repository=Depends(RoleOutboxRepository),
+    subscription_catalog=Depends(get_subscription_catalog),
+) -> dict:
+    """Метод просмотра метрик пулов соединений, кешей и очереди изменений ролей"""
+    return {
+        "stripe": stripe_client.metrics.snapshot(),
+        "auth": auth_http_client.metrics.snapshot(),
+        "token_cache": token_cache.snapshot(),
+        "subscription_catalog": subscription_catalog.snapshot(),
+        "role_outbox": {
+            **role_outbox_dispatcher.snapshot(),
+            **await role_outbox_repository.get_stats(),
+        },
+    }
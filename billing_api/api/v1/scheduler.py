@@ -1,20 +1,148 @@
 import logging
-from datetime import date, timedelta
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import UUID4
 from tortoise.transactions import in_transaction
 
-from core.helpers import get_amount
-from core.roles import get_roles_client
-from core.stripe import get_stripe
+from core.config import (CHECK_CHUNK_SIZE, PROCESSING_PAGE_SIZE,
+                         PROCESSING_PAGE_SIZE_MAX, RENEWAL_BATCH_SIZE,
+                         RENEWAL_BATCH_SIZE_MAX, RENEWAL_CONCURRENCY,
+                         RENEWAL_RATE_LIMIT, STRIPE_CONCURRENCY)
+from core.helpers import (chunked, decode_cursor, encode_cursor,
+                          gather_with_concurrency, ndjson)
+from core.renewal import RecurringPaymentRunner
+from core.stripe import StripeClient, get_stripe
 from db.repositories.order import OrderRepository
+from db.repositories.role_outbox import RoleOutboxRepository
 from db.repositories.user_subscription import UserSubscriptionRepository
-from models.api_models import ExpireUserSubscriptionData, OrderApiModel
-from models.common_models import OrderStatus, SubscriptionState
+from models.api_models import (SUBSCRIPTION_FIELDS, CheckResultOut,
+                               ExpireUserSubscriptionData, ExternalIdsIn,
+                               OrderApiModel, RenewalReportOut)
+from models.common_models import (CheckResult, OrderStatus, PaymentInner,
+                                  RenewalResult, RoleChange, RoleOperation,
+                                  SubscriptionState)
+from models.db_models import Order
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+PROCESSING_ORDER_FIELDS = (
+    "id",
+    "created",
+    "external_id",
+    "user_id",
+    "user_email",
+    "status",
+    "payment_system",
+    "currency",
+    "discount",
+    "total_cost",
+    "refund",
+)
+# Планировщику для проверки нужен только external_id, остальное - для логов
+PROCESSING_STREAM_FIELDS = ("id", "created", "external_id", "user_id")
+
+
+async def _fetch_succeeded(
+    external_ids: list[str], fetch: Callable[[str], Awaitable[PaymentInner]]
+) -> tuple[list[str], dict[str, CheckResult]]:
+    """Конкурентный запрос статусов платежей (возвратов) в stripe.
+    Возвращает идентификаторы успешных операций и результаты для всех остальных"""
+    responses = await gather_with_concurrency(
+        STRIPE_CONCURRENCY, *(fetch(external_id) for external_id in external_ids)
+    )
+    succeeded, results = [], {}
+    for external_id, response in zip(external_ids, responses):
+        if isinstance(response, Exception):
+            logger.error(
+                "Error when requesting stripe for %s: %s", external_id, response
+            )
+            results[external_id] = CheckResult.ERROR
+        elif response.status == "succeeded":
+            succeeded.append(external_id)
+        else:
+            results[external_id] = CheckResult.PENDING
+    return succeeded, results
+
+
+async def _apply_checked_orders(
+    external_ids: list[str],
+    refund: bool,
+    apply: Callable[[list[Order]], Awaitable[None]],
+    order_repository: OrderRepository,
+) -> dict[str, CheckResult]:
+    """
+    Применение изменений по успешным операциям одной транзакцией.
+    Применяются только заказы, которые под блокировкой всё ещё в обработке,
+    поэтому повторный или параллельный вызов не применит их второй раз
+    """
+    results = {external_id: CheckResult.NOT_FOUND for external_id in external_ids}
+    orders = []
+    try:
+        async with in_transaction():
+            orders = await order_repository.lock_processing_orders_by_external_ids(
+                external_ids=external_ids, refund=refund
+            )
+            if not orders:
+                return results
+            await order_repository.update_orders_status(
+                order_ids=[order.id for order in orders], status=OrderStatus.PAID
+            )
+            await apply(orders)
+    except Exception as e:
+        logger.exception("Error when applying checked orders: %s", e)
+        results.update({order.external_id: CheckResult.ERROR for order in orders})
+        return results
+
+    results.update({order.external_id: CheckResult.PAID for order in orders})
+    return results
+
+
+async def _processing_orders_page(
+    refund: bool,
+    limit: int,
+    cursor: Optional[str],
+    response: Response,
+    order_repository: OrderRepository,
+) -> list[OrderApiModel]:
+    """Страница заказов (возвратов) в обработке по курсору"""
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    rows = await order_repository.get_processing_orders_page(
+        refund=refund,
+        limit=limit,
+        fields=PROCESSING_ORDER_FIELDS,
+        subscription_fields=SUBSCRIPTION_FIELDS,
+        after=after,
+    )
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            rows[-1]["created"], rows[-1]["id"]
+        )
+    return [OrderApiModel(**row) for row in rows]
+
+
+def _processing_orders_stream(
+    refund: bool, order_repository: OrderRepository
+) -> StreamingResponse:
+    """Все заказы (возвраты) в обработке потоком NDJSON, память не зависит от их числа"""
+    return StreamingResponse(
+        ndjson(
+            order_repository.iter_processing_orders(
+                refund=refund,
+                fields=PROCESSING_STREAM_FIELDS,
+                batch_size=PROCESSING_PAGE_SIZE,
+            )
+        ),
+        media_type="application/x-ndjson",
+    )
+
 
 @router.get(
     "/subscriptions/automatic/active", response_model=list[ExpireUserSubscriptionData]
@@ -30,7 +158,7 @@ async def expiring_active_subscriptions_automatic(
     return [
         ExpireUserSubscriptionData(
             user_id=user_subscription.user_id,
-            subscription_id=user_subscription.subscription.id,
+            subscription_id=user_subscription.subscription_id,
         )
         for user_subscription in user_subscriptions
     ]
@@ -38,15 +166,27 @@ async def expiring_active_subscriptions_automatic(
 
 @router.get("/orders/processing", response_model=list[OrderApiModel])
 async def processing_orders(
+    response: Response,
+    limit: int = Query(PROCESSING_PAGE_SIZE, ge=1, le=PROCESSING_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     order_repository=Depends(OrderRepository),
 ) -> list[OrderApiModel]:
-    """Метод просмотра заказов в обработке"""
-    orders = await order_repository.get_processing_orders()
-    logger.info("All orders are collected in progress")
-    return [
-        OrderApiModel(subscription=order.subscription.__dict__, **order.__dict__)
-        for order in orders
-    ]
+    """Метод просмотра страницы заказов в обработке, курсор следующей страницы в X-Next-Cursor"""
+    return await _processing_orders_page(
+        refund=False,
+        limit=limit,
+        cursor=cursor,
+        response=response,
+        order_repository=order_repository,
+    )
+
+
+@router.get("/orders/processing/stream")
+async def processing_orders_stream(
+    order_repository=Depends(OrderRepository),
+) -> StreamingResponse:
+    """Метод выгрузки всех заказов в обработке потоком NDJSON"""
+    return _processing_orders_stream(refund=False, order_repository=order_repository)
 
 
 @router.get("/order/{order_external_id:str}/check")
@@ -55,7 +195,7 @@ async def check_order_payment(
     stripe_client=Depends(get_stripe),
     order_repository=Depends(OrderRepository),
     user_subscription_repository=Depends(UserSubscriptionRepository),
-    roles_client=Depends(get_roles_client),
+    role_outbox_repository=Depends(RoleOutboxRepository),
 ) -> None:
     """Метод проверки оплаты заказа"""
     payment = await stripe_client.get_payment_data(payment_intents_id=order_external_id)
@@ -75,30 +215,95 @@ async def check_order_payment(
                 order.subscription.id,
                 order.user_id,
             )
-            await roles_client.grant_role(
-                user_id=order.user_id,
-                role_title=f"subscriber_{order.subscription.type.value}",
+            await role_outbox_repository.add_role_changes(
+                [
+                    RoleChange(
+                        user_id=order.user_id,
+                        role_title=f"subscriber_{order.subscription.type.value}",
+                        op=RoleOperation.GRANT,
+                    )
+                ]
             )
             logger.info(
-                "Roles subscriber_%s has grant to user %s",
+                "Role subscriber_%s is queued for grant to user %s",
                 order.subscription.type.value,
                 order.user_id,
             )
 
 
+@router.post("/orders/check", response_model=list[CheckResultOut])
+async def check_orders_payment(
+    orders_data: ExternalIdsIn,
+    stripe_client=Depends(get_stripe),
+    order_repository=Depends(OrderRepository),
+    user_subscription_repository=Depends(UserSubscriptionRepository),
+    role_outbox_repository=Depends(RoleOutboxRepository),
+) -> list[CheckResultOut]:
+    """Метод пакетной проверки оплаты заказов"""
+
+    async def activate_subscriptions(orders: list[Order]) -> None:
+        await user_subscription_repository.create_users_subscriptions(
+            orders=orders, status=SubscriptionState.ACTIVE
+        )
+        await role_outbox_repository.add_role_changes(
+            [
+                RoleChange(
+                    user_id=order.user_id,
+                    role_title=f"subscriber_{order.subscription.type.value}",
+                    op=RoleOperation.GRANT,
+                )
+                for order in orders
+            ]
+        )
+
+    results: dict[str, CheckResult] = {}
+    for chunk in chunked(orders_data.external_ids, CHECK_CHUNK_SIZE):
+        paid_ids, chunk_results = await _fetch_succeeded(
+            external_ids=chunk,
+            fetch=lambda external_id: stripe_client.get_payment_data(
+                payment_intents_id=external_id
+            ),
+        )
+        results.update(chunk_results)
+        if paid_ids:
+            results.update(
+                await _apply_checked_orders(
+                    external_ids=paid_ids,
+                    refund=False,
+                    apply=activate_subscriptions,
+                    order_repository=order_repository,
+                )
+            )
+    logger.info("%s orders are checked", len(orders_data.external_ids))
+    return [
+        CheckResultOut(external_id=external_id, result=results[external_id])
+        for external_id in orders_data.external_ids
+    ]
+
+
 @router.get("/refunds/processing", response_model=list[OrderApiModel])
 async def processing_refunds(
+    response: Response,
+    limit: int = Query(PROCESSING_PAGE_SIZE, ge=1, le=PROCESSING_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     order_repository=Depends(OrderRepository),
 ) -> list[OrderApiModel]:
-    """Метод просмотра возвратов в обработке"""
-    refunds_orders = await order_repository.get_processing_refunds()
-    logger.info("All refunds are collected in progress")
-    return [
-        OrderApiModel(
-            subscription=refund_order.subscription.__dict__, **refund_order.__dict__
-        )
-        for refund_order in refunds_orders
-    ]
+    """Метод просмотра страницы возвратов в обработке, курсор следующей страницы в X-Next-Cursor"""
+    return await _processing_orders_page(
+        refund=True,
+        limit=limit,
+        cursor=cursor,
+        response=response,
+        order_repository=order_repository,
+    )
+
+
+@router.get("/refunds/processing/stream")
+async def processing_refunds_stream(
+    order_repository=Depends(OrderRepository),
+) -> StreamingResponse:
+    """Метод выгрузки всех возвратов в обработке потоком NDJSON"""
+    return _processing_orders_stream(refund=True, order_repository=order_repository)
 
 
 @router.get("/refund/{refund_external_id:str}/check")
@@ -107,7 +312,7 @@ async def check_refund_order(
     stripe_client=Depends(get_stripe),
     order_repository=Depends(OrderRepository),
     user_subscription_repository=Depends(UserSubscriptionRepository),
-    roles_client=Depends(get_roles_client),
+    role_outbox_repository=Depends(RoleOutboxRepository),
 ) -> None:
     """Метод проверяет прошёл ли возврат"""
     refund = await stripe_client.get_refund_data(refund_order_id=refund_external_id)
@@ -130,60 +335,180 @@ async def check_refund_order(
                 refund_order.subscription.id,
                 refund_order.user_id,
             )
-            await roles_client.revoke_role(
-                user_id=refund_order.user_id,
-                role_title=f"subscriber_{refund_order.subscription.type.value}",
+            await role_outbox_repository.add_role_changes(
+                [
+                    RoleChange(
+                        user_id=refund_order.user_id,
+                        role_title=f"subscriber_{refund_order.subscription.type.value}",
+                        op=RoleOperation.REVOKE,
+                    )
+                ]
             )
             logger.info(
-                "Roles subscriber_%s has revoke from user %s",
+                "Role subscriber_%s is queued for revoke from user %s",
                 refund_order.subscription.type.value,
                 refund_order.user_id,
             )
 
 
+@router.post("/refunds/check", response_model=list[CheckResultOut])
+async def check_refunds_orders(
+    refunds_data: ExternalIdsIn,
+    stripe_client=Depends(get_stripe),
+    order_repository=Depends(OrderRepository),
+    user_subscription_repository=Depends(UserSubscriptionRepository),
+    role_outbox_repository=Depends(RoleOutboxRepository),
+) -> list[CheckResultOut]:
+    """Метод пакетной проверки возвратов"""
+
+    async def deactivate_subscriptions(refund_orders: list[Order]) -> None:
+        await user_subscription_repository.update_user_subscriptions_status_by_orders(
+            orders=refund_orders, status=SubscriptionState.INACTIVE
+        )
+        await role_outbox_repository.add_role_changes(
+            [
+                RoleChange(
+                    user_id=refund_order.user_id,
+                    role_title=f"subscriber_{refund_order.subscription.type.value}",
+                    op=RoleOperation.REVOKE,
+                )
+                for refund_order in refund_orders
+            ]
+        )
+
+    results: dict[str, CheckResult] = {}
+    for chunk in chunked(refunds_data.external_ids, CHECK_CHUNK_SIZE):
+        refunded_ids, chunk_results = await _fetch_succeeded(
+            external_ids=chunk,
+            fetch=lambda external_id: stripe_client.get_refund_data(
+                refund_order_id=external_id
+            ),
+        )
+        results.update(chunk_results)
+        if refunded_ids:
+            results.update(
+                await _apply_checked_orders(
+                    external_ids=refunded_ids,
+                    refund=True,
+                    apply=deactivate_subscriptions,
+                    order_repository=order_repository,
+                )
+            )
+    logger.info("%s refunds are checked", len(refunds_data.external_ids))
+    return [
+        CheckResultOut(external_id=external_id, result=results[external_id])
+        for external_id in refunds_data.external_ids
+    ]
+
+
 @router.get("/subscriptions/expired/disable")
 async def disabling_expired_subscriptions(
     user_subscription_repository=Depends(UserSubscriptionRepository),
-    roles_client=Depends(get_roles_client),
+    role_outbox_repository=Depends(RoleOutboxRepository),
 ) -> None:
-    """Метод отключает истёкшие подписки"""
-    await user_subscription_repository.update_expired_user_subscription()
-    inactive_user_subscriptions = (
-        await user_subscription_repository.get_inactive_user_subscriptions()
-    )
-    for user_subscription in inactive_user_subscriptions:
-        await roles_client.revoke_role(
-            user_id=user_subscription.user_id,
-            role_title=f"subscriber_{user_subscription.subscription.type.value}",
+    """Метод отключает истёкшие подписки и отзывает роли только у изменившихся"""
+    async with in_transaction() as connection:
+        expired = await user_subscription_repository.disable_expired_user_subscriptions(
+            connection
         )
-
-        logger.info(
-            "Roles subscriber_%s has revoke from user %s",
-            user_subscription.subscription.type.value,
-            user_subscription.user_id,
+        await role_outbox_repository.add_role_changes(
+            [
+                RoleChange(
+                    user_id=user_id,
+                    role_title=f"subscriber_{subscription_type.value}",
+                    op=RoleOperation.REVOKE,
+                )
+                for user_id, subscription_type in expired
+            ]
         )
+    logger.info("Subscriber roles are queued for revoke from %s users", len(expired))
 
 
 @router.get("/subscriptions/preactive/enable")
 async def enable_preactive_subscriptions(
     user_subscription_repository=Depends(UserSubscriptionRepository),
-    roles_client=Depends(get_roles_client),
+    role_outbox_repository=Depends(RoleOutboxRepository),
 ) -> None:
-    """Метод включает предактивные подписки"""
-    await user_subscription_repository.update_preactive_user_subscription()
-    active_user_subscriptions = (
-        await user_subscription_repository.get_active_user_subscriptions()
-    )
-    for user_subscription in active_user_subscriptions:
-        await roles_client.grant_role(
-            user_id=user_subscription.user_id,
-            role_title=f"subscriber_{user_subscription.subscription.type.value}",
+    """Метод включает предактивные подписки и выдаёт роли только включённым"""
+    async with in_transaction() as connection:
+        enabled = (
+            await user_subscription_repository.enable_preactive_user_subscriptions(
+                connection
+            )
         )
-        logger.info(
-            "Roles subscriber_%s has grant to user %s",
-            user_subscription.subscription.type.value,
-            user_subscription.user_id,
+        await role_outbox_repository.add_role_changes(
+            [
+                RoleChange(
+                    user_id=user_id,
+                    role_title=f"subscriber_{subscription_type.value}",
+                    op=RoleOperation.GRANT,
+                )
+                for user_id, subscription_type in enabled
+            ]
         )
+    logger.info("Subscriber roles are queued for grant to %s users", len(enabled))
+
+
+def _recurring_payment_runner(
+    stripe_client: StripeClient,
+    order_repository: OrderRepository,
+    user_subscription_repository: UserSubscriptionRepository,
+    rate_limit: float = RENEWAL_RATE_LIMIT,
+) -> RecurringPaymentRunner:
+    return RecurringPaymentRunner(
+        stripe_client=stripe_client,
+        order_repository=order_repository,
+        user_subscription_repository=user_subscription_repository,
+        concurrency=RENEWAL_CONCURRENCY,
+        rate_limit=rate_limit,
+    )
+
+
+@router.post("/subscriptions/automatic/renew", response_model=RenewalReportOut)
+async def renew_expiring_subscriptions_automatic(
+    limit: int = Query(RENEWAL_BATCH_SIZE, ge=1, le=RENEWAL_BATCH_SIZE_MAX),
+    cursor: Optional[UUID4] = None,
+    rate_limit: float = Query(RENEWAL_RATE_LIMIT, gt=0, le=RENEWAL_RATE_LIMIT),
+    user_subscription_repository=Depends(UserSubscriptionRepository),
+    order_repository=Depends(OrderRepository),
+    stripe_client=Depends(get_stripe),
+) -> RenewalReportOut:
+    """
+    Метод продления страницы автоматических подписок, срок действия которых истекает завтра.
+    Курсор следующей страницы - в next_cursor, повтор страницы не списывает деньги повторно
+    """
+    started = time.monotonic()
+    user_subscriptions = await user_subscription_repository.get_expiring_active_subscriptions_automatic_page(
+        limit=limit, after=cursor
+    )
+    results = Counter(
+        await _recurring_payment_runner(
+            stripe_client, order_repository, user_subscription_repository, rate_limit
+        ).renew(user_subscriptions)
+    )
+    elapsed = time.monotonic() - started
+    report = RenewalReportOut(
+        total=len(user_subscriptions),
+        renewed=results[RenewalResult.RENEWED],
+        skipped=results[RenewalResult.SKIPPED],
+        declined=results[RenewalResult.DECLINED],
+        errors=results[RenewalResult.ERROR],
+        elapsed=elapsed,
+        per_second=len(user_subscriptions) / elapsed if elapsed else 0.0,
+        next_cursor=user_subscriptions[-1].id
+        if len(user_subscriptions) == limit
+        else None,
+    )
+    logger.info(
+        "Renewal of %s subscriptions: %s renewed, %s skipped, %s declined, %s errors in %.3f s",
+        report.total,
+        report.renewed,
+        report.skipped,
+        report.declined,
+        report.errors,
+        report.elapsed,
+    )
+    return report
 
 
 @router.post("/subscription/recurring_payment")
@@ -193,45 +518,25 @@ async def recurring_payment(
     order_repository=Depends(OrderRepository),
     stripe_client=Depends(get_stripe),
 ) -> None:
-    """Метод по списанию рекурентных платежей"""
-    user_order = await order_repository.get_order(
+    """Метод по списанию рекурентного платежа за одну подписку"""
+    user_subscription = await user_subscription_repository.get_user_subscription(
         user_id=user_subscription_data.user_id,
-        status=OrderStatus.PAID,
-        subscription__id=user_subscription_data.subscription_id,
-        parent_id=None,
-    )
-
-    child_order = await order_repository.get_recurrent_order(
-        order_parend_id=user_order.id
+        status=[SubscriptionState.ACTIVE],
+        subscription_id=user_subscription_data.subscription_id,
     )
-    if not child_order:
-        async with in_transaction():
-            child_order = await order_repository.create_recurrent_order(
-                order=user_order
-            )
-            payment = await stripe_client.create_recurrent_payment(
-                customer_id=child_order.user_id,
-                user_email=child_order.user_email,
-                amount=get_amount(child_order.total_cost),
-                currency=child_order.currency.value,
-                payment_method_id=child_order.payment_method.id,
-            )
-            if payment.status == "succeeded":
-                await order_repository.update_order_external_id(
-                    order_id=child_order.id,
-                    external_id=payment.id,
-                    status=OrderStatus.PAID,
-                )
-                await user_subscription_repository.create_user_subscriptions(
-                    order=child_order,
-                    status=SubscriptionState.PREACTIVE,
-                    start_date=date.today() + timedelta(days=1),
-                    end_date=date.today()
-                    + timedelta(days=1 + child_order.subscription.period),
-                )
-
-                return
+    if not user_subscription:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND, detail="User has no active subscription"
+        )
 
-            raise Exception(
-                f"Error when trying recurrent payment for subscription {child_order.subscription},user {child_order.id}"
-            )
+    [result] = await _recurring_payment_runner(
+        stripe_client, order_repository, user_subscription_repository
+    ).renew([user_subscription])
+    if result == RenewalResult.DECLINED:
+        raise HTTPException(
+            status.HTTP_402_PAYMENT_REQUIRED, detail="Recurring payment is declined"
+        )
+    if result == RenewalResult.ERROR:
+        raise HTTPException(
+            status.HTTP_502_BAD_GATEWAY, detail="Recurring payment is failed"
+        )
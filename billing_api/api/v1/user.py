@@ -1,43 +1,111 @@
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 
 from core.auth import auth_current_user
+from core.config import USER_PAGE_SIZE, USER_PAGE_SIZE_MAX
+from core.helpers import decode_cursor, dumps, encode_cursor
 from db.repositories.order import OrderRepository
 from db.repositories.user_subscription import UserSubscriptionRepository
-from models.api_models import OrderApiModel, UserSubscriptionApiModel
+from models.api_models import (ORDER_FIELDS, SUBSCRIPTION_FIELDS,
+                               USER_SUBSCRIPTION_FIELDS, OrderApiModel,
+                               UserSubscriptionApiModel)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+FIELDS_DESCRIPTION = (
+    "Поля через запятую, поля подписки - subscription.<поле> или subscription целиком. "
+    "id и created возвращаются всегда"
+)
+
+
+def _parse_fields(
+    fields: Optional[str], own_fields: tuple[str, ...]
+) -> tuple[list[str], list[str]]:
+    """
+    Поля выборки values() по параметру fields, по умолчанию - все поля ответа.
+    Возвращает собственные поля и поля подписки
+    """
+    requested = fields.split(",") if fields else [*own_fields, "subscription"]
+    selected, subscription_selected = ["id", "created"], []
+    for field in requested:
+        field = field.strip()
+        if field in own_fields:
+            names, target = [field], selected
+        elif field == "subscription":
+            names, target = SUBSCRIPTION_FIELDS, subscription_selected
+        elif field.startswith("subscription.") and (
+            field[len("subscription.") :] in SUBSCRIPTION_FIELDS
+        ):
+            names, target = [field[len("subscription.") :]], subscription_selected
+        else:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST, detail=f"Unknown field {field}"
+            )
+        target.extend(name for name in names if name not in target)
+    return selected, subscription_selected
+
+
+def _parse_cursor(cursor: Optional[str]):
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _page_response(rows: list[dict], limit: int) -> Response:
+    """Страница строк из базы сразу в json, курсор следующей страницы в X-Next-Cursor"""
+    headers = {}
+    if len(rows) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created"], rows[-1]["id"])
+    return Response(
+        content=dumps(rows),
+        media_type="application/json",
+        headers=headers,
+    )
+
 
 @router.get("/user/subscriptions", response_model=list[UserSubscriptionApiModel])
 async def user_subscriptions(
+    limit: int = Query(USER_PAGE_SIZE, ge=1, le=USER_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     auth_user=Depends(auth_current_user),
     user_subscription_repository=Depends(UserSubscriptionRepository),
-) -> list[UserSubscriptionApiModel]:
-    """Метод просмотра всех подписок пользователя"""
-    subscriptions = (
-        await user_subscription_repository.get_user_subscriptions_by_user_id(
-            user_id=auth_user.user_id
-        )
+) -> Response:
+    """Метод просмотра подписок пользователя, от новых к старым, по страницам"""
+    own_fields, subscription_fields = _parse_fields(fields, USER_SUBSCRIPTION_FIELDS)
+    rows = await user_subscription_repository.get_user_subscriptions_page(
+        user_id=auth_user.user_id,
+        limit=limit,
+        fields=own_fields,
+        subscription_fields=subscription_fields,
+        before=_parse_cursor(cursor),
     )
-    logger.info("All subscriptions of the user %s are collected", auth_user.user_id)
-
-    return [
-        UserSubscriptionApiModel(subscription=sub.subscription.__dict__, **sub.__dict__)
-        for sub in subscriptions
-    ]
+    logger.info(
+        "%s subscriptions of the user %s are collected", len(rows), auth_user.user_id
+    )
+    return _page_response(rows, limit)
 
 
 @router.get("/user/orders", response_model=list[OrderApiModel])
 async def user_orders(
-    auth_user=Depends(auth_current_user), order_repository=Depends(OrderRepository)
-) -> list[OrderApiModel]:
-    """Метод просмотра всех заказов пользователя"""
-    orders = await order_repository.get_user_orders(user_id=auth_user.user_id)
-    logger.info("All orders of the user %s are collected", auth_user.user_id)
-    return [
-        OrderApiModel(subscription=order.subscription.__dict__, **order.__dict__)
-        for order in orders
-    ]
+    limit: int = Query(USER_PAGE_SIZE, ge=1, le=USER_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    auth_user=Depends(auth_current_user),
+    order_repository=Depends(OrderRepository),
+) -> Response:
+    """Метод просмотра заказов пользователя, от новых к старым, по страницам"""
+    own_fields, subscription_fields = _parse_fields(fields, ORDER_FIELDS)
+    rows = await order_repository.get_user_orders_page(
+        user_id=auth_user.user_id,
+        limit=limit,
+        fields=own_fields,
+        subscription_fields=subscription_fields,
+        before=_parse_cursor(cursor),
+    )
+    logger.info("%s orders of the user %s are collected", len(rows), auth_user.user_id)
+    return _page_response(rows, limit)
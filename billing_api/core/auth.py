@@ -1,45 +1,164 @@
+import hmac
+import json
 import logging
+import time
+from hashlib import sha256
 from typing import Optional
 
 import httpx
+import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
 
+from core.config import SERVICE_TOKEN
+from core.http import HttpClient
+from core.revocation import RevocationListener
+from core.token_cache import TokenCache
 from models.common_models import AuthUserInner
 
 logger = logging.getLogger(__name__)
 
+ASYMMETRIC_ALGORITHMS = ["RS256", "EdDSA"]
+
 
 class AuthClient:
-    def __init__(self, base_url):
-        self.base_url = base_url
+    def __init__(self, http_client: HttpClient):
+        self.http_client = http_client
 
     async def check_token(self, token):
-        async with httpx.AsyncClient(base_url=self.base_url) as client:
-            return await client.post(
-                "/staff/api/v1/auth/check_token/", json={"token": token}
+        return await self.http_client.request(
+            "POST", "/staff/api/v1/auth/check_token/", json={"token": token}
+        )
+
+
+class LocalVerificationUnavailable(Exception):
+    """Токен нельзя проверить локально, нужна проверка в сервисе auth"""
+
+
+class LocalTokenVerifier:
+    """Проверка access токенов без запроса в auth: по опубликованным ключам и локальному списку отозванных"""
+
+    def __init__(
+        self,
+        jwks_url: str,
+        revocation: RevocationListener,
+        http_client: HttpClient,
+        jwks_cache_seconds: float = 300,
+        jwks_refresh_interval: float = 10,
+    ):
+        self.jwks_url = jwks_url
+        self.revocation = revocation
+        self.http_client = http_client
+        self.jwks_cache_seconds = jwks_cache_seconds
+        self.jwks_refresh_interval = jwks_refresh_interval
+        self.keys: dict[str, jwt.PyJWK] = {}
+        self._keys_loaded_at = 0.0
+
+    async def _load_keys(self) -> None:
+        try:
+            response = await self.http_client.request("GET", self.jwks_url)
+            response.raise_for_status()
+            jwks = jwt.PyJWKSet.from_dict(response.json())
+        except (httpx.HTTPError, jwt.PyJWKSetError, ValueError) as exc:
+            raise LocalVerificationUnavailable(f"Failed to load JWKS: {exc}")
+        self.keys = {key.key_id: key for key in jwks.keys}
+        self._keys_loaded_at = time.monotonic()
+
+    async def _get_key(self, kid: str) -> jwt.PyJWK:
+        """Ключ по kid. Неизвестный kid (ротация ключей) перезагружает набор ключей не чаще раза в интервал"""
+        age = time.monotonic() - self._keys_loaded_at
+        if age > self.jwks_cache_seconds or (
+            kid not in self.keys and age > self.jwks_refresh_interval
+        ):
+            await self._load_keys()
+        if kid not in self.keys:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid}")
+        return self.keys[kid]
+
+    async def verify(self, token: str) -> AuthUserInner:
+        """
+        Проверка подписи, срока действия и отзыва токена
+
+        :raises jwt.InvalidTokenError: Токен невалиден или отозван
+        :raises LocalVerificationUnavailable: Токен надо проверить в сервисе auth
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        if not kid:
+            raise LocalVerificationUnavailable(
+                "Token is not signed with a published key"
             )
+        if not self.revocation.synced:
+            raise LocalVerificationUnavailable("Revoked tokens are not synced")
+
+        key = await self._get_key(kid)
+        payload = jwt.decode(
+            token,
+            key=key.key,
+            algorithms=ASYMMETRIC_ALGORITHMS,
+            options={"require": ["exp", "iat"]},
+        )
+        # Токены, выпущенные до появления jti, отзываются по хешу самого токена
+        jti = payload.get("jti") or sha256(token.encode()).hexdigest()
+        if self.revocation.is_revoked(jti):
+            raise jwt.InvalidTokenError("Access token was revoked")
+        if payload.get("gen", 0) < self.revocation.generation(payload["user_id"]):
+            raise jwt.InvalidTokenError("All user sessions were revoked")
+
+        return AuthUserInner(
+            user_id=payload["user_id"],
+            user_email=payload["user_email"],
+            birthdate=payload.get("birthdate"),
+            country=payload.get("country"),
+            user_roles=json.loads(payload["user_roles"]),
+            user_permissions=json.loads(payload["user_permissions"]),
+        )
 
 
 auth_client: Optional[AuthClient] = None
+token_verifier: Optional[LocalTokenVerifier] = None
+token_cache: Optional[TokenCache] = None
 
 
 def get_auth_client() -> Optional[AuthClient]:
     return auth_client
 
 
+def get_token_verifier() -> Optional[LocalTokenVerifier]:
+    return token_verifier
+
+
+def get_token_cache() -> Optional[TokenCache]:
+    return token_cache
+
+
 api_token_scheme = APIKeyHeader(name="TOKEN")
 
 
 async def auth_current_user(
     token: str = Depends(api_token_scheme),
     auth_client: AuthClient = Depends(get_auth_client),
+    token_verifier: Optional[LocalTokenVerifier] = Depends(get_token_verifier),
+    token_cache: Optional[TokenCache] = Depends(get_token_cache),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate access token",
     )
 
+    if token_verifier:
+        try:
+            return await token_verifier.verify(token)
+        except LocalVerificationUnavailable as exc:
+            logger.warning("Local token verification unavailable: %s", exc)
+        except jwt.InvalidTokenError as exc:
+            logger.info("Access token is invalid: %s", exc)
+            raise credentials_exception
+
+    if token_cache:
+        cached_user = token_cache.get(token)
+        if cached_user:
+            return cached_user
+
     try:
         response = await auth_client.check_token(token)
     except httpx.HTTPError as exc:
@@ -49,5 +168,20 @@ async def auth_current_user(
     if response.status_code != status.HTTP_200_OK:
         raise credentials_exception
 
-    data = response.json()
-    return AuthUserInner(**data)
+    user = AuthUserInner(**response.json())
+    if token_cache:
+        token_cache.put(token, user)
+    return user
+
+
+service_token_scheme = APIKeyHeader(name="X-Service-Token")
+
+
+async def service_required(token: str = Depends(service_token_scheme)) -> None:
+    """Доступ для внутренних сервисов и мониторинга с общим секретом SERVICE_TOKEN"""
+    if not SERVICE_TOKEN or not hmac.compare_digest(
+        token.encode(), SERVICE_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid service token"
+        )
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Iterable, Optional, Sequence
+from uuid import UUID
+
+import asyncpg
+from tortoise.exceptions import BaseORMException
+
+from models.db_models import Subscription
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который пишет триггер на таблице billing_subscription (см. db/triggers.py)
+SUBSCRIPTION_CHANNEL = "billing_subscription_changed"
+RECONNECT_DELAY = 1
+
+
+class SubscriptionNotFound(LookupError):
+    """Подписки, на которую ссылается заказ или подписка пользователя, нет в базе"""
+
+
+class SubscriptionCatalog:
+    """
+    Справочник подписок в памяти процесса.
+
+    Загружается из postgres и перечитывается целиком по уведомлению LISTEN/NOTIFY
+    от триггера на billing_subscription, а также раз в refresh_interval на случай
+    потерянного уведомления. Пока подписка на уведомления не установлена,
+    подписки читаются из базы.
+    """
+
+    def __init__(self, refresh_interval: float = 60):
+        self.refresh_interval = refresh_interval
+        self.subscriptions: dict[UUID, Subscription] = {}
+        self.synced = False
+        self.reloads = 0
+        self.misses = 0
+        self._credentials: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, credentials: dict) -> None:
+        """Загрузка справочника и запуск фоновой подписки на изменения"""
+        self._credentials = credentials
+        await self.reload()
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Остановка подписки"""
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def reload(self) -> None:
+        """Перечитывание всех подписок из базы"""
+        self.subscriptions = {
+            subscription.id: subscription for subscription in await Subscription.all()
+        }
+        self.reloads += 1
+
+    async def get(self, subscription_id: UUID) -> Optional[Subscription]:
+        """Подписка по идентификатору"""
+        subscriptions = await self._resolve([subscription_id])
+        return subscriptions.get(subscription_id)
+
+    async def attach(self, objects: Sequence) -> None:
+        """Подстановка подписок в заказы или подписки пользователей вместо join"""
+        subscriptions = await self._resolve(obj.subscription_id for obj in objects)
+        for obj in objects:
+            obj.subscription = self._pick(subscriptions, obj.subscription_id)
+
+    async def nest(self, rows: list[dict], fields: Sequence[str]) -> list[dict]:
+        """Подстановка полей подписки во вложенный объект строк выборки values()"""
+        if not fields:
+            return rows
+        subscriptions = await self._resolve(row["subscription_id"] for row in rows)
+        for row in rows:
+            subscription = self._pick(subscriptions, row.pop("subscription_id"))
+            row["subscription"] = {
+                field: getattr(subscription, field) for field in fields
+            }
+        return rows
+
+    async def automatic_ids(self) -> list[UUID]:
+        """Идентификаторы подписок с автоматическим продлением"""
+        if not self.synced:
+            self.misses += 1
+            return await Subscription.filter(automatic=True).values_list(
+                "id", flat=True
+            )
+        return [
+            subscription.id
+            for subscription in self.subscriptions.values()
+            if subscription.automatic
+        ]
+
+    def snapshot(self) -> dict:
+        """Состояние справочника"""
+        return {
+            "size": len(self.subscriptions),
+            "synced": self.synced,
+            "reloads": self.reloads,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def _pick(
+        subscriptions: dict[UUID, Subscription], subscription_id: UUID
+    ) -> Subscription:
+        try:
+            return subscriptions[subscription_id]
+        except KeyError:
+            raise SubscriptionNotFound(
+                f"Subscription {subscription_id} does not exist"
+            ) from None
+
+    async def _resolve(self, ids: Iterable[UUID]) -> dict[UUID, Subscription]:
+        ids = set(ids)
+        if self.synced:
+            missing = ids - self.subscriptions.keys()
+        else:
+            missing = ids
+        if not missing:
+            return self.subscriptions
+        # Подписка могла появиться раньше, чем пришло уведомление о ней
+        self.misses += 1
+        subscriptions = {
+            subscription.id: subscription
+            for subscription in await Subscription.filter(id__in=missing)
+        }
+        if self.synced:
+            self.subscriptions = {**self.subscriptions, **subscriptions}
+        return {**self.subscriptions, **subscriptions}
+
+    async def _listen(self) -> None:
+        while True:
+            connection = None
+            changed = asyncio.Event()
+            try:
+                connection = await asyncpg.connect(
+                    host=self._credentials["host"],
+                    port=self._credentials["port"],
+                    user=self._credentials["user"],
+                    password=self._credentials["password"],
+                    database=self._credentials["database"],
+                )
+                await connection.add_listener(
+                    SUBSCRIPTION_CHANNEL, lambda *args: changed.set()
+                )
+                # Справочник загружается после подписки, чтобы не потерять изменения между ними
+                await self.reload()
+                self.synced = True
+                logger.info(
+                    "Subscription catalog is synced, %s subscriptions",
+                    len(self.subscriptions),
+                )
+                while True:
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(changed.wait(), self.refresh_interval)
+                    changed.clear()
+                    # Запрос в том же соединении заодно проверяет, что подписка жива
+                    await connection.execute("SELECT 1")
+                    await self.reload()
+            except (
+                OSError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+                BaseORMException,
+            ) as exc:
+                logger.warning("Subscription catalog subscription is lost: %s", exc)
+            finally:
+                self.synced = False
+                if connection is not None:
+                    with suppress(Exception):
+                        await connection.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+subscription_catalog = SubscriptionCatalog()
+
+
+def get_subscription_catalog() -> SubscriptionCatalog:
+    return subscription_catalog
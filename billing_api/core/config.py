@@ -4,6 +4,26 @@ from core.settings import DatabaseSettings
 
 PROJECT_NAME = "Billing API"
 AUTH_URL = os.getenv("AUTH_URL", "http://localhost:8001/")
+# local - проверка токенов по ключам auth, remote - запрос check_token в auth на каждый вызов
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local")
+AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL", f"{AUTH_URL}.well-known/jwks.json")
+AUTH_JWKS_CACHE_SECONDS = float(os.getenv("AUTH_JWKS_CACHE_SECONDS", 300))
+REDIS_DSN = os.getenv("REDIS_DSN", "redis://localhost:6379")
+AUTH_REDIS_DB = int(os.getenv("AUTH_REDIS_DB", 1))
+# Время жизни access токена в auth: через него удаляются старые поколения сессий
+AUTH_ACCESS_TOKEN_TTL = float(os.getenv("AUTH_ACCESS_TOKEN_TTL", 3600))
+# Кеш результатов check_token: число токенов и максимальное время жизни записи
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+# Общий пул соединений к auth: проверка токенов, ключи и изменения ролей
+AUTH_POOL_LIMIT = int(os.getenv("AUTH_POOL_LIMIT", 100))
+AUTH_POOL_KEEPALIVE = int(os.getenv("AUTH_POOL_KEEPALIVE", 20))
+AUTH_KEEPALIVE_TIMEOUT = float(os.getenv("AUTH_KEEPALIVE_TIMEOUT", 60))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 10))
+AUTH_POOL_TIMEOUT = float(os.getenv("AUTH_POOL_TIMEOUT", 5))
+AUTH_HTTP2 = os.getenv("AUTH_HTTP2", "true").lower() == "true"
+# Общий секрет для внутренних ручек auth (пакетное изменение ролей)
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "")
 
 TORTOISE_CONFIG = {
     "connections": {
@@ -23,3 +43,34 @@ TORTOISE_CONFIG = {
 
 STRIPE_API_KEY = os.getenv("STRIPE_API_KEY", "STRIPE_API_KEY")
 STRIPE_BASE_URL = os.getenv("STRIPE_BASE_URL", "https://api.stripe.com/v1")
+STRIPE_POOL_LIMIT = int(os.getenv("STRIPE_POOL_LIMIT", 100))
+STRIPE_POOL_LIMIT_PER_HOST = int(os.getenv("STRIPE_POOL_LIMIT_PER_HOST", 50))
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", 30))
+STRIPE_KEEPALIVE_TIMEOUT = float(os.getenv("STRIPE_KEEPALIVE_TIMEOUT", 60))
+STRIPE_CONCURRENCY = int(os.getenv("STRIPE_CONCURRENCY", 10))
+# Продление автоматических подписок: платежей за запрос, параллельных платежей
+# и предел частоты запросов в stripe (в секунду) за один запуск
+RENEWAL_BATCH_SIZE = int(os.getenv("RENEWAL_BATCH_SIZE", 500))
+RENEWAL_BATCH_SIZE_MAX = int(os.getenv("RENEWAL_BATCH_SIZE_MAX", 5000))
+RENEWAL_CONCURRENCY = int(os.getenv("RENEWAL_CONCURRENCY", 20))
+RENEWAL_RATE_LIMIT = float(os.getenv("RENEWAL_RATE_LIMIT", 50))
+
+CHECK_CHUNK_SIZE = int(os.getenv("CHECK_CHUNK_SIZE", 100))
+# Сколько внешних идентификаторов можно проверить одним запросом
+CHECK_BATCH_SIZE_MAX = int(os.getenv("CHECK_BATCH_SIZE_MAX", 1000))
+# Размер страницы заказов и подписок пользователя
+USER_PAGE_SIZE = int(os.getenv("USER_PAGE_SIZE", 50))
+USER_PAGE_SIZE_MAX = int(os.getenv("USER_PAGE_SIZE_MAX", 500))
+# Размер страницы заказов в обработке (и пачки чтения при выгрузке потоком)
+PROCESSING_PAGE_SIZE = int(os.getenv("PROCESSING_PAGE_SIZE", 1000))
+PROCESSING_PAGE_SIZE_MAX = int(os.getenv("PROCESSING_PAGE_SIZE_MAX", 10000))
+# Справочник подписок в памяти: как часто перечитывать его без уведомлений из postgres
+SUBSCRIPTION_CATALOG_REFRESH = float(os.getenv("SUBSCRIPTION_CATALOG_REFRESH", 60))
+# Сколько изменений ролей отправляется в auth одним запросом
+ROLE_CHANGES_BATCH_SIZE = int(os.getenv("ROLE_CHANGES_BATCH_SIZE", 1000))
+# Доставка изменений ролей из очереди billing_role_outbox в auth
+ROLE_OUTBOX_INTERVAL = float(os.getenv("ROLE_OUTBOX_INTERVAL", 1))
+ROLE_OUTBOX_MAX_BACKOFF = float(os.getenv("ROLE_OUTBOX_MAX_BACKOFF", 300))
+# На сколько секунд пачка закрепляется за воркером на время запроса в auth,
+# должно быть больше AUTH_TIMEOUT + AUTH_POOL_TIMEOUT
+ROLE_OUTBOX_LEASE = float(os.getenv("ROLE_OUTBOX_LEASE", 60))
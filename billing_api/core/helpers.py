@@ -1,6 +1,14 @@
-from datetime import date
+import asyncio
+import base64
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Optional
+from typing import (AsyncIterator, Awaitable, Iterator, Optional, Sequence,
+                    TypeVar)
+from uuid import UUID
+
+import orjson
+
+T = TypeVar("T")
 
 
 def get_refund_amount(
@@ -18,3 +26,69 @@ def get_refund_amount(
 def get_amount(price: Decimal):
     """Функция пересчёта цены в наименьший денежный эквивалент (руб -> коп, usd -> cent)"""
     return int(price * 100)
+
+
+def chunked(items: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    """Функция разбиения последовательности на части размером не более size"""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+async def gather_with_concurrency(limit: int, *aws: Awaitable) -> list:
+    """Функция конкурентного выполнения корутин с ограничением одновременных вызовов.
+    Исключения возвращаются в списке результатов вместо того, чтобы прерывать остальные вызовы"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=True)
+
+
+class RateLimiter:
+    """Ограничение частоты вызовов: не больше rate вызовов в секунду, равномерно"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Ожидание очередного разрешённого вызова"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+def encode_cursor(created: datetime, id: UUID) -> str:
+    """Функция кодирования курсора следующей страницы: время создания и id последней записи"""
+    return base64.urlsafe_b64encode(f"{created.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Функция разбора курсора страницы, ValueError для некорректного курсора"""
+    value, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(value), UUID(id)
+
+
+def _json_default(value):
+    # Суммы отдаются числами, как их отдавал jsonable_encoder fastapi
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def dumps(value) -> bytes:
+    """Функция сериализации строк из базы в json без промежуточных pydantic моделей"""
+    return orjson.dumps(value, default=_json_default)
+
+
+async def ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Функция сериализации строк в NDJSON: по одному json объекту на строку"""
+    async for row in rows:
+        yield dumps(row) + b"\n"
@@ -0,0 +1,79 @@
+import asyncio
+import importlib.util
+import time
+from typing import Optional
+
+import httpx
+
+from .metrics import PoolMetrics
+
+# HTTP/2 включается, только если установлен пакет h2 (httpx[http2]),
+# и используется только для https: по http httpx всегда работает через HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class HttpClient:
+    """
+    Общий httpx клиент с пулом долгоживущих соединений.
+
+    Число одновременных запросов ограничено размером пула: запрос сверх лимита ждёт
+    свободного соединения не дольше pool_timeout, время ожидания попадает в метрики.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60,
+        timeout: float = 10,
+        pool_timeout: float = 5,
+        http2: bool = True,
+    ):
+        self.pool_timeout = pool_timeout
+        self.metrics = PoolMetrics(limit=max_connections)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, pool=pool_timeout),
+            http2=http2 and HTTP2_AVAILABLE,
+        )
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Запрос через общий пул соединений"""
+        await self._acquire()
+        try:
+            async with self.metrics.track_request():
+                return await self.client.request(method=method, url=url, **kwargs)
+        finally:
+            self._semaphore.release()
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        await self.client.aclose()
+
+    async def _acquire(self) -> None:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        self.metrics.connection_queued()
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.pool_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.errors += 1
+            raise httpx.PoolTimeout("Timed out waiting for a free connection")
+        finally:
+            self.metrics.connection_dequeued(time.monotonic() - queued_at)
+
+
+auth_http_client: Optional[HttpClient] = None
+
+
+def get_auth_http_client() -> Optional[HttpClient]:
+    return auth_http_client
@@ -0,0 +1,88 @@
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import AsyncIterator
+
+from aiohttp import ClientSession, TraceConfig, TraceConnectionQueuedEndParams
+
+
+class PoolMetrics:
+    """Счётчики использования пула соединений http клиента"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.request_seconds = 0.0
+        self.queued = 0
+        self.queued_total = 0
+        self.queue_wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def track_request(self) -> AsyncIterator[None]:
+        """Учёт запроса: число одновременных запросов, ошибки и длительность"""
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            self.request_seconds += time.monotonic() - started
+
+    def connection_queued(self) -> None:
+        """Запрос встал в очередь ожидания свободного соединения"""
+        self.queued += 1
+        self.queued_total += 1
+
+    def connection_dequeued(self, wait_seconds: float) -> None:
+        """Запрос получил соединение из пула"""
+        self.queued -= 1
+        self.queue_wait_seconds += wait_seconds
+
+    def snapshot(self) -> dict:
+        """Текущее состояние счётчиков"""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "saturation": self.in_flight / self.limit if self.limit else 0.0,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_request_seconds": self.request_seconds / self.requests
+            if self.requests
+            else 0.0,
+            "queued": self.queued,
+            "queued_total": self.queued_total,
+            "avg_queue_wait_seconds": self.queue_wait_seconds / self.queued_total
+            if self.queued_total
+            else 0.0,
+        }
+
+
+def aiohttp_trace_config(metrics: PoolMetrics) -> TraceConfig:
+    """Трассировка aiohttp, сообщающая о времени ожидания соединения из пула"""
+
+    async def on_queued_start(
+        session: ClientSession, context: SimpleNamespace, params
+    ) -> None:
+        context.queued_at = time.monotonic()
+        metrics.connection_queued()
+
+    async def on_queued_end(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceConnectionQueuedEndParams,
+    ) -> None:
+        metrics.connection_dequeued(time.monotonic() - context.queued_at)
+
+    trace_config = TraceConfig()
+    trace_config.on_connection_queued_start.append(on_queued_start)
+    trace_config.on_connection_queued_end.append(on_queued_end)
+    return trace_config
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import timedelta
+from typing import Optional
+
+import httpx
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from core.roles import RolesService
+from db.repositories.role_outbox import RoleOutboxRepository
+from models.common_models import RoleChange
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: пачку из начала очереди выбирает только один воркер billing
+# одновременно, иначе изменения ролей одного пользователя могли бы прийти в auth
+# не по порядку
+OUTBOX_LOCK_KEY = 7_310_018
+# Ответы auth, после которых повтор имеет смысл
+RETRY_STATUSES = {408, 425, 429}
+
+
+class RoleOutboxDispatcher:
+    """
+    Доставка изменений ролей из очереди в auth.
+
+    Изменения отправляются пачками в порядке добавления. Пачка выбирается и
+    закрепляется за воркером на lease секунд в короткой транзакции под advisory lock,
+    запрос в auth идёт вне транзакции, результат записывается второй транзакцией.
+    Если auth недоступен, пачка остаётся в начале очереди и повторяется
+    с экспоненциальной задержкой, чтобы более поздние изменения не обогнали её.
+    Если auth отклонил пачку, изменения отправляются по одному и в ошибки уходят
+    только отклонённые.
+    """
+
+    def __init__(
+        self,
+        roles_client: RolesService,
+        repository: RoleOutboxRepository,
+        batch_size: int = 1000,
+        interval: float = 1,
+        max_backoff: float = 300,
+        lease: float = 60,
+    ):
+        self.roles_client = roles_client
+        self.repository = repository
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.delivered = 0
+        self.retries = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Запуск фоновой доставки"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановка доставки"""
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def dispatch(self) -> int:
+        """Отправка одной пачки, возвращает число доставленных изменений"""
+        entries = await self._claim()
+        if not entries:
+            return 0
+
+        try:
+            await self._send(entries)
+        except httpx.HTTPStatusError as exc:
+            if not self._is_rejected(exc):
+                await self._finish(postponed=entries, error=str(exc))
+                return 0
+            logger.warning(
+                "Auth rejected %s role changes, sending them one by one: %s",
+                len(entries),
+                exc.response.text,
+            )
+            return await self._dispatch_each(entries)
+        except httpx.HTTPError as exc:
+            await self._finish(postponed=entries, error=str(exc))
+            return 0
+
+        await self._finish(delivered=entries)
+        return len(entries)
+
+    def snapshot(self) -> dict:
+        """Счётчики доставки"""
+        return {
+            "delivered": self.delivered,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+    async def _claim(self) -> list:
+        async with in_transaction() as connection:
+            if not await self.repository.try_lock(connection, OUTBOX_LOCK_KEY):
+                return []
+            entries = await self.repository.get_pending(connection, self.batch_size)
+            # Начало очереди ждёт повтора или уже отправляется другим воркером
+            if not entries or entries[0].available_at > timezone.now():
+                return []
+            await self.repository.claim(
+                connection,
+                [entry.id for entry in entries],
+                until=timezone.now() + timedelta(seconds=self.lease),
+            )
+        return entries
+
+    async def _send(self, entries: list) -> None:
+        await self.roles_client.apply_role_changes(
+            [
+                RoleChange(
+                    user_id=entry.user_id,
+                    role_title=entry.role_title,
+                    op=entry.op,
+                )
+                for entry in entries
+            ]
+        )
+
+    async def _dispatch_each(self, entries: list) -> int:
+        delivered = []
+        rejected = []
+        for index, entry in enumerate(entries):
+            try:
+                await self._send([entry])
+            except httpx.HTTPStatusError as exc:
+                if not self._is_rejected(exc):
+                    await self._finish(
+                        delivered, rejected, postponed=entries[index:], error=str(exc)
+                    )
+                    return len(delivered)
+                rejected.append((entry, exc.response.text))
+            except httpx.HTTPError as exc:
+                await self._finish(
+                    delivered, rejected, postponed=entries[index:], error=str(exc)
+                )
+                return len(delivered)
+            else:
+                delivered.append(entry)
+        await self._finish(delivered, rejected)
+        return len(delivered)
+
+    async def _finish(
+        self,
+        delivered: list = (),
+        rejected: list = (),
+        postponed: list = (),
+        error: str = "",
+    ) -> None:
+        async with in_transaction() as connection:
+            if delivered:
+                await self.repository.delete(
+                    connection, [entry.id for entry in delivered]
+                )
+            for entry, reason in rejected:
+                await self.repository.fail(connection, [entry.id], reason)
+            if postponed:
+                await self._postpone(connection, postponed, error)
+        if delivered:
+            self.delivered += len(delivered)
+            logger.info("Delivered %s role changes to auth", len(delivered))
+        if rejected:
+            self.failed += len(rejected)
+            logger.error(
+                "Auth rejected %s role changes: %s",
+                len(rejected),
+                "; ".join(reason for _, reason in rejected),
+            )
+
+    @staticmethod
+    def _is_rejected(exc: httpx.HTTPStatusError) -> bool:
+        # Ошибка в самих изменениях, повтор не поможет
+        return (
+            exc.response.status_code < 500
+            and exc.response.status_code not in RETRY_STATUSES
+        )
+
+    async def _postpone(self, connection, entries: list, error: str) -> None:
+        self.retries += 1
+        delay = min(2 ** entries[0].attempts, self.max_backoff)
+        logger.warning(
+            "Failed to deliver %s role changes, retry in %s s: %s",
+            len(entries),
+            delay,
+            error,
+        )
+        await self.repository.postpone(
+            connection,
+            [entry.id for entry in entries],
+            available_at=timezone.now() + timedelta(seconds=delay),
+            error=error,
+        )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Полная пачка - в очереди, скорее всего, есть ещё
+                if await self.dispatch() == self.batch_size:
+                    continue
+            except Exception as exc:
+                logger.exception("Role outbox dispatch failed: %s", exc)
+            await asyncio.sleep(self.interval)
+
+
+role_outbox_dispatcher: Optional[RoleOutboxDispatcher] = None
+
+
+def get_role_outbox_dispatcher() -> Optional[RoleOutboxDispatcher]:
+    return role_outbox_dispatcher
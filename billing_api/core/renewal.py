@@ -0,0 +1,154 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import Optional
+from uuid import UUID
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from core.helpers import RateLimiter, gather_with_concurrency, get_amount
+from core.stripe import StripeClient
+from db.repositories.order import OrderRepository
+from db.repositories.user_subscription import UserSubscriptionRepository
+from models.common_models import OrderStatus, RenewalResult, SubscriptionState
+from models.db_models import Order, UsersSubscription
+
+logger = logging.getLogger(__name__)
+
+
+class RecurringPaymentRunner:
+    """
+    Продление автоматических подписок пачкой.
+
+    Платежи проводятся не более чем concurrency одновременно, запросы в stripe идут
+    не чаще rate_limit в секунду. Заказ-потомок периода создаётся до списания под
+    блокировкой исходного заказа, ключ идемпотентности платежа - продлеваемая подписка,
+    поэтому прерванный или параллельный запуск не спишет деньги второй раз.
+    """
+
+    def __init__(
+        self,
+        stripe_client: StripeClient,
+        order_repository: OrderRepository,
+        user_subscription_repository: UserSubscriptionRepository,
+        concurrency: int = 20,
+        rate_limit: float = 50,
+    ):
+        self.stripe_client = stripe_client
+        self.order_repository = order_repository
+        self.user_subscription_repository = user_subscription_repository
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+
+    async def renew(
+        self, user_subscriptions: list[UsersSubscription]
+    ) -> list[RenewalResult]:
+        """Продление подписок, результаты в том же порядке"""
+        parents = await self.order_repository.get_renewal_orders(user_subscriptions)
+        children = defaultdict(list)
+        for child in await self.order_repository.get_recurrent_orders(
+            [parent.id for parent in parents.values()]
+        ):
+            children[child.parent_id].append(child)
+
+        results = await gather_with_concurrency(
+            self.concurrency,
+            *(
+                self._renew(
+                    user_subscription,
+                    parents.get(
+                        (user_subscription.user_id, user_subscription.subscription_id)
+                    ),
+                    children,
+                )
+                for user_subscription in user_subscriptions
+            ),
+        )
+        for user_subscription, result in zip(user_subscriptions, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Error when trying recurring payment for user subscription %s: %s",
+                    user_subscription.id,
+                    result,
+                )
+        return [
+            RenewalResult.ERROR if isinstance(result, Exception) else result
+            for result in results
+        ]
+
+    async def _renew(
+        self,
+        user_subscription: UsersSubscription,
+        parent: Optional[Order],
+        children: dict[UUID, list[Order]],
+    ) -> RenewalResult:
+        if parent is None:
+            logger.error(
+                "Paid order for user subscription %s is not found", user_subscription.id
+            )
+            return RenewalResult.ERROR
+
+        # Заказ текущего периода создан после начала подписки,
+        # более ранние потомки - продления прошлых периодов
+        child = next(
+            (
+                child
+                for child in children[parent.id]
+                if child.created.date() >= user_subscription.start_date
+            ),
+            None,
+        )
+        if child and child.status == OrderStatus.PAID:
+            return RenewalResult.SKIPPED
+        if child and child.status == OrderStatus.ERROR:
+            return RenewalResult.DECLINED
+        # Под блокировкой исходного заказа: параллельный запуск мог уже создать
+        # или даже завершить заказ этого периода
+        child = await self.order_repository.get_or_create_renewal_order(
+            order=parent,
+            since=timezone.make_aware(
+                datetime.combine(user_subscription.start_date, time.min)
+            ),
+        )
+        if child.status == OrderStatus.PAID:
+            return RenewalResult.SKIPPED
+        if child.status == OrderStatus.ERROR:
+            return RenewalResult.DECLINED
+
+        await self.rate_limiter.wait()
+        # Ключ привязан к продлеваемой подписке, а не к заказу: повтор и параллельный
+        # запуск получат от stripe тот же платёж вместо второго списания
+        payment = await self.stripe_client.create_recurrent_payment(
+            customer_id=child.user_id,
+            user_email=child.user_email,
+            amount=get_amount(child.total_cost),
+            currency=child.currency.value,
+            payment_method_id=child.payment_method.id,
+            idempotency_key=f"renewal-{user_subscription.id}",
+        )
+        if payment.status != "succeeded":
+            logger.info(
+                "Recurring payment %s for user %s is %s",
+                payment.id,
+                child.user_id,
+                payment.status,
+            )
+            await self.order_repository.complete_order(
+                order_id=child.id, external_id=payment.id, status=OrderStatus.ERROR
+            )
+            return RenewalResult.DECLINED
+
+        async with in_transaction():
+            if not await self.order_repository.complete_order(
+                order_id=child.id, external_id=payment.id, status=OrderStatus.PAID
+            ):
+                return RenewalResult.SKIPPED
+            await self.user_subscription_repository.create_user_subscriptions(
+                order=child,
+                status=SubscriptionState.PREACTIVE,
+                start_date=user_subscription.end_date,
+                end_date=user_subscription.end_date
+                + timedelta(days=child.subscription.period),
+            )
+        return RenewalResult.RENEWED
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import suppress
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Ключ и канал, которые ведёт сервис auth (см. auth/core/revocation.py)
+REVOKED_TOKENS_KEY = "revoked_tokens"
+TOKEN_GENERATIONS_KEY = "token_generations_at"
+REVOCATION_CHANNEL = "revoked_tokens"
+RECONNECT_DELAY = 1
+PRUNE_INTERVAL = 60
+
+
+class RevocationListener:
+    """
+    Локальная копия списка отозванных токенов, которую обновляет сервис auth.
+
+    Поколение сессий пользователя - время его смены в миллисекундах, поколения
+    старше generation_ttl (времени жизни access токена) удаляются.
+    """
+
+    def __init__(self, redis: Redis, generation_ttl: float = 3600):
+        self.redis = redis
+        self.generation_ttl = generation_ttl
+        self.revoked: dict[str, float] = {}
+        self.generations: dict[str, int] = {}
+        self.synced = False
+        self._pruned_at = time.time()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Запуск фоновой подписки на отзывы токенов"""
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Остановка подписки"""
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        await self.redis.close()
+
+    def is_revoked(self, token_id: str) -> bool:
+        """Проверка, отозван ли токен"""
+        return token_id in self.revoked
+
+    def generation(self, user_id: str) -> int:
+        """Текущее поколение сессий пользователя"""
+        return self.generations.get(user_id, 0)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                # Снимок загружается после подписки, чтобы не потерять отзывы между ними
+                await self._load_snapshot()
+                self.synced = True
+                logger.info("Revoked tokens are synced, %s entries", len(self.revoked))
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._apply(json.loads(message["data"]))
+            except RedisError as exc:
+                logger.warning("Revoked tokens subscription is lost: %s", exc)
+            finally:
+                self.synced = False
+                with suppress(RedisError):
+                    await pubsub.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _load_snapshot(self) -> None:
+        entries = await self.redis.zrangebyscore(
+            REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True
+        )
+        self.revoked = {token_id.decode(): exp for token_id, exp in entries}
+        generations = await self.redis.zrangebyscore(
+            TOKEN_GENERATIONS_KEY, self._generations_since(), "+inf", withscores=True
+        )
+        self.generations = {
+            user_id.decode(): int(generation) for user_id, generation in generations
+        }
+
+    def _apply(self, event: dict) -> None:
+        if event.get("type") == "token":
+            self.revoked[event["id"]] = event["exp"]
+        elif event.get("type") == "user":
+            self.generations[event["id"]] = max(
+                event["generation"], self.generations.get(event["id"], 0)
+            )
+
+        now = time.time()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self.revoked = {
+                token_id: exp for token_id, exp in self.revoked.items() if exp > now
+            }
+            since = self._generations_since()
+            self.generations = {
+                user_id: generation
+                for user_id, generation in self.generations.items()
+                if generation >= since
+            }
+            self._pruned_at = now
+
+    def _generations_since(self) -> int:
+        return int((time.time() - self.generation_ttl) * 1000)
@@ -1,33 +1,45 @@
 from typing import Optional
 
-import httpx
-from pydantic import UUID4
+from core.config import ROLE_CHANGES_BATCH_SIZE
+from core.helpers import chunked
+from core.http import HttpClient
+from models.common_models import RoleChange
 
 
 class RolesService:
     """Класс для работы с ролями пользователя"""
 
-    def __init__(self, base_url):
-        self.base_url = base_url
-        self.roles_update_url = "api/v1/authorization/user_role/"
+    def __init__(self, http_client: HttpClient, service_token: str):
+        self.http_client = http_client
+        self.service_token = service_token
+        self.roles_batch_url = "api/v1/authorization/user_roles/batch/"
 
     async def _request(self, method: str, url: str, data: dict):
-        async with httpx.AsyncClient(base_url=self.base_url) as client:
-            return await client.request(method=method, url=url, json=data)
-
-    async def grant_role(self, user_id: UUID4, role_title: str) -> None:
-        await self._request(
-            method="POST",
-            url=self.roles_update_url,
-            data={"user_id": str(user_id), "role_title": role_title},
+        return await self.http_client.request(
+            method=method,
+            url=url,
+            json=data,
+            headers={"X-Service-Token": self.service_token},
         )
 
-    async def revoke_role(self, user_id: UUID4, role_title: str) -> None:
-        await self._request(
-            method="DELETE",
-            url=self.roles_update_url,
-            data={"user_id": str(user_id), "role_title": role_title},
-        )
+    async def apply_role_changes(self, changes: list[RoleChange]) -> None:
+        """Пакетная выдача и отзыв ролей, ошибка auth прерывает изменения"""
+        for batch in chunked(changes, ROLE_CHANGES_BATCH_SIZE):
+            response = await self._request(
+                method="POST",
+                url=self.roles_batch_url,
+                data={
+                    "changes": [
+                        {
+                            "user_id": str(change.user_id),
+                            "role_title": change.role_title,
+                            "op": change.op.value,
+                        }
+                        for change in batch
+                    ]
+                },
+            )
+            response.raise_for_status()
 
 
 roles_client: Optional[RolesService] = None
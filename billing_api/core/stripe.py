@@ -1,15 +1,16 @@
 import logging
+from typing import Optional
 
 import backoff
 import stripe
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp.client_exceptions import ClientError
 from pydantic import UUID4
 
 from models.api_models import PaymentMethodData, PaymentMethodDataOut
 from models.common_models import CustomerInner, PaymentInner, RefundInner
 
-from .config import STRIPE_API_KEY, STRIPE_BASE_URL
+from .metrics import PoolMetrics, aiohttp_trace_config
 
 logger = logging.getLogger(__name__)
 
@@ -17,13 +18,45 @@ logger = logging.getLogger(__name__)
 class StripeClient:
     """Клиент для stripe"""
 
-    def __init__(self, url: str, api_key: str):
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        pool_limit: int = 100,
+        pool_limit_per_host: int = 0,
+        timeout: float = 30,
+        keepalive_timeout: float = 60,
+    ):
         self.client = stripe
         self.base_url = url
         self.api_key = api_key
         self.auth_header = {
             "Authorization": f"Bearer {self.api_key}",
         }
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.timeout = ClientTimeout(total=timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self.metrics = PoolMetrics(limit=pool_limit)
+        self.session: Optional[ClientSession] = None
+
+    async def start(self) -> None:
+        """Создание общего пула соединений к stripe"""
+        self.session = ClientSession(
+            headers=self.auth_header,
+            connector=TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            ),
+            timeout=self.timeout,
+            trace_configs=[aiohttp_trace_config(self.metrics)],
+        )
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        if self.session:
+            await self.session.close()
 
     @backoff.on_exception(
         exception=ClientError, wait_gen=backoff.expo, max_time=30, logger=logger
@@ -31,8 +64,8 @@ class StripeClient:
     async def _request(
         self, method: str, endpoint: str, headers: dict = None, data: dict = None
     ):
-        async with ClientSession(headers=self.auth_header) as session:
-            async with session.request(
+        async with self.metrics.track_request():
+            async with self.session.request(
                 method=method,
                 url=f"{self.base_url}{endpoint}",
                 headers=headers,
@@ -84,8 +117,12 @@ class StripeClient:
         currency: str,
         user_email: str,
         payment_method_id: str,
+        idempotency_key: Optional[str] = None,
     ) -> PaymentInner:
-        """Создание рекурентного платежа"""
+        """
+        Создание рекурентного платежа.
+        Повтор с тем же idempotency_key возвращает уже созданный платёж, а не списывает снова
+        """
         payment_intent_data = {
             "customer": customer_id,
             "amount": amount,
@@ -96,8 +133,14 @@ class StripeClient:
             "off_session": True,
         }
         payment = await self._request(
-            method="POST", endpoint="/payment_intents", data=payment_intent_data
+            method="POST",
+            endpoint="/payment_intents",
+            headers={"Idempotency-Key": idempotency_key} if idempotency_key else None,
+            data=payment_intent_data,
         )
+        # Отклонённый платёж stripe возвращает ошибкой, в которой есть сам платёж
+        if "error" in payment and "payment_intent" in payment["error"]:
+            return PaymentInner(**payment["error"]["payment_intent"])
         return PaymentInner(**payment)
 
     async def confirm_payment(self, payment_id: str, payment_method: str):
@@ -157,5 +200,8 @@ class StripeClient:
         )
 
 
-async def get_stripe() -> StripeClient:
-    return StripeClient(url=STRIPE_BASE_URL, api_key=STRIPE_API_KEY)
+stripe_client: Optional[StripeClient] = None
+
+
+def get_stripe() -> Optional[StripeClient]:
+    return stripe_client
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha256
+from typing import Optional
+
+import jwt
+
+from core.revocation import RevocationListener
+from models.common_models import AuthUserInner
+
+
+@dataclass
+class CachedToken:
+    user: AuthUserInner
+    jti: str
+    user_id: str
+    generation: int
+    expires_at: float
+
+
+class TokenCache:
+    """
+    Кеш результатов проверки токенов в auth (LRU с ограничением по времени).
+
+    Запись живёт не дольше срока действия токена и max_ttl. Отозванный токен
+    или токен со сброшенным поколением сессий удаляется из кеша при обращении.
+    Пока список отзывов не синхронизирован, кеш не используется.
+    """
+
+    def __init__(
+        self,
+        revocation: RevocationListener,
+        max_size: int = 10000,
+        max_ttl: float = 300,
+    ):
+        self.revocation = revocation
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revoked = 0
+        self._entries: OrderedDict[str, CachedToken] = OrderedDict()
+
+    def get(self, token: str) -> Optional[AuthUserInner]:
+        """Пользователь по ранее проверенному токену"""
+        if not self.revocation.synced:
+            self.misses += 1
+            return None
+        key = sha256(token.encode()).hexdigest()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        if self.revocation.is_revoked(
+            entry.jti
+        ) or entry.generation < self.revocation.generation(entry.user_id):
+            del self._entries[key]
+            self.revoked += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.user
+
+    def put(self, token: str, user: AuthUserInner) -> None:
+        """Сохранение результата проверки токена"""
+        try:
+            payload = jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            return
+        if "exp" not in payload:
+            return
+        expires_at = min(payload["exp"], time.time() + self.max_ttl)
+        key = sha256(token.encode()).hexdigest()
+        self._entries[key] = CachedToken(
+            user=user,
+            # Токены, выпущенные до появления jti, отзываются по хешу самого токена
+            jti=payload.get("jti") or key,
+            user_id=str(payload.get("user_id", user.user_id)),
+            generation=payload.get("gen", 0),
+            expires_at=expires_at,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def snapshot(self) -> dict:
+        """Статистика попаданий для подбора размера кеша"""
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "revoked": self.revoked,
+        }
@@ -0,0 +1,26 @@
+from tortoise import Tortoise
+
+# Частичные индексы, которые tortoise не умеет объявлять в Meta моделей.
+# Покрывают выборки планировщика: заказы и возвраты в обработке,
+# предактивные подписки и неотправленные изменения ролей
+PARTIAL_INDEXES = (
+    """
+    CREATE INDEX IF NOT EXISTS billing_order_processing_idx
+    ON billing_order (refund, created, id) WHERE status = 'progress'
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS billing_userssubscription_preactive_idx
+    ON billing_userssubscription (start_date) WHERE status = 'preactive'
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS billing_role_outbox_pending_idx
+    ON billing_role_outbox (id) WHERE failed_at IS NULL
+    """,
+)
+
+
+async def create_partial_indexes() -> None:
+    """Создание частичных индексов, если их ещё нет"""
+    connection = Tortoise.get_connection("default")
+    for query in PARTIAL_INDEXES:
+        await connection.execute_script(query)
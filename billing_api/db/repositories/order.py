@@ -1,12 +1,16 @@
+from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import AsyncIterator, Optional, Sequence
 
 from pydantic import UUID4
 from tortoise import timezone
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 
+from core.catalog import subscription_catalog
 from models.api_models import PaymentDataIn, PaymentMethodDataOut
 from models.common_models import OrderStatus
-from models.db_models import Order, Subscription
+from models.db_models import Order, Subscription, UsersSubscription
 
 
 class OrderRepository:
@@ -15,21 +19,24 @@ class OrderRepository:
     @staticmethod
     async def _get_order(**kwargs) -> Optional[Order]:
         """Получить заказ"""
-        return (
+        order = (
             await Order.filter(**kwargs)
             .order_by(
                 "-created",
             )
-            .prefetch_related("subscription", "payment_method")
+            .prefetch_related("payment_method")
             .first()
         )
+        if order:
+            await subscription_catalog.attach([order])
+        return order
 
     @staticmethod
     async def _get_orders(**kwargs) -> list[Order]:
         """Получить список заказов"""
-        return await Order.filter(**kwargs).prefetch_related(
-            "subscription", "payment_method"
-        )
+        orders = await Order.filter(**kwargs).prefetch_related("payment_method")
+        await subscription_catalog.attach(orders)
+        return orders
 
     @staticmethod
     async def _update_order(order_id: UUID4, **kwargs) -> None:
@@ -52,17 +59,122 @@ class OrderRepository:
         """Метод возвращет рекурентный заказ (заказ потомок)"""
         return await self._get_order(parent_id=order_parend_id)
 
-    async def get_processing_orders(self) -> list[Order]:
-        """Метод возваращает все заказы находящиеся в обработке"""
-        return await self._get_orders(status=OrderStatus.PROGRESS, refund=False)
+    @staticmethod
+    async def get_processing_orders_page(
+        refund: bool,
+        limit: int,
+        fields: Sequence[str],
+        subscription_fields: Sequence[str] = (),
+        after: Optional[tuple[datetime, UUID4]] = None,
+    ) -> list[dict]:
+        """
+        Метод возвращает страницу заказов (или возвратов) в обработке
+        в порядке (created, id), начиная после курсора after.
+        Поля подписки subscription_fields подставляются из справочника в памяти
+        """
+        query = Order.filter(status=OrderStatus.PROGRESS, refund=refund)
+        if after:
+            created, id = after
+            query = query.filter(Q(created__gt=created) | Q(created=created, id__gt=id))
+        if subscription_fields:
+            fields = (*fields, "subscription_id")
+        rows = await query.order_by("created", "id").limit(limit).values(*fields)
+        return await subscription_catalog.nest(rows, subscription_fields)
+
+    async def iter_processing_orders(
+        self, refund: bool, fields: Sequence[str], batch_size: int
+    ) -> AsyncIterator[dict]:
+        """Метод обходит все заказы (или возвраты) в обработке страницами по batch_size"""
+        after = None
+        while True:
+            rows = await self.get_processing_orders_page(
+                refund=refund, limit=batch_size, fields=fields, after=after
+            )
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            after = rows[-1]["created"], rows[-1]["id"]
 
-    async def get_processing_refunds(self) -> list[Order]:
-        """Метод возваращает все возвраты находящиеся в обработке"""
-        return await self._get_orders(status=OrderStatus.PROGRESS, refund=True)
+    @staticmethod
+    async def get_renewal_orders(
+        user_subscriptions: list[UsersSubscription],
+    ) -> dict[tuple[UUID4, UUID4], Order]:
+        """
+        Метод возвращает исходные оплаченные заказы, по которым продлеваются подписки пользователей,
+        по паре (user_id, subscription_id). Из нескольких заказов берётся последний
+        """
+        if not user_subscriptions:
+            return {}
+        orders = (
+            await Order.filter(
+                Q(
+                    *(
+                        Q(
+                            user_id=user_subscription.user_id,
+                            subscription_id=user_subscription.subscription_id,
+                        )
+                        for user_subscription in user_subscriptions
+                    ),
+                    join_type=Q.OR,
+                ),
+                status=OrderStatus.PAID,
+                refund=False,
+                parent_id=None,
+            )
+            .order_by("created")
+            .prefetch_related("payment_method")
+        )
+        await subscription_catalog.attach(orders)
+        return {(order.user_id, order.subscription_id): order for order in orders}
+
+    async def get_recurrent_orders(self, order_parent_ids: list[UUID4]) -> list[Order]:
+        """Метод возвращает рекурентные заказы (заказы потомки) нескольких заказов"""
+        if not order_parent_ids:
+            return []
+        return await self._get_orders(parent_id__in=order_parent_ids, refund=False)
+
+    @staticmethod
+    async def lock_processing_orders_by_external_ids(
+        external_ids: list[str], refund: bool
+    ) -> list[Order]:
+        """
+        Метод блокирует до конца транзакции и возвращает заказы (или возвраты),
+        которые всё ещё в обработке. Параллельный вызов дождётся блокировки
+        и не получит заказы, которые успел провести первый
+        """
+        orders = (
+            await Order.filter(
+                external_id__in=external_ids,
+                status=OrderStatus.PROGRESS,
+                refund=refund,
+            )
+            .select_for_update()
+            .prefetch_related("payment_method")
+        )
+        await subscription_catalog.attach(orders)
+        return orders
 
-    async def get_user_orders(self, user_id: UUID4) -> list[Order]:
-        """Метод возвращает все заказы пользователя"""
-        return await self._get_orders(user_id=user_id)
+    @staticmethod
+    async def get_user_orders_page(
+        user_id: UUID4,
+        limit: int,
+        fields: Sequence[str],
+        subscription_fields: Sequence[str] = (),
+        before: Optional[tuple[datetime, UUID4]] = None,
+    ) -> list[dict]:
+        """
+        Метод возвращает страницу заказов пользователя от новых к старым, начиная после курсора before.
+        Поля подписки subscription_fields подставляются из справочника в памяти
+        """
+        query = Order.filter(user_id=user_id)
+        if before:
+            created, id = before
+            query = query.filter(Q(created__lt=created) | Q(created=created, id__lt=id))
+        if subscription_fields:
+            fields = (*fields, "subscription_id")
+        rows = await query.order_by("-created", "-id").limit(limit).values(*fields)
+        return await subscription_catalog.nest(rows, subscription_fields)
 
     async def update_order_external_id(
         self, order_id: UUID4, external_id: str, status: OrderStatus, **kwargs
@@ -72,10 +184,30 @@ class OrderRepository:
             order_id=order_id, external_id=external_id, status=status, **kwargs
         )
 
+    @staticmethod
+    async def complete_order(
+        order_id: UUID4, external_id: str, status: OrderStatus
+    ) -> bool:
+        """
+        Метод завершает созданный заказ. Возвращает False, если заказ уже завершён
+        (например, параллельным запуском), тогда повторно применять его нельзя
+        """
+        updated = await Order.filter(id=order_id, status=OrderStatus.CREATED).update(
+            external_id=external_id, status=status, modified=timezone.now()
+        )
+        return bool(updated)
+
     async def update_order_status(self, order_id: UUID4, status: OrderStatus) -> None:
         """Метод обновляет статус заказа"""
         await self._update_order(order_id=order_id, status=status)
 
+    @staticmethod
+    async def update_orders_status(order_ids: list[UUID4], status: OrderStatus) -> None:
+        """Метод обновляет статус нескольких заказов"""
+        await Order.filter(id__in=order_ids).update(
+            status=status, modified=timezone.now()
+        )
+
     @staticmethod
     async def create_order(
         user_id: UUID4,
@@ -115,6 +247,25 @@ class OrderRepository:
             modified=timezone.now(),
         )
 
+    async def get_or_create_renewal_order(self, order: Order, since: datetime) -> Order:
+        """
+        Метод возвращает рекурентный заказ текущего периода (созданный не раньше since),
+        а если его нет - создаёт. Исходный заказ блокируется на время проверки,
+        поэтому параллельные запуски не создадут два заказа за один период
+        """
+        async with in_transaction():
+            await Order.filter(id=order.id).select_for_update().first()
+            child = (
+                await Order.filter(parent_id=order.id, refund=False, created__gte=since)
+                .order_by("created")
+                .first()
+            )
+            if child is None:
+                return await self.create_recurrent_order(order=order)
+        child.subscription = order.subscription
+        child.payment_method = order.payment_method
+        return child
+
     @staticmethod
     async def create_recurrent_order(order: Order):
         """Метод создания рекуррентного заказа"""
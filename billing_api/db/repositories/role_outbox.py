@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from tortoise import timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+
+from models.common_models import RoleChange
+from models.db_models import RoleOutbox
+
+
+class RoleOutboxRepository:
+    """Класс для работы с очередью изменений ролей."""
+
+    @staticmethod
+    async def add_role_changes(changes: list[RoleChange]) -> None:
+        """Метод ставит изменения ролей в очередь в текущей транзакции"""
+        if not changes:
+            return
+        await RoleOutbox.bulk_create(
+            [
+                RoleOutbox(
+                    user_id=change.user_id, role_title=change.role_title, op=change.op
+                )
+                for change in changes
+            ]
+        )
+
+    @staticmethod
+    async def try_lock(connection: BaseDBAsyncClient, key: int) -> bool:
+        """Метод берёт advisory lock до конца транзакции, если он свободен"""
+        rows = await connection.execute_query_dict(
+            "SELECT pg_try_advisory_xact_lock($1) AS locked", [key]
+        )
+        return rows[0]["locked"]
+
+    @staticmethod
+    async def get_pending(
+        connection: BaseDBAsyncClient, limit: int
+    ) -> list[RoleOutbox]:
+        """Метод возвращает самые старые неотправленные изменения в порядке добавления"""
+        return (
+            await RoleOutbox.filter(failed_at=None)
+            .order_by("id")
+            .limit(limit)
+            .using_db(connection)
+        )
+
+    @staticmethod
+    async def claim(
+        connection: BaseDBAsyncClient, ids: list[int], until: datetime
+    ) -> None:
+        """Метод закрепляет изменения за воркером до until, пока идёт их отправка"""
+        await RoleOutbox.filter(id__in=ids).using_db(connection).update(
+            available_at=until
+        )
+
+    @staticmethod
+    async def delete(connection: BaseDBAsyncClient, ids: list[int]) -> None:
+        """Метод удаляет доставленные изменения"""
+        await RoleOutbox.filter(id__in=ids).using_db(connection).delete()
+
+    @staticmethod
+    async def postpone(
+        connection: BaseDBAsyncClient,
+        ids: list[int],
+        available_at: datetime,
+        error: str,
+    ) -> None:
+        """Метод откладывает повторную отправку изменений"""
+        await RoleOutbox.filter(id__in=ids).using_db(connection).update(
+            attempts=F("attempts") + 1, available_at=available_at, last_error=error
+        )
+
+    @staticmethod
+    async def fail(connection: BaseDBAsyncClient, ids: list[int], error: str) -> None:
+        """Метод помечает изменения, которые auth отклонил, и убирает их из очереди"""
+        await RoleOutbox.filter(id__in=ids).using_db(connection).update(
+            attempts=F("attempts") + 1, failed_at=timezone.now(), last_error=error
+        )
+
+    @staticmethod
+    async def get_stats() -> dict:
+        """Метод возвращает размер очереди и возраст самого старого изменения"""
+        pending = RoleOutbox.filter(failed_at=None)
+        oldest = await pending.order_by("id").first()
+        return {
+            "pending": await pending.count(),
+            "failed": await RoleOutbox.filter(failed_at__isnull=False).count(),
+            "oldest_seconds": (timezone.now() - oldest.created).total_seconds()
+            if oldest
+            else 0.0,
+        }
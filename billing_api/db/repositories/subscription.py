@@ -2,6 +2,7 @@ from typing import Optional
 
 from pydantic import UUID4
 
+from core.catalog import subscription_catalog
 from models.db_models import Subscription
 
 
@@ -10,5 +11,5 @@ class SubscriptionRepository:
 
     @staticmethod
     async def get_subscription(subscription_id: UUID4) -> Optional[Subscription]:
-        """Метод возвращает подписку"""
-        return await Subscription.get_or_none(id=subscription_id)
+        """Метод возвращает подписку из справочника в памяти"""
+        return await subscription_catalog.get(subscription_id)
@@ -1,12 +1,50 @@
-from datetime import date, timedelta
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Optional, Sequence
 
 from pydantic import UUID4
 from tortoise import timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Q
 
-from models.common_models import SubscriptionState
+from core.catalog import subscription_catalog
+from models.common_models import SubscriptionState, SubscriptionType
 from models.db_models import Order, Subscription, UsersSubscription
 
+# Подписки, срок которых закончился. Возвращаются только пользователи,
+# у которых не осталось другой действующей подписки того же типа
+DISABLE_EXPIRED_QUERY = """
+WITH expired AS (
+    UPDATE billing_userssubscription us
+    SET status = $1, modified = $2
+    FROM billing_subscription s
+    WHERE s.id = us.subscription_id
+      AND us.status = ANY($3::varchar[])
+      AND us.end_date <= $4
+    RETURNING us.user_id, s.type
+)
+SELECT DISTINCT expired.user_id, expired.type
+FROM expired
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM billing_userssubscription other
+    JOIN billing_subscription other_s ON other_s.id = other.subscription_id
+    WHERE other.user_id = expired.user_id
+      AND other_s.type = expired.type
+      AND other.status = ANY($3::varchar[])
+      AND other.end_date > $4
+)
+"""
+
+ENABLE_PREACTIVE_QUERY = """
+UPDATE billing_userssubscription us
+SET status = $1, modified = $2
+FROM billing_subscription s
+WHERE s.id = us.subscription_id
+  AND us.status = $3
+  AND us.start_date <= $4
+RETURNING us.user_id, s.type
+"""
+
 
 class UserSubscriptionRepository:
     """Класс для работы с таблицей подписок пользователей."""
@@ -16,14 +54,29 @@ class UserSubscriptionRepository:
         user_id: UUID4, status=list[SubscriptionState], **kwargs
     ) -> Optional[UsersSubscription]:
         """Метод возвращает подписку пользователя"""
-        return await UsersSubscription.get_or_none(
+        user_subscription = await UsersSubscription.get_or_none(
             user_id=user_id, status__in=status, **kwargs
-        ).select_related("subscription")
+        )
+        if user_subscription:
+            await subscription_catalog.attach([user_subscription])
+        return user_subscription
+
+    async def get_user_automatic_subscription(
+        self, user_id: UUID4, status: list[SubscriptionState]
+    ) -> Optional[UsersSubscription]:
+        """Метод возвращает подписку пользователя с автоматическим продлением"""
+        return await self.get_user_subscription(
+            user_id=user_id,
+            status=status,
+            subscription_id__in=await subscription_catalog.automatic_ids(),
+        )
 
     @staticmethod
     async def _get_user_subscriptions(**kwargs) -> list[UsersSubscription]:
         """Получить список подписок"""
-        return await UsersSubscription.filter(**kwargs).select_related("subscription")
+        user_subscriptions = await UsersSubscription.filter(**kwargs)
+        await subscription_catalog.attach(user_subscriptions)
+        return user_subscriptions
 
     @staticmethod
     async def _update_user_subscriptions(status: SubscriptionState, **kwargs) -> None:
@@ -32,29 +85,55 @@ class UserSubscriptionRepository:
             status=status, modified=timezone.now()
         )
 
-    async def get_active_user_subscriptions(self) -> list[UsersSubscription]:
-        """Метод возвращает активные подписки"""
-        return await self._get_user_subscriptions(status=SubscriptionState.ACTIVE)
-
-    async def get_inactive_user_subscriptions(self) -> list[UsersSubscription]:
-        """Метод возвращает активные подписки"""
-        return await self._get_user_subscriptions(status=SubscriptionState.INACTIVE)
-
     async def get_expiring_active_subscriptions_automatic(
         self,
     ) -> list[UsersSubscription]:
         """Метод возвращает активные 'автоматические' подписки, срок действия которых истекает завтра"""
         return await self._get_user_subscriptions(
             status=SubscriptionState.ACTIVE,
-            subscription__automatic=True,
+            subscription_id__in=await subscription_catalog.automatic_ids(),
             end_date=date.today() + timedelta(days=1),
         )
 
-    async def get_user_subscriptions_by_user_id(
-        self, user_id: UUID4
+    @staticmethod
+    async def get_expiring_active_subscriptions_automatic_page(
+        limit: int, after: Optional[UUID4] = None
     ) -> list[UsersSubscription]:
-        """Метод возвращает все подписки, которые есть и были у пользователя"""
-        return await self._get_user_subscriptions(user_id=user_id)
+        """
+        Метод возвращает страницу активных 'автоматических' подписок, срок действия которых
+        истекает завтра, в порядке id, начиная после курсора after
+        """
+        query = UsersSubscription.filter(
+            status=SubscriptionState.ACTIVE,
+            subscription_id__in=await subscription_catalog.automatic_ids(),
+            end_date=date.today() + timedelta(days=1),
+        )
+        if after:
+            query = query.filter(id__gt=after)
+        user_subscriptions = await query.order_by("id").limit(limit)
+        await subscription_catalog.attach(user_subscriptions)
+        return user_subscriptions
+
+    @staticmethod
+    async def get_user_subscriptions_page(
+        user_id: UUID4,
+        limit: int,
+        fields: Sequence[str],
+        subscription_fields: Sequence[str] = (),
+        before: Optional[tuple[datetime, UUID4]] = None,
+    ) -> list[dict]:
+        """
+        Метод возвращает страницу подписок пользователя от новых к старым, начиная после курсора before.
+        Поля подписки subscription_fields подставляются из справочника в памяти
+        """
+        query = UsersSubscription.filter(user_id=user_id)
+        if before:
+            created, id = before
+            query = query.filter(Q(created__lt=created) | Q(created=created, id__lt=id))
+        if subscription_fields:
+            fields = (*fields, "subscription_id")
+        rows = await query.order_by("-created", "-id").limit(limit).values(*fields)
+        return await subscription_catalog.nest(rows, subscription_fields)
 
     async def update_user_subscription_status_by_id(
         self, subscription_id: UUID4, status: SubscriptionState
@@ -70,18 +149,58 @@ class UserSubscriptionRepository:
             status=status, user_id=user_id, subscription=subscription
         )
 
-    async def update_expired_user_subscription(self) -> None:
-        """Метод обновляет обновляет статус истёкшим подпискам"""
-        await self._update_user_subscriptions(
-            status=SubscriptionState.INACTIVE, end_date=date.today()
+    @staticmethod
+    async def update_user_subscriptions_status_by_orders(
+        orders: list[Order], status: SubscriptionState
+    ) -> None:
+        """Метод обновления статуса подписок пользователей по списку заказов"""
+        await UsersSubscription.filter(
+            Q(
+                *(
+                    Q(user_id=order.user_id, subscription_id=order.subscription_id)
+                    for order in orders
+                ),
+                join_type=Q.OR,
+            )
+        ).update(status=status, modified=timezone.now())
+
+    @staticmethod
+    async def disable_expired_user_subscriptions(
+        connection: BaseDBAsyncClient,
+    ) -> list[tuple[UUID4, SubscriptionType]]:
+        """
+        Метод отключает истёкшие подписки одним запросом.
+        Возвращает пользователей и типы подписок, роли которых нужно отозвать
+        """
+        rows = await connection.execute_query_dict(
+            DISABLE_EXPIRED_QUERY,
+            [
+                SubscriptionState.INACTIVE.value,
+                timezone.now(),
+                [SubscriptionState.ACTIVE.value, SubscriptionState.CANCELED.value],
+                date.today(),
+            ],
         )
+        return [(row["user_id"], SubscriptionType(row["type"])) for row in rows]
 
     @staticmethod
-    async def update_preactive_user_subscription() -> None:
-        """Метод обновляет обновляет статус предактивным подпискам"""
-        await UsersSubscription.filter(
-            status=SubscriptionState.PREACTIVE, start_date=date.today()
-        ).update(status=SubscriptionState.ACTIVE, modified=timezone.now())
+    async def enable_preactive_user_subscriptions(
+        connection: BaseDBAsyncClient,
+    ) -> list[tuple[UUID4, SubscriptionType]]:
+        """
+        Метод включает предактивные подписки, период которых начался, одним запросом.
+        Возвращает пользователей и типы включённых подписок
+        """
+        rows = await connection.execute_query_dict(
+            ENABLE_PREACTIVE_QUERY,
+            [
+                SubscriptionState.ACTIVE.value,
+                timezone.now(),
+                SubscriptionState.PREACTIVE.value,
+                date.today(),
+            ],
+        )
+        return [(row["user_id"], SubscriptionType(row["type"])) for row in rows]
 
     @staticmethod
     async def create_user_subscriptions(
@@ -102,3 +221,23 @@ class UserSubscriptionRepository:
             created=timezone.now(),
             modified=timezone.now(),
         )
+
+    @staticmethod
+    async def create_users_subscriptions(
+        orders: list[Order], status: SubscriptionState
+    ) -> None:
+        """Метод пакетного создания подписок пользователей по оплаченным заказам"""
+        await UsersSubscription.bulk_create(
+            [
+                UsersSubscription(
+                    user_id=order.user_id,
+                    subscription=order.subscription,
+                    start_date=date.today(),
+                    end_date=date.today() + timedelta(days=order.subscription.period),
+                    status=status,
+                    created=timezone.now(),
+                    modified=timezone.now(),
+                )
+                for order in orders
+            ]
+        )
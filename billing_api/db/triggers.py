@@ -0,0 +1,40 @@
+from tortoise.transactions import in_transaction
+
+# Уведомление справочников подписок в памяти воркеров (core/catalog.py)
+# о любом изменении таблицы подписок, в том числе из админки
+SUBSCRIPTION_TRIGGERS = """
+CREATE OR REPLACE FUNCTION notify_billing_subscription() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('billing_subscription_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS billing_subscription_notify ON billing_subscription;
+CREATE TRIGGER billing_subscription_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON billing_subscription
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_billing_subscription();
+"""
+
+
+# Ключ advisory lock: воркеры billing стартуют одновременно
+TRIGGERS_LOCK_KEY = 7_310_024
+SUBSCRIPTION_TRIGGER_NAME = "billing_subscription_notify"
+
+
+async def create_triggers() -> None:
+    """
+    Создание триггеров уведомлений, если их ещё нет.
+    DDL выполняет только первый воркер под advisory lock, остальные видят готовый
+    триггер и не берут блокировку на таблицу подписок
+    """
+    async with in_transaction() as connection:
+        await connection.execute_query(
+            "SELECT pg_advisory_xact_lock($1)", [TRIGGERS_LOCK_KEY]
+        )
+        rows = await connection.execute_query_dict(
+            "SELECT 1 FROM pg_trigger WHERE NOT tgisinternal AND tgname = $1",
+            [SUBSCRIPTION_TRIGGER_NAME],
+        )
+        if not rows:
+            await connection.execute_script(SUBSCRIPTION_TRIGGERS)
@@ -3,11 +3,17 @@ import logging
 import uvicorn as uvicorn
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
+from redis.asyncio import Redis
 from tortoise import Tortoise
 
-from api.v1 import billing, scheduler, user
-from core import auth, config, roles
+from api.v1 import billing, metrics, scheduler, user
+from core import auth, catalog, config, http, outbox, revocation, roles, stripe
 from core.logger import LOGGING
+from core.settings import DatabaseSettings
+from core.token_cache import TokenCache
+from db.indexes import create_partial_indexes
+from db.repositories.role_outbox import RoleOutboxRepository
+from db.triggers import create_triggers
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -20,20 +26,77 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup():
-    auth.auth_client = auth.AuthClient(base_url=config.AUTH_URL)
-    roles.roles_client = roles.RolesService(base_url=config.AUTH_URL)
+    http.auth_http_client = http.HttpClient(
+        base_url=config.AUTH_URL,
+        max_connections=config.AUTH_POOL_LIMIT,
+        max_keepalive_connections=config.AUTH_POOL_KEEPALIVE,
+        keepalive_expiry=config.AUTH_KEEPALIVE_TIMEOUT,
+        timeout=config.AUTH_TIMEOUT,
+        pool_timeout=config.AUTH_POOL_TIMEOUT,
+        http2=config.AUTH_HTTP2,
+    )
+    auth.auth_client = auth.AuthClient(http_client=http.auth_http_client)
+    revocation_listener = revocation.RevocationListener(
+        redis=Redis.from_url(config.REDIS_DSN, db=config.AUTH_REDIS_DB),
+        generation_ttl=config.AUTH_ACCESS_TOKEN_TTL,
+    )
+    await revocation_listener.start()
+    auth.token_cache = TokenCache(
+        revocation=revocation_listener,
+        max_size=config.AUTH_TOKEN_CACHE_SIZE,
+        max_ttl=config.AUTH_TOKEN_CACHE_TTL,
+    )
+    if config.AUTH_VERIFY_MODE == "local":
+        auth.token_verifier = auth.LocalTokenVerifier(
+            jwks_url=config.AUTH_JWKS_URL,
+            revocation=revocation_listener,
+            http_client=http.auth_http_client,
+            jwks_cache_seconds=config.AUTH_JWKS_CACHE_SECONDS,
+        )
+    roles.roles_client = roles.RolesService(
+        http_client=http.auth_http_client, service_token=config.SERVICE_TOKEN
+    )
+    stripe.stripe_client = stripe.StripeClient(
+        url=config.STRIPE_BASE_URL,
+        api_key=config.STRIPE_API_KEY,
+        pool_limit=config.STRIPE_POOL_LIMIT,
+        pool_limit_per_host=config.STRIPE_POOL_LIMIT_PER_HOST,
+        timeout=config.STRIPE_TIMEOUT,
+        keepalive_timeout=config.STRIPE_KEEPALIVE_TIMEOUT,
+    )
+    await stripe.stripe_client.start()
     await Tortoise.init(config=config.TORTOISE_CONFIG)
     await Tortoise.generate_schemas(safe=True)
+    await create_partial_indexes()
+    await create_triggers()
+    catalog.subscription_catalog.refresh_interval = config.SUBSCRIPTION_CATALOG_REFRESH
+    await catalog.subscription_catalog.start(credentials=DatabaseSettings().dict())
+    outbox.role_outbox_dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=roles.roles_client,
+        repository=RoleOutboxRepository(),
+        batch_size=config.ROLE_CHANGES_BATCH_SIZE,
+        interval=config.ROLE_OUTBOX_INTERVAL,
+        max_backoff=config.ROLE_OUTBOX_MAX_BACKOFF,
+        lease=config.ROLE_OUTBOX_LEASE,
+    )
+    await outbox.role_outbox_dispatcher.start()
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    await auth.token_cache.revocation.stop()
+    await stripe.stripe_client.close()
+    if outbox.role_outbox_dispatcher:
+        await outbox.role_outbox_dispatcher.stop()
+    await catalog.subscription_catalog.stop()
+    await http.auth_http_client.close()
     await Tortoise.close_connections()
 
 
 app.include_router(billing.router, prefix="/api/v1/billing", tags=["billing"])
 app.include_router(scheduler.router, prefix="/api/v1/billing", tags=["scheduler"])
 app.include_router(user.router, prefix="/api/v1/billing", tags=["user"])
+app.include_router(metrics.router, prefix="/api/v1/billing", tags=["metrics"])
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -4,9 +4,11 @@ from typing import Optional
 
 from pydantic import UUID4, BaseModel, Field
 
-from models.common_models import (Currency, OrderStatus, PaymentMethodType,
-                                  PaymentSystem, SubscriptionPeriod,
-                                  SubscriptionState, SubscriptionType)
+from core.config import CHECK_BATCH_SIZE_MAX
+from models.common_models import (CheckResult, Currency, OrderStatus,
+                                  PaymentMethodType, PaymentSystem,
+                                  SubscriptionPeriod, SubscriptionState,
+                                  SubscriptionType)
 
 
 class SubscriptionApiModel(BaseModel):
@@ -46,6 +48,16 @@ class OrderApiModel(BaseModel):
     refund: bool
 
 
+# Поля, которые можно запросить у списков заказов и подписок пользователя (параметр fields)
+SUBSCRIPTION_FIELDS = tuple(SubscriptionApiModel.__fields__)
+ORDER_FIELDS = tuple(
+    field for field in OrderApiModel.__fields__ if field != "subscription"
+)
+USER_SUBSCRIPTION_FIELDS = tuple(
+    field for field in UserSubscriptionApiModel.__fields__ if field != "subscription"
+)
+
+
 class PaymentMethodData(BaseModel):
     """Модель для метода оплаты картой"""
 
@@ -94,3 +106,29 @@ class RefundDataIn(BaseModel):
 class ExpireUserSubscriptionData(BaseModel):
     user_id: UUID4
     subscription_id: UUID4
+
+
+class ExternalIdsIn(BaseModel):
+    """Внешние идентификаторы заказов для пакетной проверки"""
+
+    external_ids: list[str] = Field(min_items=1, max_items=CHECK_BATCH_SIZE_MAX)
+
+
+class CheckResultOut(BaseModel):
+    """Результат проверки заказа"""
+
+    external_id: str
+    result: CheckResult
+
+
+class RenewalReportOut(BaseModel):
+    """Итоги продления страницы автоматических подписок"""
+
+    total: int
+    renewed: int
+    skipped: int
+    declined: int
+    errors: int
+    elapsed: float
+    per_second: float
+    next_cursor: Optional[UUID4] = None
@@ -55,6 +55,39 @@ class OrderStatus(Enum):
     ERROR = "error"
 
 
+class CheckResult(Enum):
+    """Результаты проверки заказа в платёжной системе"""
+
+    PAID = "paid"
+    PENDING = "pending"
+    NOT_FOUND = "not_found"
+    ERROR = "error"
+
+
+class RenewalResult(Enum):
+    """Результаты продления автоматической подписки"""
+
+    RENEWED = "renewed"
+    SKIPPED = "skipped"
+    DECLINED = "declined"
+    ERROR = "error"
+
+
+class RoleOperation(Enum):
+    """Операции с ролями пользователя"""
+
+    GRANT = "grant"
+    REVOKE = "revoke"
+
+
+class RoleChange(BaseModel):
+    """Изменение роли пользователя для пакетного запроса в auth"""
+
+    user_id: UUID4
+    role_title: str
+    op: RoleOperation
+
+
 class PaymentInner(BaseModel):
     """Внутренняя модель платежа"""
 
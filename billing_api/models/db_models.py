@@ -2,7 +2,7 @@ from tortoise import fields, timezone
 from tortoise.models import Model
 
 from .common_models import (Currency, OrderStatus, PaymentMethodType,
-                            PaymentSystem, SubscriptionPeriod,
+                            PaymentSystem, RoleOperation, SubscriptionPeriod,
                             SubscriptionState, SubscriptionType)
 
 
@@ -10,8 +10,8 @@ class AbstractModel(Model):
     """Абстрактная модель с общими полями"""
 
     id = fields.UUIDField(pk=True)
-    created = fields.DatetimeField(default=timezone.now())
-    modified = fields.DatetimeField(default=timezone.now())
+    created = fields.DatetimeField(default=timezone.now)
+    modified = fields.DatetimeField(default=timezone.now)
 
     class Meta:
         abstract = True
@@ -50,6 +50,11 @@ class UsersSubscription(AbstractModel):
 
     class Meta:
         table = "billing_userssubscription"
+        indexes = (
+            ("user_id", "status"),
+            ("user_id", "created", "id"),
+            ("status", "end_date"),
+        )
 
     def __str__(self):
         return f"{self.user_id} - {self.subscription} - {self.status}"
@@ -64,8 +69,8 @@ class PaymentMethod(Model):
         enum_type=PaymentMethodType, default=PaymentMethodType.CARD
     )
 
-    created = fields.DatetimeField(default=timezone.now())
-    modified = fields.DatetimeField(default=timezone.now())
+    created = fields.DatetimeField(default=timezone.now)
+    modified = fields.DatetimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.id} - {self.user_id} - {self.type}"
@@ -102,6 +107,31 @@ class Order(AbstractModel):
 
     class Meta:
         table = "billing_order"
+        indexes = (
+            ("user_id", "status", "created"),
+            ("user_id", "created", "id"),
+            ("parent_id",),
+        )
 
     def __str__(self):
         return f"{self.id} - {self.user_id} - {self.total_cost} - {self.status}"
+
+
+class RoleOutbox(Model):
+    """Изменения ролей, ожидающие отправки в auth"""
+
+    id = fields.BigIntField(pk=True)
+    user_id = fields.UUIDField(null=False)
+    role_title = fields.CharField(max_length=255, null=False)
+    op: RoleOperation = fields.CharEnumField(enum_type=RoleOperation)
+    created = fields.DatetimeField(auto_now_add=True)
+    attempts = fields.SmallIntField(default=0, null=False)
+    available_at = fields.DatetimeField(auto_now_add=True)
+    failed_at = fields.DatetimeField(null=True)
+    last_error = fields.TextField(null=True)
+
+    class Meta:
+        table = "billing_role_outbox"
+
+    def __str__(self):
+        return f"{self.id} - {self.user_id} - {self.op} {self.role_title}"
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from billing_api.core.auth import AuthClient
+from billing_api.core.http import HttpClient
+
+
+@pytest.fixture
+async def auth_server():
+    peers = set()
+
+    async def check_token(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(float(request.query.get("delay", 0)))
+        return web.json_response({"user_id": "test"})
+
+    app = web.Application()
+    app.router.add_post("/staff/api/v1/auth/check_token/", check_token)
+    server = TestServer(app)
+    await server.start_server()
+    server.peers = peers
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+class TestAuthPool:
+    async def test_connection_is_reused(self, auth_server):
+        """Тест переиспользования соединения с auth между запросами"""
+        http_client = HttpClient(base_url=str(auth_server.make_url("")))
+        auth_client = AuthClient(http_client=http_client)
+        try:
+            for token in ("first", "second", "third"):
+                response = await auth_client.check_token(token)
+                assert response.status_code == 200
+        finally:
+            await http_client.close()
+
+        assert len(auth_server.peers) == 1
+        snapshot = http_client.metrics.snapshot()
+        assert snapshot["requests"] == 3
+        assert snapshot["errors"] == 0
+        assert snapshot["in_flight"] == 0
+
+    async def test_pool_wait_is_limited(self, auth_server):
+        """Тест ожидания свободного соединения сверх размера пула"""
+        http_client = HttpClient(
+            base_url=str(auth_server.make_url("")), max_connections=1, pool_timeout=0.1
+        )
+        url = "/staff/api/v1/auth/check_token/?delay=0.3"
+        try:
+            results = await asyncio.gather(
+                http_client.request("POST", url),
+                http_client.request("POST", url),
+                return_exceptions=True,
+            )
+        finally:
+            await http_client.close()
+
+        assert results[0].status_code == 200
+        assert isinstance(results[1], httpx.PoolTimeout)
+        snapshot = http_client.metrics.snapshot()
+        assert snapshot["queued_total"] == 1
+        assert snapshot["queued"] == 0
+        assert snapshot["errors"] == 1
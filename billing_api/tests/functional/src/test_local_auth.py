@@ -0,0 +1,93 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jwt.algorithms import RSAAlgorithm
+
+from billing_api.core import auth
+from billing_api.core.auth import (LocalTokenVerifier,
+                                   LocalVerificationUnavailable)
+from billing_api.core.revocation import RevocationListener
+
+USER_ID = "4e7c09ff-f69e-45f0-8285-99f80a289320"
+
+
+@pytest.fixture
+def signing_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def token_verifier(signing_key):
+    revocation = RevocationListener(redis=None)
+    revocation.synced = True
+    verifier = LocalTokenVerifier(
+        jwks_url="http://auth/jwks", revocation=revocation, http_client=None
+    )
+    jwk = json.loads(RSAAlgorithm.to_jwk(signing_key.public_key()))
+    verifier.keys = {"test": jwt.PyJWK({**jwk, "kid": "test", "alg": "RS256"})}
+    verifier._keys_loaded_at = time.monotonic()
+    return verifier
+
+
+def make_token(signing_key, jti="test-jti", gen=0, **headers) -> str:
+    now = datetime.now(tz=timezone.utc)
+    payload = {
+        "jti": jti,
+        "gen": gen,
+        "user_id": USER_ID,
+        "user_email": "user@mail.ru",
+        "user_roles": json.dumps(["subscriber_gold"]),
+        "user_permissions": json.dumps(["can_watch_movies"]),
+        "country": "Russia",
+        "birthdate": None,
+        "iat": now,
+        "exp": now + timedelta(hours=1),
+    }
+    return jwt.encode(payload, key=signing_key, algorithm="RS256", headers=headers)
+
+
+@pytest.mark.asyncio
+class TestLocalTokenVerifier:
+    async def test_verify_token(self, token_verifier, signing_key):
+        """Тест локальной проверки токена"""
+        user = await token_verifier.verify(make_token(signing_key, kid="test"))
+        assert str(user.user_id) == USER_ID
+        assert user.user_roles == ["subscriber_gold"]
+
+    async def test_revoked_token(self, token_verifier, signing_key):
+        """Тест проверки отозванного токена"""
+        token = make_token(signing_key, kid="test")
+        token_verifier.revocation.revoked["test-jti"] = time.time() + 3600
+        with pytest.raises(jwt.InvalidTokenError):
+            await token_verifier.verify(token)
+
+    async def test_token_of_previous_generation(self, token_verifier, signing_key):
+        """Тест токена, выпущенного до выхода пользователя со всех устройств"""
+        token_verifier.revocation.generations[USER_ID] = 1
+        with pytest.raises(jwt.InvalidTokenError):
+            await token_verifier.verify(make_token(signing_key, kid="test"))
+        user = await token_verifier.verify(make_token(signing_key, gen=1, kid="test"))
+        assert str(user.user_id) == USER_ID
+
+    async def test_token_without_kid(self, token_verifier, signing_key):
+        """Тест токена, который нельзя проверить локально"""
+        with pytest.raises(LocalVerificationUnavailable):
+            await token_verifier.verify(make_token(signing_key))
+
+
+@pytest.mark.asyncio
+async def test_service_token(monkeypatch):
+    """Тест доступа к внутренним ручкам по общему секрету"""
+    monkeypatch.setattr(auth, "SERVICE_TOKEN", "secret")
+    await auth.service_required("secret")
+    with pytest.raises(HTTPException):
+        await auth.service_required("wrong")
+
+    monkeypatch.setattr(auth, "SERVICE_TOKEN", "")
+    with pytest.raises(HTTPException):
+        await auth.service_required("")
@@ -0,0 +1,70 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import orjson
+import pytest
+
+from billing_api.core.helpers import decode_cursor, encode_cursor, ndjson
+from billing_api.db.repositories.order import OrderRepository
+
+STARTED = datetime(2021, 9, 1, tzinfo=timezone.utc)
+ORDERS = [
+    {
+        "id": uuid.UUID(int=number),
+        "created": STARTED + timedelta(minutes=number // 2),
+        "external_id": f"pi_{number}",
+        "total_cost": Decimal("100.00"),
+    }
+    for number in range(7)
+]
+
+
+def test_cursor_round_trip():
+    """Тест кодирования курсора страницы"""
+    order = ORDERS[3]
+    assert decode_cursor(encode_cursor(order["created"], order["id"])) == (
+        order["created"],
+        order["id"],
+    )
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+@pytest.mark.asyncio
+async def test_processing_orders_are_streamed_by_pages(monkeypatch):
+    """Тест выгрузки всех заказов в обработке страницами по курсору"""
+    pages = []
+
+    async def get_processing_orders_page(refund, limit, fields, after=None):
+        pages.append(after)
+        rows = [
+            order
+            for order in ORDERS
+            if after is None or (order["created"], order["id"]) > after
+        ]
+        return rows[:limit]
+
+    monkeypatch.setattr(
+        OrderRepository,
+        "get_processing_orders_page",
+        staticmethod(get_processing_orders_page),
+    )
+    lines = [
+        line
+        async for line in ndjson(
+            OrderRepository().iter_processing_orders(
+                refund=False, fields=("id", "created", "external_id"), batch_size=3
+            )
+        )
+    ]
+
+    assert [orjson.loads(line)["external_id"] for line in lines] == [
+        order["external_id"] for order in ORDERS
+    ]
+    assert orjson.loads(lines[0])["total_cost"] == 100.0
+    assert pages == [
+        None,
+        (ORDERS[2]["created"], ORDERS[2]["id"]),
+        (ORDERS[5]["created"], ORDERS[5]["id"]),
+    ]
@@ -0,0 +1,185 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from hashlib import md5
+
+import pytest
+from tortoise import Tortoise
+
+from billing_api.db.indexes import create_partial_indexes
+from billing_api.db.repositories import order, user_subscription
+from billing_api.db.repositories.order import OrderRepository
+from billing_api.db.repositories.role_outbox import RoleOutboxRepository
+from billing_api.db.repositories.user_subscription import \
+    UserSubscriptionRepository
+
+from ..settings import TEST_DATABASE_DSN
+
+# Репозитории импортируют модели и перечисления как models.*: Tortoise.init
+# регистрирует те же модели, а перечисления берутся из модулей репозиториев
+OrderStatus = order.OrderStatus
+SubscriptionState = user_subscription.SubscriptionState
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_DSN, reason="TEST_DATABASE_DSN is not set"
+)
+
+# Таблицы, в которых запросы не должны читаться последовательным сканированием
+HOT_TABLES = {"billing_order", "billing_userssubscription", "billing_role_outbox"}
+ROWS = 50000
+USERS = 5000
+USER_ID = uuid.UUID(md5(b"1").hexdigest())
+SUBSCRIPTION_ID = uuid.UUID(md5(b"subscription").hexdigest())
+
+SEED_QUERIES = (
+    """
+    TRUNCATE billing_role_outbox, billing_userssubscription, billing_order,
+        billing_paymentmethod, billing_subscription CASCADE
+    """,
+    f"""
+    INSERT INTO billing_subscription
+        (id, created, modified, title, description, period, type, price, currency, automatic)
+    VALUES ('{SUBSCRIPTION_ID}', now(), now(), 'gold', '', 30, 'gold', 100, 'rub', true)
+    """,
+    """
+    INSERT INTO billing_paymentmethod (id, user_id, type, created, modified)
+    VALUES ('pm_test', md5('1')::uuid, 'card', now(), now())
+    """,
+    f"""
+    INSERT INTO billing_order
+        (id, created, modified, external_id, parent_id, user_id, user_email,
+         subscription_id, status, payment_method_id, payment_system, currency,
+         discount, total_cost, refund)
+    SELECT md5('order' || i)::uuid, now() - i * interval '1 minute', now(), 'pi_' || i,
+        CASE WHEN i % 10 = 0 THEN md5('order' || (i - 1))::uuid END,
+        md5((i % {USERS})::text)::uuid, 'user@mail.ru', '{SUBSCRIPTION_ID}',
+        CASE WHEN i % 100 = 0 THEN 'progress' ELSE 'paid' END,
+        'pm_test', 'stripe', 'rub', 0, 100, i % 7 = 0
+    FROM generate_series(1, {ROWS}) AS i
+    """,
+    f"""
+    INSERT INTO billing_userssubscription
+        (id, created, modified, user_id, subscription_id, start_date, end_date, status)
+    SELECT md5('subscription' || i)::uuid, now(), now(), md5((i % {USERS})::text)::uuid,
+        '{SUBSCRIPTION_ID}', current_date - i % 400, current_date - i % 400 + 30,
+        CASE
+            WHEN i % 100 = 0 THEN 'active'
+            WHEN i % 100 = 1 THEN 'canceled'
+            WHEN i % 100 = 2 THEN 'preactive'
+            ELSE 'inactive'
+        END
+    FROM generate_series(1, {ROWS}) AS i
+    """,
+    f"""
+    INSERT INTO billing_role_outbox
+        (user_id, role_title, op, created, attempts, available_at, failed_at)
+    SELECT md5((i % {USERS})::text)::uuid, 'subscriber_gold', 'grant', now(), 1, now(),
+        CASE WHEN i % 100 <> 0 THEN now() END
+    FROM generate_series(1, {ROWS}) AS i
+    """,
+    "ANALYZE",
+)
+
+
+@pytest.fixture
+async def connection():
+    await Tortoise.init(
+        db_url=TEST_DATABASE_DSN, modules={"billing": ["models.db_models"]}
+    )
+    await Tortoise.generate_schemas(safe=True)
+    await create_partial_indexes()
+    connection = Tortoise.get_connection("default")
+    for query in SEED_QUERIES:
+        await connection.execute_script(query)
+    yield connection
+    await Tortoise.close_connections()
+
+
+async def capture_queries(connection, monkeypatch, call) -> list[tuple]:
+    """Запросы, которые выполняет вызов репозитория (сами запросы не выполняются)"""
+    queries = []
+
+    async def execute_query(query, values=None):
+        queries.append((query, values))
+        return 0, []
+
+    async def execute_query_dict(query, values=None):
+        queries.append((query, values))
+        return []
+
+    with monkeypatch.context() as patch:
+        patch.setattr(connection, "execute_query", execute_query)
+        patch.setattr(connection, "execute_query_dict", execute_query_dict)
+        await call(connection)
+    return queries
+
+
+def seq_scans(plan: dict) -> list[str]:
+    """Таблицы из HOT_TABLES, которые план читает последовательным сканированием"""
+    tables = []
+    if plan["Node Type"] == "Seq Scan" and plan["Relation Name"] in HOT_TABLES:
+        tables.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables.extend(seq_scans(child))
+    return tables
+
+
+REPOSITORY_QUERIES = {
+    "order_by_user_and_status": lambda connection: OrderRepository().get_order(
+        user_id=USER_ID, status=OrderStatus.PAID, subscription_id=SUBSCRIPTION_ID
+    ),
+    "user_orders": lambda connection: OrderRepository.get_user_orders_page(
+        user_id=USER_ID, limit=50, fields=("id", "created", "external_id")
+    ),
+    "recurrent_order": lambda connection: OrderRepository().get_recurrent_order(
+        order_parend_id=uuid.UUID(md5(b"order1").hexdigest())
+    ),
+    "processing_orders": lambda connection: OrderRepository.get_processing_orders_page(
+        refund=False, limit=1000, fields=("id", "created", "external_id")
+    ),
+    "processing_refunds_next_page": lambda connection: OrderRepository.get_processing_orders_page(
+        refund=True,
+        limit=1000,
+        fields=("id", "created", "external_id"),
+        after=(datetime.now(tz=timezone.utc), uuid.UUID(int=0)),
+    ),
+    "user_subscription": lambda connection: UserSubscriptionRepository().get_user_subscription(
+        user_id=USER_ID,
+        status=[SubscriptionState.ACTIVE, SubscriptionState.CANCELED],
+    ),
+    "user_subscriptions": lambda connection: UserSubscriptionRepository.get_user_subscriptions_page(
+        user_id=USER_ID,
+        limit=50,
+        fields=("id", "created", "status"),
+    ),
+    "expiring_automatic": lambda connection: UserSubscriptionRepository().get_expiring_active_subscriptions_automatic(),
+    "expiring_automatic_page": lambda connection: UserSubscriptionRepository.get_expiring_active_subscriptions_automatic_page(
+        limit=500, after=uuid.UUID(int=0)
+    ),
+    "disable_expired": lambda connection: UserSubscriptionRepository.disable_expired_user_subscriptions(
+        connection
+    ),
+    "enable_preactive": lambda connection: UserSubscriptionRepository.enable_preactive_user_subscriptions(
+        connection
+    ),
+    "pending_role_changes": lambda connection: RoleOutboxRepository.get_pending(
+        connection, limit=1000
+    ),
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", REPOSITORY_QUERIES)
+async def test_query_uses_index(name, connection, monkeypatch):
+    """Тест отсутствия последовательного сканирования в запросах репозиториев"""
+    queries = await capture_queries(connection, monkeypatch, REPOSITORY_QUERIES[name])
+    assert queries
+
+    for query, values in queries:
+        rows = await connection.execute_query_dict(
+            f"EXPLAIN (FORMAT JSON) {query}", values
+        )
+        plan = rows[0]["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        assert seq_scans(plan[0]["Plan"]) == [], query
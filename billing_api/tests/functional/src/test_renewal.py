@@ -0,0 +1,203 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from billing_api.core import renewal
+from billing_api.core.helpers import RateLimiter
+from billing_api.models.common_models import Currency
+
+# Модули приложения импортируют перечисления как models.*, поэтому сравниваемые
+# с ними значения берутся из тестируемого модуля
+OrderStatus, RenewalResult = renewal.OrderStatus, renewal.RenewalResult
+
+SUBSCRIPTION = SimpleNamespace(id=uuid.UUID(int=100), period=30)
+TOMORROW = date.today() + timedelta(days=1)
+
+
+def make_user_subscription(number: int):
+    return SimpleNamespace(
+        id=uuid.UUID(int=number),
+        user_id=uuid.UUID(int=number),
+        subscription_id=SUBSCRIPTION.id,
+        start_date=TOMORROW - timedelta(days=30),
+        end_date=TOMORROW,
+    )
+
+
+def make_order(user_id, parent_id=None, status=OrderStatus.PAID, created=None):
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        parent_id=parent_id,
+        user_id=user_id,
+        user_email="user@mail.ru",
+        subscription_id=SUBSCRIPTION.id,
+        subscription=SUBSCRIPTION,
+        payment_method=SimpleNamespace(id="pm_test"),
+        currency=Currency.RUB,
+        total_cost=100,
+        status=status,
+        created=created or datetime.now(tz=timezone.utc),
+    )
+
+
+class FakeOrderRepository:
+    def __init__(self, parents, children):
+        self.parents = parents
+        self.children = children
+        self.statuses = {}
+
+    async def get_renewal_orders(self, user_subscriptions):
+        return {(order.user_id, order.subscription_id): order for order in self.parents}
+
+    async def get_recurrent_orders(self, order_parent_ids):
+        return self.children
+
+    async def create_recurrent_order(self, order):
+        child = make_order(
+            order.user_id, parent_id=order.id, status=OrderStatus.CREATED
+        )
+        self.children.append(child)
+        return child
+
+    async def get_or_create_renewal_order(self, order, since):
+        for child in self.children:
+            if child.parent_id == order.id and child.created >= since:
+                child.status = self.statuses.get(child.id, child.status)
+                return child
+        return await self.create_recurrent_order(order)
+
+    async def complete_order(self, order_id, external_id, status):
+        if order_id in self.statuses:
+            return False
+        self.statuses[order_id] = status
+        return True
+
+
+class FakeUserSubscriptionRepository:
+    def __init__(self):
+        self.created = []
+
+    async def create_user_subscriptions(self, order, status, start_date, end_date):
+        self.created.append((order.user_id, start_date, end_date))
+
+
+class FakeStripe:
+    def __init__(self, declined_users=()):
+        self.declined_users = declined_users
+        self.keys = []
+
+    async def create_recurrent_payment(self, customer_id, idempotency_key, **kwargs):
+        self.keys.append(idempotency_key)
+        status = (
+            "requires_payment_method"
+            if customer_id in self.declined_users
+            else "succeeded"
+        )
+        return SimpleNamespace(id=f"pi_{customer_id}", status=status)
+
+
+@pytest.fixture(autouse=True)
+def fake_transaction(monkeypatch):
+    @asynccontextmanager
+    async def in_transaction():
+        yield None
+
+    monkeypatch.setattr(renewal, "in_transaction", in_transaction)
+
+
+@pytest.mark.asyncio
+async def test_cohort_is_renewed_once():
+    """Тест продления подписок: уже продлённые пропускаются, отклонённые не повторяются"""
+    user_subscriptions = [make_user_subscription(number) for number in range(1, 5)]
+    parents = [
+        make_order(user_subscription.user_id)
+        for user_subscription in user_subscriptions
+    ]
+    # Первая подписка уже продлена, у второй остался заказ прошлого периода
+    children = [
+        make_order(parents[0].user_id, parent_id=parents[0].id),
+        make_order(
+            parents[1].user_id,
+            parent_id=parents[1].id,
+            created=datetime.now(tz=timezone.utc) - timedelta(days=40),
+        ),
+    ]
+    order_repository = FakeOrderRepository(parents, children)
+    user_subscription_repository = FakeUserSubscriptionRepository()
+    stripe = FakeStripe(declined_users={parents[3].user_id})
+    runner = renewal.RecurringPaymentRunner(
+        stripe_client=stripe,
+        order_repository=order_repository,
+        user_subscription_repository=user_subscription_repository,
+        rate_limit=1000,
+    )
+
+    results = await runner.renew(user_subscriptions)
+
+    assert results == [
+        RenewalResult.SKIPPED,
+        RenewalResult.RENEWED,
+        RenewalResult.RENEWED,
+        RenewalResult.DECLINED,
+    ]
+    assert user_subscription_repository.created[0][1:] == (
+        TOMORROW,
+        TOMORROW + timedelta(days=30),
+    )
+    assert len(stripe.keys) == len(set(stripe.keys)) == 3
+
+    # Повторный запуск не списывает деньги второй раз
+    for child in order_repository.children:
+        child.status = order_repository.statuses.get(child.id, child.status)
+    assert await runner.renew(user_subscriptions) == [
+        RenewalResult.SKIPPED,
+        RenewalResult.SKIPPED,
+        RenewalResult.SKIPPED,
+        RenewalResult.DECLINED,
+    ]
+    assert len(stripe.keys) == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    """Тест ограничения частоты запросов в stripe"""
+    limiter = RateLimiter(rate=100)
+    started = time.monotonic()
+    for _ in range(6):
+        await limiter.wait()
+    assert time.monotonic() - started >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_overlapping_runs_charge_once():
+    """Тест параллельных запусков по одной странице: один заказ и одно продление на подписку"""
+    user_subscriptions = [make_user_subscription(number) for number in range(1, 4)]
+    parents = [
+        make_order(user_subscription.user_id)
+        for user_subscription in user_subscriptions
+    ]
+    order_repository = FakeOrderRepository(parents, [])
+    user_subscription_repository = FakeUserSubscriptionRepository()
+    stripe = FakeStripe()
+
+    def make_runner():
+        return renewal.RecurringPaymentRunner(
+            stripe_client=stripe,
+            order_repository=order_repository,
+            user_subscription_repository=user_subscription_repository,
+            rate_limit=1000,
+        )
+
+    await asyncio.gather(
+        make_runner().renew(user_subscriptions),
+        make_runner().renew(user_subscriptions),
+    )
+
+    assert len(order_repository.children) == 3
+    assert len(set(stripe.keys)) == 3
+    assert len(user_subscription_repository.created) == 3
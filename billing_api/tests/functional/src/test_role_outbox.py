@@ -0,0 +1,186 @@
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from tortoise import timezone
+
+from billing_api.core import outbox
+from billing_api.models.common_models import RoleOperation
+
+USER_ID = "4e7c09ff-f69e-45f0-8285-99f80a289320"
+
+
+class FakeRepository:
+    """Очередь изменений ролей в памяти"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.failed = []
+
+    async def try_lock(self, connection, key):
+        return True
+
+    async def get_pending(self, connection, limit):
+        return self.entries[:limit]
+
+    async def claim(self, connection, ids, until):
+        for entry in self.entries:
+            if entry.id in ids:
+                entry.available_at = until
+
+    async def delete(self, connection, ids):
+        self.entries = [entry for entry in self.entries if entry.id not in ids]
+
+    async def postpone(self, connection, ids, available_at, error):
+        for entry in self.entries:
+            if entry.id in ids:
+                entry.attempts += 1
+                entry.available_at = available_at
+
+    async def fail(self, connection, ids, error):
+        self.failed += [entry for entry in self.entries if entry.id in ids]
+        self.entries = [entry for entry in self.entries if entry.id not in ids]
+
+
+class FakeRolesClient:
+    def __init__(self, error=None, unknown_roles=()):
+        self.error = error
+        self.unknown_roles = unknown_roles
+        self.batches = []
+
+    async def apply_role_changes(self, changes):
+        if self.error:
+            raise self.error
+        if any(change.role_title in self.unknown_roles for change in changes):
+            request = httpx.Request("POST", "http://auth/")
+            response = httpx.Response(400, request=request, text="unknown role")
+            raise httpx.HTTPStatusError(
+                "bad request", request=request, response=response
+            )
+        self.batches.append(
+            [(change.op.value, change.role_title) for change in changes]
+        )
+
+
+def make_entries(*ops):
+    return [
+        SimpleNamespace(
+            id=id,
+            user_id=USER_ID,
+            role_title="subscriber_gold",
+            op=op.value,
+            attempts=0,
+            available_at=timezone.now(),
+        )
+        for id, op in enumerate(ops, start=1)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def fake_transaction(monkeypatch):
+    @asynccontextmanager
+    async def in_transaction():
+        yield None
+
+    monkeypatch.setattr(outbox, "in_transaction", in_transaction)
+
+
+@pytest.mark.asyncio
+async def test_changes_are_delivered_in_order():
+    """Тест доставки изменений ролей пачками в порядке добавления"""
+    repository = FakeRepository(
+        make_entries(RoleOperation.GRANT, RoleOperation.REVOKE, RoleOperation.GRANT)
+    )
+    roles_client = FakeRolesClient()
+    dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=roles_client, repository=repository, batch_size=2
+    )
+
+    assert await dispatcher.dispatch() == 2
+    assert await dispatcher.dispatch() == 1
+    assert roles_client.batches == [
+        [
+            ("grant", "subscriber_gold"),
+            ("revoke", "subscriber_gold"),
+        ],
+        [("grant", "subscriber_gold")],
+    ]
+    assert repository.entries == []
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_later():
+    """Тест отложенного повтора пачки, если auth недоступен"""
+    repository = FakeRepository(make_entries(RoleOperation.GRANT))
+    roles_client = FakeRolesClient(error=httpx.ConnectError("auth is down"))
+    dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=roles_client, repository=repository
+    )
+
+    assert await dispatcher.dispatch() == 0
+    assert repository.entries[0].attempts == 1
+    assert repository.entries[0].available_at > timezone.now()
+
+    # Пока не наступило время повтора, пачка не отправляется
+    roles_client.error = None
+    assert await dispatcher.dispatch() == 0
+
+    repository.entries[0].available_at = timezone.now() - timedelta(seconds=1)
+    assert await dispatcher.dispatch() == 1
+
+
+@pytest.mark.asyncio
+async def test_rejected_batch_is_not_retried():
+    """Тест изменений, которые auth отклонил как некорректные"""
+    request = httpx.Request("POST", "http://auth/")
+    response = httpx.Response(400, request=request, text="unknown role")
+    repository = FakeRepository(make_entries(RoleOperation.GRANT))
+    dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=FakeRolesClient(
+            error=httpx.HTTPStatusError(
+                "bad request", request=request, response=response
+            )
+        ),
+        repository=repository,
+    )
+
+    assert await dispatcher.dispatch() == 0
+    assert repository.entries == []
+    assert len(repository.failed) == 1
+
+
+@pytest.mark.asyncio
+async def test_only_rejected_changes_fail():
+    """Тест пачки, в которой auth отклонил одно изменение"""
+    repository = FakeRepository(
+        make_entries(RoleOperation.GRANT, RoleOperation.REVOKE, RoleOperation.GRANT)
+    )
+    repository.entries[1].role_title = "unknown"
+    roles_client = FakeRolesClient(unknown_roles={"unknown"})
+    dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=roles_client, repository=repository
+    )
+
+    assert await dispatcher.dispatch() == 2
+    assert roles_client.batches == [
+        [("grant", "subscriber_gold")],
+        [("grant", "subscriber_gold")],
+    ]
+    assert repository.entries == []
+    assert [entry.id for entry in repository.failed] == [2]
+
+
+@pytest.mark.asyncio
+async def test_claimed_batch_is_not_sent_twice():
+    """Тест пачки, которую уже отправляет другой воркер"""
+    repository = FakeRepository(make_entries(RoleOperation.GRANT))
+    roles_client = FakeRolesClient()
+    dispatcher = outbox.RoleOutboxDispatcher(
+        roles_client=roles_client, repository=repository
+    )
+
+    await dispatcher._claim()
+    assert await dispatcher.dispatch() == 0
+    assert roles_client.batches == []
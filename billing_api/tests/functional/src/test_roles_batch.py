@@ -0,0 +1,46 @@
+import pytest
+
+from billing_api.core import roles
+from billing_api.models.common_models import RoleChange, RoleOperation
+
+USER_ID = "4e7c09ff-f69e-45f0-8285-99f80a289320"
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+
+class FakeHttpClient:
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, method, url, json, headers):
+        self.requests.append((json["changes"], headers))
+        return FakeResponse()
+
+
+@pytest.mark.asyncio
+async def test_role_changes_are_sent_in_batches(monkeypatch):
+    """Тест пакетной отправки изменений ролей в auth"""
+    http_client = FakeHttpClient()
+    monkeypatch.setattr(roles, "ROLE_CHANGES_BATCH_SIZE", 2)
+    client = roles.RolesService(http_client=http_client, service_token="secret")
+
+    await client.apply_role_changes(
+        [
+            RoleChange(user_id=USER_ID, role_title="subscriber_gold", op=op)
+            for op in (RoleOperation.GRANT, RoleOperation.REVOKE, RoleOperation.GRANT)
+        ]
+    )
+
+    requests = [changes for changes, _ in http_client.requests]
+    assert [len(batch) for batch in requests] == [2, 1]
+    assert all(
+        headers == {"X-Service-Token": "secret"} for _, headers in http_client.requests
+    )
+    assert requests[0][1] == {
+        "user_id": USER_ID,
+        "role_title": "subscriber_gold",
+        "op": "revoke",
+    }
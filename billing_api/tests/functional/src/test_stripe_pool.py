@@ -0,0 +1,44 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from billing_api.core.stripe import StripeClient
+
+
+@pytest.fixture
+async def stripe_server():
+    peers = set()
+
+    async def payment_intent(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.json_response(
+            {"id": request.match_info["id"], "amount": 100, "status": "succeeded"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/payment_intents/{id}", payment_intent)
+    server = TestServer(app)
+    await server.start_server()
+    server.peers = peers
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+class TestStripePool:
+    async def test_session_is_reused(self, stripe_server):
+        """Тест переиспользования соединения между запросами"""
+        client = StripeClient(url=str(stripe_server.make_url("")), api_key="test")
+        await client.start()
+        try:
+            for payment_id in ("first", "second", "third"):
+                payment = await client.get_payment_data(payment_intents_id=payment_id)
+                assert payment.id == payment_id
+        finally:
+            await client.close()
+
+        assert len(stripe_server.peers) == 1
+        snapshot = client.metrics.snapshot()
+        assert snapshot["requests"] == 3
+        assert snapshot["errors"] == 0
+        assert snapshot["in_flight"] == 0
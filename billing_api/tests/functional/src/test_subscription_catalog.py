@@ -0,0 +1,61 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from billing_api.core.catalog import SubscriptionCatalog, SubscriptionNotFound
+
+GOLD_ID = uuid.UUID(int=1)
+BRONZE_ID = uuid.UUID(int=2)
+
+
+@pytest.fixture
+def catalog():
+    catalog = SubscriptionCatalog()
+    catalog.subscriptions = {
+        GOLD_ID: SimpleNamespace(id=GOLD_ID, title="gold", period=30, automatic=True),
+        BRONZE_ID: SimpleNamespace(
+            id=BRONZE_ID, title="bronze", period=7, automatic=False
+        ),
+    }
+    catalog.synced = True
+    return catalog
+
+
+@pytest.mark.asyncio
+async def test_subscriptions_are_attached_from_memory(catalog):
+    """Тест подстановки подписок в заказы без обращения к базе"""
+    orders = [
+        SimpleNamespace(subscription_id=GOLD_ID),
+        SimpleNamespace(subscription_id=BRONZE_ID),
+    ]
+
+    await catalog.attach(orders)
+
+    assert [order.subscription.title for order in orders] == ["gold", "bronze"]
+    assert await catalog.automatic_ids() == [GOLD_ID]
+    assert catalog.misses == 0
+
+
+@pytest.mark.asyncio
+async def test_subscription_fields_are_nested(catalog):
+    """Тест подстановки полей подписки в строки выборки values()"""
+    rows = [{"id": 1, "subscription_id": GOLD_ID}]
+
+    assert await catalog.nest(rows, ["title", "period"]) == [
+        {"id": 1, "subscription": {"title": "gold", "period": 30}}
+    ]
+    assert await catalog.nest([{"id": 2}], []) == [{"id": 2}]
+
+
+@pytest.mark.asyncio
+async def test_missing_subscription_is_reported(catalog, monkeypatch):
+    """Тест понятной ошибки, если подписки нет ни в справочнике, ни в базе"""
+
+    async def resolve(ids):
+        return catalog.subscriptions
+
+    monkeypatch.setattr(catalog, "_resolve", resolve)
+
+    with pytest.raises(SubscriptionNotFound):
+        await catalog.attach([SimpleNamespace(subscription_id=uuid.UUID(int=3))])
@@ -0,0 +1,107 @@
+import time
+
+import jwt
+import pytest
+
+from billing_api.core.revocation import RevocationListener
+from billing_api.core.token_cache import TokenCache
+from billing_api.models.common_models import AuthUserInner
+
+USER_ID = "4e7c09ff-f69e-45f0-8285-99f80a289320"
+
+
+@pytest.fixture
+def revocation():
+    revocation = RevocationListener(redis=None)
+    revocation.synced = True
+    return revocation
+
+
+@pytest.fixture
+def user():
+    return AuthUserInner(
+        user_id=USER_ID,
+        user_email="user@mail.ru",
+        country="RU",
+        user_roles=[],
+        user_permissions=[],
+    )
+
+
+def make_token(jti: str, exp_delta: float = 3600, gen: int = 0) -> str:
+    return jwt.encode(
+        {"user_id": USER_ID, "jti": jti, "gen": gen, "exp": time.time() + exp_delta},
+        key="secret",
+        algorithm="HS256",
+    )
+
+
+def test_cached_token_is_returned(revocation, user):
+    """Тест повторной проверки токена из кеша"""
+    cache = TokenCache(revocation=revocation)
+    token = make_token("first")
+
+    assert cache.get(token) is None
+    cache.put(token, user)
+    assert cache.get(token) == user
+    assert cache.snapshot()["hits"] == 1
+    assert cache.snapshot()["misses"] == 1
+
+
+def test_entry_lives_no_longer_than_token(revocation, user):
+    """Тест ограничения времени жизни записи сроком действия токена"""
+    cache = TokenCache(revocation=revocation, max_ttl=300)
+    token = make_token("first", exp_delta=-1)
+
+    cache.put(token, user)
+    assert cache.get(token) is None
+
+
+def test_revoked_token_is_evicted(revocation, user):
+    """Тест удаления из кеша отозванных токенов и сброшенных сессий"""
+    cache = TokenCache(revocation=revocation)
+    revoked_token, other_token = make_token("revoked"), make_token("other")
+    cache.put(revoked_token, user)
+    cache.put(other_token, user)
+
+    revocation._apply({"type": "token", "id": "revoked", "exp": time.time() + 60})
+    assert cache.get(revoked_token) is None
+    assert cache.get(other_token) == user
+
+    revocation._apply({"type": "user", "id": USER_ID, "generation": 1})
+    assert cache.get(other_token) is None
+    assert cache.snapshot()["revoked"] == 2
+
+
+def test_old_generations_are_pruned(revocation):
+    """Тест удаления поколений, сменившихся раньше выпуска всех живых токенов"""
+    now = int(time.time() * 1000)
+    revocation.generations = {"old": now - 3601 * 1000, "recent": now - 60 * 1000}
+    revocation._pruned_at = 0
+
+    revocation._apply({"type": "user", "id": USER_ID, "generation": now})
+    assert revocation.generations == {"recent": now - 60 * 1000, USER_ID: now}
+
+
+def test_cache_is_bounded(revocation, user):
+    """Тест вытеснения давно не использованных токенов"""
+    cache = TokenCache(revocation=revocation, max_size=2)
+    first, second, third = (make_token(jti) for jti in ("first", "second", "third"))
+    cache.put(first, user)
+    cache.put(second, user)
+    cache.get(first)
+    cache.put(third, user)
+
+    assert cache.get(second) is None
+    assert cache.get(first) == user
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_cache_is_bypassed_until_synced(revocation, user):
+    """Тест работы без кеша, пока список отзывов не синхронизирован"""
+    cache = TokenCache(revocation=revocation)
+    token = make_token("first")
+    cache.put(token, user)
+
+    revocation.synced = False
+    assert cache.get(token) is None
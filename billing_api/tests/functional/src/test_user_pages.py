@@ -0,0 +1,51 @@
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from billing_api.api.v1.user import _page_response, _parse_fields
+from billing_api.core.helpers import decode_cursor
+from billing_api.models.api_models import ORDER_FIELDS
+
+CREATED = datetime(2021, 9, 1, tzinfo=timezone.utc)
+
+
+def test_sparse_fields_are_selected():
+    """Тест выбора полей заказа и подписки по параметру fields"""
+    assert _parse_fields("status, subscription.title", ORDER_FIELDS) == (
+        ["id", "created", "status"],
+        ["title"],
+    )
+    assert "automatic" in _parse_fields(None, ORDER_FIELDS)[1]
+    with pytest.raises(HTTPException):
+        _parse_fields("password", ORDER_FIELDS)
+
+
+def test_rows_are_serialized_with_cursor():
+    """Тест сериализации страницы строк из базы и курсора следующей страницы"""
+    rows = [
+        {
+            "id": uuid.UUID(int=number),
+            "created": CREATED,
+            "total_cost": Decimal("100.50"),
+            "subscription": {"title": "gold"},
+        }
+        for number in (2, 1)
+    ]
+
+    response = _page_response(rows, limit=2)
+
+    assert orjson.loads(response.body)[0] == {
+        "id": str(uuid.UUID(int=2)),
+        "created": "2021-09-01T00:00:00+00:00",
+        "total_cost": 100.5,
+        "subscription": {"title": "gold"},
+    }
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == (
+        CREATED,
+        uuid.UUID(int=1),
+    )
+    assert "X-Next-Cursor" not in _page_response([], limit=2).headers
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import backoff
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from helpers import (RENEWAL_COUNTERS, achunked,  # type: ignore
+                     log_check_results, log_renewal_results)
+from settings import Settings  # type: ignore
+
+logger = logging.getLogger("scheduler")
+
+
+class AsyncSchedulerService:
+    """Класс для работы асинхронного планировщика"""
+
+    def __init__(self, billing_settings: Settings):
+        self.billing_api_url = billing_settings.BILLING_API_URL
+        self.base_endpoint = billing_settings.BILLING_API_BASE_ENDPOINT
+        self.concurrency = billing_settings.SCHEDULER_CONCURRENCY
+        self.check_batch_size = billing_settings.SCHEDULER_CHECK_BATCH_SIZE
+        self.pool_limit = billing_settings.SCHEDULER_HTTP_POOL_LIMIT
+        self.timeout = ClientTimeout(total=billing_settings.SCHEDULER_HTTP_TIMEOUT)
+        self.session: Optional[ClientSession] = None
+
+    async def start(self) -> None:
+        """Создание пула соединений к billing api"""
+        self.session = ClientSession(
+            connector=TCPConnector(limit=self.pool_limit), timeout=self.timeout
+        )
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        if self.session:
+            await self.session.close()
+
+    @backoff.on_exception(
+        exception=(ClientError, asyncio.TimeoutError),
+        wait_gen=backoff.expo,
+        max_time=30,
+        logger=logger,
+    )
+    async def _request(self, method: str, endpoint: str, data: dict = None):
+        async with self.session.request(
+            method=method,
+            url=f"{self.billing_api_url}{self.base_endpoint}{endpoint}",
+            json=data,
+        ) as response:
+            if response.ok:
+                return await response.json()
+            logger.error(
+                "Error when requesting the billing api status_code=%s,  reason - %s",
+                response.status,
+                response.reason,
+            )
+
+    async def _stream(self, endpoint: str) -> AsyncIterator[dict]:
+        """Построчное чтение NDJSON ответа billing api"""
+        async with self.session.get(
+            f"{self.billing_api_url}{self.base_endpoint}{endpoint}",
+            # Поток читается сколько угодно долго, ограничено только ожидание очередной строки
+            timeout=ClientTimeout(total=None, sock_read=self.timeout.total),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def _run_bounded_stream(
+        self, handler: Callable[[Any], Awaitable[None]], items: AsyncIterator
+    ) -> None:
+        """
+        Конкурентный запуск обработчика по мере чтения потока.
+        Следующий элемент читается, только когда освободился слот, поэтому память не зависит от длины потока
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: set[asyncio.Task] = set()
+
+        async def run(item) -> None:
+            try:
+                await handler(item)
+            finally:
+                semaphore.release()
+
+        async for item in items:
+            await semaphore.acquire()
+            task = asyncio.create_task(run(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    async def _external_ids(self, endpoint: str, counter: dict) -> AsyncIterator[str]:
+        async for order in self._stream(endpoint):
+            counter["total"] += 1
+            yield order["external_id"]
+
+    async def check_processing_orders(self) -> None:
+        """Метод проверки оплаты заказов в обработке"""
+        try:
+            counter = {"total": 0}
+            await self._run_bounded_stream(
+                self.check_orders_payment,
+                achunked(
+                    self._external_ids("/orders/processing/stream", counter),
+                    self.check_batch_size,
+                ),
+            )
+            logger.info("%s orders in processing", counter["total"])
+        except Exception as e:
+            logger.exception("Error when trying to check processing orders: %s", e)
+
+    async def check_orders_payment(self, orders_external_ids: list) -> None:
+        """Метод пакетной проверки оплаты заказов"""
+        try:
+            results = await self._request(
+                method="POST",
+                endpoint="/orders/check",
+                data={"external_ids": orders_external_ids},
+            )
+            log_check_results(name="orders", results=results)
+        except Exception as e:
+            logger.exception(
+                "Error when trying to check payment for %s orders: %s",
+                len(orders_external_ids),
+                e,
+            )
+
+    async def check_processing_refunds(self) -> None:
+        """Метод проверки проведения возвратов в обработке"""
+        try:
+            counter = {"total": 0}
+            await self._run_bounded_stream(
+                self.check_refunds_execution,
+                achunked(
+                    self._external_ids("/refunds/processing/stream", counter),
+                    self.check_batch_size,
+                ),
+            )
+            logger.info("%s refunds in processing", counter["total"])
+        except Exception as e:
+            logger.exception("Error when trying to check processing refunds: %s", e)
+
+    async def check_refunds_execution(self, refunds_external_ids: list) -> None:
+        """Метод пакетной проверки выполнения возвратов"""
+        try:
+            results = await self._request(
+                method="POST",
+                endpoint="/refunds/check",
+                data={"external_ids": refunds_external_ids},
+            )
+            log_check_results(name="refunds", results=results)
+        except Exception as e:
+            logger.exception(
+                "Error when trying to check execution of %s refunds: %s",
+                len(refunds_external_ids),
+                e,
+            )
+
+    async def disable_expired_user_subscription(self) -> None:
+        """Метод отключает все истёкшие подписки пользователя"""
+        try:
+            await self._request(method="GET", endpoint="/subscriptions/expired/disable")
+            logger.info("Expired subscriptions on %s are disabled", date.today())
+        except Exception as e:
+            logger.exception(
+                "Error when trying to disable expired user subscriptions : %s", e
+            )
+
+    async def check_expiring_active_subscriptions_automatic(self) -> None:
+        """
+        Метод продления всех активных автоматических подписок, срок действия которых истекает завтра.
+        Billing продлевает подписки страницами с пулом воркеров, повтор страницы безопасен
+        """
+        try:
+            totals: Counter = Counter()
+            started = time.monotonic()
+            cursor = None
+            while True:
+                report = await self._request(
+                    method="POST",
+                    endpoint="/subscriptions/automatic/renew"
+                    + (f"?cursor={cursor}" if cursor else ""),
+                )
+                if report is None:
+                    break
+                totals.update(
+                    {counter: report[counter] for counter in RENEWAL_COUNTERS}
+                )
+                cursor = report["next_cursor"]
+                if not cursor:
+                    break
+            log_renewal_results(totals, time.monotonic() - started)
+        except Exception as e:
+            logger.exception("Error when trying to renew expiring subscriptions: %s", e)
+
+    async def enable_preactive_user_subscriptions(self) -> None:
+        """Метод активации предактивных подпискок"""
+        try:
+            await self._request(
+                method="GET", endpoint="/subscriptions/preactive/enable"
+            )
+            logger.info("Preactive subscriptions on %s are enable", date.today())
+        except Exception as e:
+            logger.exception(
+                "Error when trying to enable preactive user subscriptions : %s", e
+            )
+
+
+async def run_periodically(job: Callable[[], Awaitable[None]], period: float) -> None:
+    """
+    Запуск задачи с фиксированным периодом.
+    Период отсчитывается от запланированного времени старта, поэтому не зависит
+    ни от длительности самой задачи, ни от других задач планировщика.
+    """
+    loop = asyncio.get_running_loop()
+    next_run = loop.time()
+    while True:
+        started = loop.time()
+        try:
+            await job()
+        except Exception as e:
+            logger.exception("Unhandled error in job %s: %s", job.__name__, e)
+        elapsed = loop.time() - started
+        logger.info("Sweep %s finished in %.3f s", job.__name__, elapsed)
+
+        next_run += period
+        if next_run < loop.time():
+            logger.warning(
+                "Sweep %s took %.3f s, longer than its period %s s",
+                job.__name__,
+                elapsed,
+                period,
+            )
+            next_run = loop.time()
+        await asyncio.sleep(next_run - loop.time())
+
+
+async def start_async_scheduler(billing_settings: Settings) -> None:
+    """Функция запуска асинхронного планировщика"""
+    logger.info("Async scheduler is starting")
+    scheduler = AsyncSchedulerService(billing_settings=billing_settings)
+    await scheduler.start()
+    logger.info("Async scheduler is running")
+    try:
+        await asyncio.gather(
+            run_periodically(scheduler.check_processing_orders, period=5),
+            run_periodically(scheduler.check_processing_refunds, period=5),
+            run_periodically(
+                scheduler.check_expiring_active_subscriptions_automatic, period=10
+            ),
+            run_periodically(scheduler.disable_expired_user_subscription, period=10),
+            run_periodically(scheduler.enable_preactive_user_subscriptions, period=10),
+        )
+    finally:
+        await scheduler.close()
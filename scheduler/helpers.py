@@ -0,0 +1,48 @@
+import logging
+from collections import Counter
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+
+logger = logging.getLogger("scheduler")
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Функция разбиения списка (или потока элементов) на части размером не более size"""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+async def achunked(items: AsyncIterator, size: int) -> AsyncIterator[list]:
+    """Функция разбиения асинхронного потока элементов на части размером не более size"""
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def log_check_results(name: str, results: list) -> None:
+    """Функция логирования итогов пакетной проверки"""
+    logger.info(
+        "Checked %s %s: %s",
+        len(results),
+        name,
+        dict(Counter(result.get("result") for result in results)),
+    )
+
+
+RENEWAL_COUNTERS = ("total", "renewed", "skipped", "declined", "errors")
+
+
+def log_renewal_results(totals: Counter, elapsed: float) -> None:
+    """Функция логирования итогов продления подписок и скорости продления"""
+    logger.info(
+        "Renewed expiring subscriptions in %.3f s, %.1f per second: %s",
+        elapsed,
+        totals["total"] / elapsed if elapsed else 0.0,
+        {counter: totals[counter] for counter in RENEWAL_COUNTERS},
+    )
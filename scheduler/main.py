@@ -1,12 +1,19 @@
+import asyncio
+import json
 import logging
 import time
+from collections import Counter
 from datetime import date
+from typing import Iterator
 
 import backoff
 import schedule
 from requests import request  # type: ignore
 from requests.exceptions import RequestException  # type: ignore
 
+from async_scheduler import start_async_scheduler  # type: ignore
+from helpers import (RENEWAL_COUNTERS, chunked,  # type: ignore
+                     log_check_results, log_renewal_results)
 from settings import Settings  # type: ignore
 
 settings = Settings()
@@ -19,6 +26,7 @@ class SchedulerService:
     def __init__(self, billing_settings: Settings):
         self.billing_api_url = billing_settings.BILLING_API_URL
         self.base_endpoint = billing_settings.BILLING_API_BASE_ENDPOINT
+        self.check_batch_size = billing_settings.SCHEDULER_CHECK_BATCH_SIZE
 
     @backoff.on_exception(
         exception=RequestException, wait_gen=backoff.expo, max_time=30, logger=logger
@@ -40,53 +48,77 @@ class SchedulerService:
             response.reason,
         )
 
+    def _stream(self, endpoint: str) -> Iterator[dict]:
+        """Построчное чтение NDJSON ответа billing api"""
+        with request(
+            method="GET",
+            url=f"{self.billing_api_url}{self.base_endpoint}{endpoint}",
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
     def check_processing_orders(self) -> None:
         """Метод проверки оплаты заказов в обработке"""
         try:
-            processing_orders = self._request(
-                method="GET", endpoint="/orders/processing"
+            total = 0
+            external_ids = (
+                order["external_id"]
+                for order in self._stream("/orders/processing/stream")
             )
-            logger.info("%s orders in processing", len(processing_orders))
-            for order in processing_orders:
-                self.check_order_payment(order_external_id=order.get("external_id"))
-                time.sleep(1)
+            for chunk in chunked(external_ids, self.check_batch_size):
+                total += len(chunk)
+                self.check_orders_payment(orders_external_ids=chunk)
+            logger.info("%s orders in processing", total)
         except Exception as e:
             logger.exception("Error when trying to check processing orders: %s", e)
 
-    def check_order_payment(self, order_external_id: str) -> None:
-        """Метод проверки оплаты заказа"""
+    def check_orders_payment(self, orders_external_ids: list) -> None:
+        """Метод пакетной проверки оплаты заказов"""
         try:
-            self._request(method="GET", endpoint=f"/order/{order_external_id}/check")
+            results = self._request(
+                method="POST",
+                endpoint="/orders/check",
+                data={"external_ids": orders_external_ids},
+            )
+            log_check_results(name="orders", results=results)
         except Exception as e:
             logger.exception(
-                "Error when trying to check payment for order %s: %s",
-                order_external_id,
+                "Error when trying to check payment for %s orders: %s",
+                len(orders_external_ids),
                 e,
             )
 
     def check_processing_refunds(self) -> None:
         """Метод проверки проведения возвратов в обработке"""
         try:
-            processing_refunds_orders = self._request(
-                method="GET", endpoint="/refunds/processing"
+            total = 0
+            external_ids = (
+                refund["external_id"]
+                for refund in self._stream("/refunds/processing/stream")
             )
-            logger.info("%s refunds in processing", len(processing_refunds_orders))
-            for refund_order in processing_refunds_orders:
-                self.check_refund_execution(
-                    refund_external_id=refund_order.get("external_id")
-                )
-                time.sleep(1)
+            for chunk in chunked(external_ids, self.check_batch_size):
+                total += len(chunk)
+                self.check_refunds_execution(refunds_external_ids=chunk)
+            logger.info("%s refunds in processing", total)
         except Exception as e:
             logger.exception("Error when trying to check processing refunds: %s", e)
 
-    def check_refund_execution(self, refund_external_id: str) -> None:
-        """Метод проверки выполнения возврата"""
+    def check_refunds_execution(self, refunds_external_ids: list) -> None:
+        """Метод пакетной проверки выполнения возвратов"""
         try:
-            self._request(method="GET", endpoint=f"/refund/{refund_external_id}/check")
+            results = self._request(
+                method="POST",
+                endpoint="/refunds/check",
+                data={"external_ids": refunds_external_ids},
+            )
+            log_check_results(name="refunds", results=results)
         except Exception as e:
             logger.exception(
-                "Error when trying to check refund execution %s: %s",
-                refund_external_id,
+                "Error when trying to check execution of %s refunds: %s",
+                len(refunds_external_ids),
                 e,
             )
 
@@ -100,39 +132,32 @@ class SchedulerService:
                 "Error when trying to disable expired user subscriptions : %s", e
             )
 
-    def check_expiring_active_subscriptions_automatic(self):
-        """Метод проверки всех активных подписок пользователей, срок действия которых истекает завтра"""
+    def check_expiring_active_subscriptions_automatic(self) -> None:
+        """
+        Метод продления всех активных автоматических подписок, срок действия которых истекает завтра.
+        Billing продлевает подписки страницами с пулом воркеров, повтор страницы безопасен
+        """
         try:
-            expiring_subscriptions = self._request(
-                method="GET", endpoint="/subscriptions/automatic/active"
-            )
-            logger.info("%s subscriptions expire tomorrow", len(expiring_subscriptions))
-            for user_subscription in expiring_subscriptions:
-                self.trying_recurring_payment(
-                    user_id=user_subscription.get("user_id"),
-                    subscription_id=user_subscription.get("subscription_id"),
+            totals: Counter = Counter()
+            started = time.monotonic()
+            cursor = None
+            while True:
+                report = self._request(
+                    method="POST",
+                    endpoint="/subscriptions/automatic/renew"
+                    + (f"?cursor={cursor}" if cursor else ""),
                 )
-            return expiring_subscriptions
-        except Exception as e:
-            logger.exception(
-                "Error when trying to check for expiring subscriptions: %s", e
-            )
-
-    def trying_recurring_payment(self, user_id: str, subscription_id) -> None:
-        """Метод проведения рекурентного платежа"""
-        try:
-            self._request(
-                method="POST",
-                endpoint="/subscription/recurring_payment",
-                data={"user_id": user_id, "subscription_id": subscription_id},
-            )
+                if report is None:
+                    break
+                totals.update(
+                    {counter: report[counter] for counter in RENEWAL_COUNTERS}
+                )
+                cursor = report["next_cursor"]
+                if not cursor:
+                    break
+            log_renewal_results(totals, time.monotonic() - started)
         except Exception as e:
-            logger.exception(
-                "Error when trying recurring payment for user %s / subscription %s: %s",
-                user_id,
-                subscription_id,
-                e,
-            )
+            logger.exception("Error when trying to renew expiring subscriptions: %s", e)
 
     def enable_preactive_user_subscriptions(self) -> None:
         """Метод активации предактивных подпискок"""
@@ -164,4 +189,7 @@ def start_scheduler() -> None:
 
 
 if __name__ == "__main__":
-    start_scheduler()
+    if settings.SCHEDULER_MODE == "async":
+        asyncio.run(start_async_scheduler(billing_settings=settings))
+    else:
+        start_scheduler()
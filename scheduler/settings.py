@@ -10,3 +10,9 @@ class Settings(BaseSettings):
     BILLING_API_BASE_ENDPOINT: str = Field(
         "/api/v1/billing", env="BILLING_API_BASE_ENDPOINT"
     )
+    # sync - последовательный цикл на schedule, async - конкурентный цикл на asyncio
+    SCHEDULER_MODE: str = Field("async", env="SCHEDULER_MODE")
+    SCHEDULER_CONCURRENCY: int = Field(20, env="SCHEDULER_CONCURRENCY")
+    SCHEDULER_CHECK_BATCH_SIZE: int = Field(500, env="SCHEDULER_CHECK_BATCH_SIZE")
+    SCHEDULER_HTTP_POOL_LIMIT: int = Field(20, env="SCHEDULER_HTTP_POOL_LIMIT")
+    SCHEDULER_HTTP_TIMEOUT: float = Field(30, env="SCHEDULER_HTTP_TIMEOUT")